@@ -1,10 +1,11 @@
 # admin.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import date, timedelta
-from sqlalchemy import func, case, or_
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash
-import csv, io
+import heapq, io, json
 from sqlalchemy.exc import IntegrityError
 
 from models import (
@@ -12,10 +13,33 @@ from models import (
     User,
     Student,
     Attendance,
+    AttendanceRollup,
+    AttendanceArchive,
+    AttendanceArchiveExtra,
+    ImportJob,
     SchoolCalendar,
     SchoolYear,
+    school_year_id_for_date,
+    invalidate_school_year_index,
+    calendar_changed,
+    count_school_days,
+    get_school_year_for_date,
 )
-from utils import csv_response, calendar_rows_to_ics, ics_to_calendar_rows, parse_date_any
+from utils import csv_response, csv_stream_response, parse_date_any, ICS_MAX_OCCURRENCES
+from importers import PREVIEW_KEPT, CALENDAR_MODES
+from jobs import enqueue_import, job_to_dict, can_apply, apply_preview, fail_abandoned_jobs
+from rollups import is_whole_months
+import queries
+import analytics
+import archive
+from search import student_match, search_students
+from pagination import paginate, paginate_list
+from calendar_ui import calendar_ics_payload
+from workbooks import attendance_workbook, XLSX_MIMETYPE
+from metrics import get_store as get_metrics_store
+
+# rows fetched per round-trip by streaming exports
+EXPORT_CHUNK = 1000
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -27,7 +51,7 @@ def require_admin():
     if not current_user.is_authenticated:
         return redirect(url_for("auth.login"))
     # Allow any logged-in user (teacher/admin) to access reports
-    if request.endpoint == "admin.reports":
+    if request.endpoint in ("admin.reports", "admin.student_search"):
         return None
     if current_user.role != "admin":
         return ("Forbidden", 403)
@@ -39,16 +63,23 @@ def students():
     q = (request.args.get("q") or "").strip()
     query = Student.query
     if q:
-        like = f"%{q}%"
-        query = query.filter(
-            or_(
-                Student.first_name.ilike(like),
-                Student.last_name.ilike(like),
-                Student.current_grade.ilike(like),
-            )
-        )
-    rows = query.order_by(Student.last_name, Student.first_name).all()
-    return render_template("students.html", rows=rows, q=q)
+        query = query.filter(student_match(q))
+    page = paginate(query, (Student.last_name, Student.first_name, Student.id))
+    return render_template("students.html", rows=page.rows, page=page, q=q)
+
+@admin_bp.route("/students/search.json")
+@login_required
+def student_search():
+    """Typeahead: ?q=jo+sm&limit=10&offset=0[&active=1]. Open to teachers too."""
+    q = (request.args.get("q") or "").strip()
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    rows, has_more = search_students(q, limit, offset, active_only=bool(request.args.get("active")))
+    return jsonify(
+        results=[{"id": s.id, "name": f"{s.last_name}, {s.first_name}", "grade": s.current_grade,
+                  "active": s.active} for s in rows],
+        next_offset=offset + limit if has_more else None,
+    )
 
 @admin_bp.route("/students/new", methods=["GET", "POST"])
 @login_required
@@ -84,6 +115,9 @@ def student_edit(sid):
 @login_required
 def student_delete(sid):
     s = Student.query.get_or_404(sid)
+    # drop the student's attendance (live and archived) and rollups too, rather than leave orphans
+    for model in (Attendance, AttendanceArchive, AttendanceArchiveExtra, AttendanceRollup):
+        model.query.filter_by(student_id=s.id).delete(synchronize_session=False)
     db.session.delete(s)
     db.session.commit()
     flash("Student deleted", "warning")
@@ -110,34 +144,8 @@ def students_import():
             flash("Please choose a .csv file", "danger")
             return redirect(url_for("admin.students_import"))
 
-        stream = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        reader = csv.DictReader(stream)
-        created = updated = 0
-        for row in reader:
-            fn = (row.get("first_name") or "").strip()
-            ln = (row.get("last_name") or "").strip()
-            gr = (row.get("grade") or "").strip() or None
-            act = (row.get("active") or "1").strip()
-            if not fn or not ln:
-                continue
-            rec = Student.query.filter_by(first_name=fn, last_name=ln).first()
-            if rec:
-                rec.current_grade = gr
-                rec.active = act.lower() in ("1", "true", "yes")
-                updated += 1
-            else:
-                db.session.add(
-                    Student(
-                        first_name=fn,
-                        last_name=ln,
-                        current_grade=gr,
-                        active=(act.lower() in ("1", "true", "yes")),
-                    )
-                )
-                created += 1
-        db.session.commit()
-        flash(f"Imported {created} new, updated {updated} students", "success")
-        return redirect(url_for("admin.students"))
+        job = enqueue_import("students_csv", file, user_id=current_user.id)
+        return _job_started(job)
     return render_template("students_import.html")
 
 # ---------- School Years ----------
@@ -156,6 +164,7 @@ def years_new():
         end = date.fromisoformat(request.form["end_date"])
         active = bool(request.form.get("active"))
         db.session.add(SchoolYear(name=name, start_date=start, end_date=end, active=active))
+        invalidate_school_year_index()
         db.session.commit()
         flash("School year created", "success")
         return redirect(url_for("admin.years_list"))
@@ -166,10 +175,16 @@ def years_new():
 def years_edit(yid):
     rec = SchoolYear.query.get_or_404(yid)
     if request.method == "POST":
+        start = date.fromisoformat(request.form["start_date"])
+        end = date.fromisoformat(request.form["end_date"])
+        if rec.compacted_at and (start, end) != (rec.start_date, rec.end_date):
+            flash("This year is archived; its dates can't change (flask expand-year first)", "danger")
+            return redirect(url_for("admin.years_edit", yid=rec.id))
         rec.name = request.form["name"].strip()
-        rec.start_date = date.fromisoformat(request.form["start_date"])
-        rec.end_date = date.fromisoformat(request.form["end_date"])
+        rec.start_date = start
+        rec.end_date = end
         rec.active = bool(request.form.get("active"))
+        invalidate_school_year_index()
         db.session.commit()
         flash("School year updated", "success")
         return redirect(url_for("admin.years_list"))
@@ -179,7 +194,12 @@ def years_edit(yid):
 @login_required
 def years_delete(yid):
     rec = SchoolYear.query.get_or_404(yid)
+    if rec.compacted_at:
+        # the packed archive is the only copy of this year's attendance
+        flash("This year is archived; run flask expand-year before deleting it", "danger")
+        return redirect(url_for("admin.years_list"))
     db.session.delete(rec)
+    invalidate_school_year_index()
     db.session.commit()
     flash("School year deleted", "warning")
     return redirect(url_for("admin.years_list"))
@@ -189,12 +209,12 @@ def years_delete(yid):
 @login_required
 def calendar_list():
     year_id = request.args.get("year_id")
-    q = SchoolCalendar.query
+    q = SchoolCalendar.query.options(joinedload(SchoolCalendar.school_year))
     if year_id:
         q = q.filter(SchoolCalendar.school_year_id == int(year_id))
-    rows = q.order_by(SchoolCalendar.date).all()
+    page = paginate(q, (SchoolCalendar.date, SchoolCalendar.id))
     years = SchoolYear.query.order_by(SchoolYear.start_date).all()
-    return render_template("calendar.html", rows=rows, years=years, year_id=year_id)
+    return render_template("calendar.html", rows=page.rows, page=page, years=years, year_id=year_id)
 
 @admin_bp.route("/calendar/new", methods=["GET", "POST"])
 @login_required
@@ -204,8 +224,7 @@ def calendar_new():
         t = request.form["type"]
         desc = (request.form.get("description") or "").strip() or None
 
-        sy = SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
-        sy_id = sy.id if sy else None
+        sy_id = school_year_id_for_date(d)
 
         rec = SchoolCalendar.query.filter_by(date=d, school_year_id=sy_id).first()
         if not rec:
@@ -213,6 +232,7 @@ def calendar_new():
             db.session.add(rec)
         rec.type = t
         rec.description = desc
+        calendar_changed()
         db.session.commit()
         flash(f"Saved calendar day {d} as {t}", "success")
         return redirect(url_for("admin.calendar_list"))
@@ -230,30 +250,58 @@ def calendar_bulk():
             flash("End date must be on/after start date", "danger")
             return redirect(url_for("admin.calendar_bulk"))
 
-        cur = start
-        cnt = 0
-        while cur <= end:
-            sy = SchoolYear.query.filter(SchoolYear.start_date <= cur, SchoolYear.end_date >= cur).first()
-            sy_id = sy.id if sy else None
-            rec = SchoolCalendar.query.filter_by(date=cur, school_year_id=sy_id).first()
-            if not rec:
-                rec = SchoolCalendar(date=cur, school_year_id=sy_id)
-                db.session.add(rec)
-            rec.type = t
-            rec.description = desc
-            cnt += 1
-            cur += timedelta(days=1)
-
+        picked = request.form.getlist("weekdays")
+        if not picked or not set(picked) <= {str(i) for i in range(7)}:
+            flash("Choose at least one weekday", "danger")
+            return redirect(url_for("admin.calendar_bulk"))
+        weekdays = {int(w) for w in picked}
+        skip_special = bool(request.form.get("skip_non_regular"))
+
+        # one read of what's already there: (date, year) -> id, and the non-Regular dates
+        existing, special = {}, set()
+        for cid, d, sy_id, cur_type in (db.session.query(SchoolCalendar.id, SchoolCalendar.date,
+                                                         SchoolCalendar.school_year_id, SchoolCalendar.type)
+                                        .filter(SchoolCalendar.date >= start, SchoolCalendar.date <= end)):
+            existing[(d, sy_id)] = cid
+            if cur_type != "Regular":
+                special.add(d)
+
+        inserts, updates, skipped = [], [], 0
+        for i in range((end - start).days + 1):
+            d = start + timedelta(days=i)
+            if d.weekday() not in weekdays:
+                continue
+            if skip_special and d in special:
+                skipped += 1
+                continue
+            sy_id = school_year_id_for_date(d)
+            cid = existing.get((d, sy_id))
+            if cid:
+                updates.append({"id": cid, "type": t, "description": desc})
+            else:
+                inserts.append({"date": d, "school_year_id": sy_id, "type": t, "description": desc})
+
+        # NULL school_year_id never conflicts in a unique index, so rather than
+        # ON CONFLICT: one multi-row insert plus one update-by-primary-key batch
+        if inserts:
+            db.session.execute(SchoolCalendar.__table__.insert(), inserts)
+        if updates:
+            db.session.execute(update(SchoolCalendar), updates)
+        calendar_changed()
         db.session.commit()
-        flash(f"Updated {cnt} days as {t}", "success")
+        msg = f"{len(inserts)} days created, {len(updates)} updated as {t}"
+        if skipped:
+            msg += f" ({skipped} non-Regular days left alone)"
+        flash(msg, "success")
         return redirect(url_for("admin.calendar_list"))
-    return render_template("calendar_bulk.html")
+    return render_template("calendar_bulk.html", weekday_names=["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"])
 
 @admin_bp.route("/calendar/<int:cid>/delete", methods=["POST"])
 @login_required
 def calendar_delete(cid):
     rec = SchoolCalendar.query.get_or_404(cid)
     db.session.delete(rec)
+    calendar_changed()
     db.session.commit()
     flash("Calendar entry deleted", "warning")
     return redirect(url_for("admin.calendar_list"))
@@ -270,9 +318,7 @@ def calendar_edit(cid):
         desc = (request.form.get("description") or "").strip() or None
 
         # recompute school year based on the chosen date
-        sy = SchoolYear.query.filter(SchoolYear.start_date <= d,
-                                     SchoolYear.end_date >= d).first()
-        sy_id = sy.id if sy else None
+        sy_id = school_year_id_for_date(d)
 
         # apply changes
         rec.date = d
@@ -281,6 +327,7 @@ def calendar_edit(cid):
         rec.school_year_id = sy_id
 
         try:
+            calendar_changed()
             db.session.commit()
             flash("Calendar day updated", "success")
             return redirect(url_for("admin.calendar_list"))
@@ -299,11 +346,10 @@ def calendar_export():
     end_str = request.args.get("end")
     year_id = request.args.get("year_id")
 
-    q = SchoolCalendar.query
     fname = "school_calendar.ics"
+    start = end = None
 
     if year_id:
-        q = q.filter(SchoolCalendar.school_year_id == int(year_id))
         fname = f"school_calendar_year{year_id}.ics"
 
     if start_str and end_str:
@@ -312,11 +358,9 @@ def calendar_export():
         if end < start:
             flash("End must be on/after start", "danger")
             return redirect(url_for("admin.calendar_list"))
-        q = q.filter(SchoolCalendar.date >= start, SchoolCalendar.date <= end)
         fname = f"school_calendar_{start.isoformat()}_{end.isoformat()}.ics"
 
-    rows = q.order_by(SchoolCalendar.date).all()
-    payload = calendar_rows_to_ics((r.date, r.type, r.description or "") for r in rows)
+    payload = calendar_ics_payload(int(year_id) if year_id else None, start, end)
 
     return send_file(
         io.BytesIO(payload),
@@ -328,52 +372,33 @@ def calendar_export():
 @admin_bp.route("/calendar/import", methods=["GET"])
 @login_required
 def calendar_import_form():
-    return render_template("calendar_import.html")
+    return render_template("calendar_import.html", max_occurrences=ICS_MAX_OCCURRENCES)
 
 @admin_bp.route("/calendar/import", methods=["POST"])
 @login_required
 def calendar_import():
     file = request.files.get("file")
-    mode = (request.form.get("mode") or "merge").lower()  # 'merge' or 'replace'
+    mode = (request.form.get("mode") or "merge").lower()
 
     if not file or not file.filename.lower().endswith(".ics"):
         flash("Please choose a .ics file", "danger")
         return redirect(url_for("admin.calendar_import_form"))
+    if mode not in CALENDAR_MODES:
+        flash("Unknown import mode", "danger")
+        return redirect(url_for("admin.calendar_import_form"))
 
-    ics_bytes = file.stream.read()
-    rows = list(ics_to_calendar_rows(ics_bytes))
-    if not rows:
-        flash("No calendar events found in the .ics.", "warning")
-        return redirect(url_for("admin.calendar_list"))
-
-    # Replace: delete only the (date, year) pairs present in the file
-    if mode == "replace":
-        to_delete = []
-        for d, _t, _desc in rows:
-            sy = SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
-            sy_id = sy.id if sy else None
-            to_delete.append((d, sy_id))
-        for d, sy_id in to_delete:
-            q = SchoolCalendar.query.filter_by(date=d, school_year_id=sy_id)
-            q.delete(synchronize_session=False)
-
-    created = updated = 0
-    for d, t, desc in rows:
-        sy = SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
-        sy_id = sy.id if sy else None
-        rec = SchoolCalendar.query.filter_by(date=d, school_year_id=sy_id).first()
-        if not rec:
-            rec = SchoolCalendar(date=d, school_year_id=sy_id)
-            db.session.add(rec)
-            created += 1
-        else:
-            updated += 1
-        rec.type = t
-        rec.description = desc or None
-
-    db.session.commit()
-    flash(f"Imported {created} new, updated {updated} calendar days", "success")
-    return redirect(url_for("admin.calendar_list"))
+    # optional window: recurring events are expanded only between these dates
+    params = {"mode": mode, "preview": mode == "sync" or bool(request.form.get("preview"))}
+    for key in ("start", "end"):
+        val = (request.form.get(key) or "").strip()
+        if val:
+            try:
+                params[key] = parse_date_any(val).isoformat()
+            except ValueError:
+                flash(f"Invalid {key} date", "danger")
+                return redirect(url_for("admin.calendar_import_form"))
+    job = enqueue_import("calendar_ics", file, params, user_id=current_user.id)
+    return _job_started(job)
 
 # ---------- Calendar CSV import ----------
 @admin_bp.route("/calendar/import_csv", methods=["GET", "POST"])
@@ -388,99 +413,71 @@ def calendar_import_csv():
         if not file or not file.filename.lower().endswith(".csv"):
             flash("Please choose a .csv file", "danger")
             return redirect(url_for("admin.calendar_import_csv"))
+        if mode not in CALENDAR_MODES:
+            flash("Unknown import mode", "danger")
+            return redirect(url_for("admin.calendar_import_csv"))
 
-        stream = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        reader = csv.DictReader(stream)
-        created = updated = skipped = 0
-
-        # CSV header: date,type,description,year
-        for row in reader:
-            try:
-                d = parse_date_any(row.get("date", ""))
-            except Exception:
-                skipped += 1
-                continue
-
-            t = (row.get("type") or "Regular").strip()
-            desc = (row.get("description") or "").strip() or None
-            year_name = (row.get("year") or "").strip()
-
-            # resolve school year
-            if year_name:
-                sy = SchoolYear.query.filter_by(name=year_name).first()
-                if not sy:
-                    flash(f"Unknown school year in CSV: {year_name}", "danger")
-                    return redirect(url_for("admin.calendar_import_csv"))
-            elif target_year_id:
-                sy = SchoolYear.query.get(int(target_year_id))
-            else:
-                sy = SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
-            sy_id = sy.id if sy else None
-
-            if mode == "replace":
-                q = SchoolCalendar.query.filter_by(date=d, school_year_id=sy_id)
-                q.delete(synchronize_session=False)
-
-            rec = SchoolCalendar.query.filter_by(date=d, school_year_id=sy_id).first()
-            if not rec:
-                rec = SchoolCalendar(date=d, school_year_id=sy_id)
-                db.session.add(rec)
-                created += 1
-            else:
-                updated += 1
-            rec.type = t
-            rec.description = desc
-
-        db.session.commit()
-        flash(f"Calendar CSV imported: {created} new, {updated} updated, {skipped} skipped (bad date)", "success")
-        return redirect(url_for("admin.calendar_list"))
+        params = {"target_year_id": int(target_year_id) if target_year_id else None, "mode": mode,
+                  "preview": mode == "sync" or bool(request.form.get("preview"))}
+        job = enqueue_import("calendar_csv", file, params, user_id=current_user.id)
+        return _job_started(job)
 
     return render_template("calendar_import_csv.html", years=years)
 
 # ---------- Attendance CSV export/import ----------
-@admin_bp.route("/attendance/export")
-@login_required
-def attendance_export():
+def _export_range():
+    """(start, end, year_id) from the export request args, or None after flashing why not."""
     start_str = request.args.get("start")
     end_str = request.args.get("end")
     year_id = request.args.get("year_id")
 
     if not start_str or not end_str:
         flash("Provide start and end dates to export attendance", "danger")
-        return redirect(url_for("admin.reports"))
+        return None
 
     start = date.fromisoformat(start_str)
     end = date.fromisoformat(end_str)
     if end < start:
         flash("End must be on/after start", "danger")
+        return None
+    return start, end, int(year_id) if year_id else None
+
+def _export_rows(start, end, yid):
+    """queries.attendance_export rows, streamed in chunks from one joined query
+    (no per-row student/year lazy loads). Compacted years are expanded from the
+    archive and merged in by date.
+    """
+    q = queries.attendance_export(start, end, yid).yield_per(EXPORT_CHUNK)
+    return heapq.merge(q, archive.archived_export(start, end, yid), key=lambda r: r[0])
+
+@admin_bp.route("/attendance/export")
+@login_required
+def attendance_export():
+    rng = _export_range()
+    if rng is None:
         return redirect(url_for("admin.reports"))
+    start, end, yid = rng
 
-    q = db.session.query(Attendance).filter(
-        Attendance.date >= start, Attendance.date <= end
+    data = (
+        [d.isoformat(), ln, fn, (gat or cur or ""), status, notes or "", year_name or ""]
+        for d, ln, fn, gat, cur, status, notes, year_name, _sid in _export_rows(start, end, yid)
     )
-    if year_id:
-        q = q.filter(Attendance.school_year_id == int(year_id))
-    q = q.order_by(Attendance.date, Attendance.student_id)
-
-    data = []
-    for r in q:
-        s = r.student
-        year_name = r.school_year.name if r.school_year else ""
-        grade_out = (r.grade_at_time or s.current_grade or "")
-        data.append(
-            [
-                r.date.isoformat(),
-                s.last_name,
-                s.first_name,
-                grade_out,
-                r.status,
-                r.notes or "",
-                year_name,
-            ]
-        )
     header = ["date", "last_name", "first_name", "grade", "status", "notes", "year"]
     fname = f"attendance_{start.isoformat()}_{end.isoformat()}.csv"
-    return csv_response(data, fname, header, title="Courageous Learners Academy Attendance")
+    return csv_stream_response(data, fname, header, title="Courageous Learners Academy Attendance")
+
+@admin_bp.route("/attendance/export.xlsx")
+@login_required
+def attendance_export_xlsx():
+    """Workbook with a sheet of records per grade and a per-grade/per-student Summary sheet."""
+    rng = _export_range()
+    if rng is None:
+        return redirect(url_for("admin.reports"))
+    start, end, yid = rng
+
+    book = attendance_workbook(_export_rows(start, end, yid), title="Courageous Learners Academy Attendance")
+    return send_file(book, mimetype=XLSX_MIMETYPE, as_attachment=True,
+                     download_name=f"attendance_{start.isoformat()}_{end.isoformat()}.xlsx")
 
 @admin_bp.route("/attendance/import_csv", methods=["GET", "POST"])
 @login_required
@@ -490,64 +487,15 @@ def attendance_import_csv():
         file = request.files.get("file")
         target_year_id = (request.form.get("school_year_id") or "").strip()
 
-        if not file or not file.filename.lower().endswith(".csv"):
-            flash("Please choose a .csv file", "danger")
+        name = file.filename.lower() if file else ""
+        if not name.endswith((".csv", ".xlsx")):
+            flash("Please choose a .csv or .xlsx file", "danger")
             return redirect(url_for("admin.attendance_import_csv"))
 
-        stream = io.StringIO(file.stream.read().decode("utf-8-sig"))
-        reader = csv.DictReader(stream)
-        created = updated = skipped = 0
-
-        # CSV header: date,last_name,first_name,grade,status,notes,year
-        for row in reader:
-            # DATE (robust parse)
-            try:
-                d = parse_date_any(row.get("date", ""))
-            except Exception:
-                skipped += 1  # bad date format
-                continue
-
-            ln = (row.get("last_name") or "").strip()
-            fn = (row.get("first_name") or "").strip()
-            gr = (row.get("grade") or "").strip() or None
-            status = (row.get("status") or "Present").strip()
-            notes = (row.get("notes") or "").strip() or None
-            year_name = (row.get("year") or "").strip()
-
-            # find student by name only
-            s = Student.query.filter_by(last_name=ln, first_name=fn).first()
-            if not s:
-                skipped += 1            # no matching student
-                continue
-
-            # resolve year
-            if year_name:
-                sy = SchoolYear.query.filter_by(name=year_name).first()
-                if not sy:
-                    skipped += 1        # unknown year name
-                    continue
-            elif target_year_id:
-                sy = SchoolYear.query.get(int(target_year_id))
-            else:
-                sy = SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
-            sy_id = sy.id if sy else None
-
-            rec = Attendance.query.filter_by(student_id=s.id, date=d).first()
-            if not rec:
-                rec = Attendance(student_id=s.id, date=d, school_year_id=sy_id)
-                db.session.add(rec)
-                created += 1
-            else:
-                updated += 1
-            rec.status = status
-            rec.notes = notes
-            rec.grade_at_time = gr
-            if sy_id and rec.school_year_id != sy_id:
-                rec.school_year_id = sy_id
-
-        db.session.commit()
-        flash(f"Attendance CSV imported: {created} new, {updated} updated, {skipped} skipped", "success")
-        return redirect(url_for("admin.reports"))
+        params = {"target_year_id": int(target_year_id) if target_year_id else None}
+        kind = "attendance_xlsx" if name.endswith(".xlsx") else "attendance_csv"
+        job = enqueue_import(kind, file, params, user_id=current_user.id)
+        return _job_started(job)
 
     return render_template("attendance_import_csv.html", years=years)
 
@@ -569,56 +517,169 @@ def reports():
     start = date.fromisoformat(start_str) if start_str else None
     end = date.fromisoformat(end_str) if end_str else None
 
-    # Daily summary
-    daily_q = db.session.query(
-        Attendance.status, func.count(Attendance.id)
-    ).filter(Attendance.date == d)
-    daily_records_q = db.session.query(Attendance).filter(Attendance.date == d)
-    if year_id:
-        daily_q = daily_q.filter(Attendance.school_year_id == int(year_id))
-        daily_records_q = daily_records_q.filter(Attendance.school_year_id == int(year_id))
-
-    daily = daily_q.group_by(Attendance.status).all()
-    daily_records = daily_records_q.all()
-
-    # Per-student % over range
-    stats = []
+    yid = int(year_id) if year_id else None
+
+    # Daily summary: one grouped pass for the counts, one page of records
+    # (a day of a compacted year is expanded from the archive, merged with any live
+    # rows of that day, year-less ones say, and paged in memory)
+    archived_day = archive.archived_records(d, d, yid, with_students=True)
+    if archived_day:
+        daily_counts, daily_grades = queries.fold_daily(
+            archive.daily_breakdown_rows(archived_day) + queries.daily_breakdown(d, yid).all())
+        key_of = lambda r: (r.student.last_name, r.student.first_name, r.student_id)
+        day_records = sorted(archived_day + queries.daily_records(d, yid).all(), key=key_of)
+        daily_records = paginate_list(day_records, queries.DAILY_RECORD_KEYS, key_of, prefix="rec_")
+    else:
+        daily_counts, daily_grades = queries.fold_daily(queries.daily_breakdown(d, yid))
+        daily_records = paginate(queries.daily_records(d, yid), queries.DAILY_RECORD_KEYS, prefix="rec_",
+                                 key_of=lambda r: (r.student.last_name, r.student.first_name, r.id))
+
+    # Per-student % over range, names and grades joined in the same query
+    stats, range_grades = [], {}
+    school_days = None
+    by_current_grade = False
     if start and end and end >= start:
-        q = db.session.query(
-            Attendance.student_id,
-            func.sum(case((Attendance.status == 'Present', 1), else_=0)).label("present"),
-            func.count(Attendance.id).label("total"),
-        ).filter(Attendance.date >= start, Attendance.date <= end)
-        if year_id:
-            q = q.filter(Attendance.school_year_id == int(year_id))
-        q = q.group_by(Attendance.student_id)
-
-        for sid, present, total in q:
-            pct = round((present or 0) * 100.0 / total, 1) if total else None
-            stats.append((sid, present or 0, total or 0, pct))
-
-    students_by_id = {s.id: f"{s.last_name}, {s.first_name}" for s in Student.query.all()}
-    years = SchoolYear.query.order_by(SchoolYear.start_date).all()
+        school_days = count_school_days(start, end, yid)
+        by_current_grade = is_whole_months(start, end)
+        if by_current_grade:
+            # whole months: read the precomputed per-month rollups
+            q = queries.student_month_stats(start, end, yid)
+        else:
+            q = queries.student_range_stats(start, end, yid).all()
+            archived = archive.archived_range_stats(start, end, yid)
+            if archived:
+                q = sorted(q + archived, key=lambda r: (r[1], r[2], r[0]))
+        stats, range_grades = queries.fold_stats(q)
 
     return render_template(
         "reports.html",
-        daily=daily,
+        daily_counts=daily_counts,
+        daily_grades=daily_grades,
         daily_records=daily_records,
         day=d,
         stats=stats,
+        range_grades=range_grades,
+        by_current_grade=by_current_grade,
+        school_days=school_days,
         start=start,
         end=end,
-        students_by_id=students_by_id,
-        years=years,
         year_id=year_id,
     )
 
+# ---------- Chronic absence analytics ----------
+def _absence_reports():
+    """(years, selected year_id arg, threshold %, chronic_only, reports) from the request args.
+    year_id "all" runs every year; blank means the current (else the latest) year.
+    """
+    years = SchoolYear.query.order_by(SchoolYear.start_date).all()
+    year_arg = request.args.get("year_id", "")
+    if year_arg == "all":
+        chosen = years
+    else:
+        year = next((y for y in years if str(y.id) == year_arg), None)
+        year = year or get_school_year_for_date(date.today()) or (years[-1] if years else None)
+        chosen = [year] if year else []
+        year_arg = str(year.id) if year else ""
+    try:
+        pct = float(request.args.get("threshold") or current_app.config["CHRONIC_ABSENCE_PCT"])
+    except ValueError:
+        pct = current_app.config["CHRONIC_ABSENCE_PCT"]
+    # the form sends a hidden "0" plus "1" when ticked; no value at all means the default (on)
+    flags = request.args.getlist("chronic_only")
+    chronic_only = "1" in flags if flags else True
+    reports = [analytics.absence_report(y, pct / 100.0) for y in chosen]
+    return years, year_arg, pct, chronic_only, reports
+
+@admin_bp.route("/analytics/absence")
+@login_required
+def absence_analytics():
+    years, year_arg, pct, chronic_only, reports = _absence_reports()
+    return render_template("absence_analytics.html", years=years, year_id=year_arg, threshold=pct,
+                           chronic_only=chronic_only, reports=reports, windows=analytics.WINDOWS,
+                           min_days=analytics.MIN_MARKED_DAYS)
+
+@admin_bp.route("/analytics/absence.csv")
+@login_required
+def absence_analytics_csv():
+    _years, year_arg, pct, chronic_only, reports = _absence_reports()
+    fname = f"chronic_absence_{'all' if year_arg == 'all' else year_arg or 'none'}.csv"
+    return csv_response(analytics.export_rows(reports, chronic_only), fname, analytics.EXPORT_HEADER,
+                        title=f"Chronic absence (threshold {pct:g}% of marked days)")
+
+# ---------- Background import jobs ----------
+# where to go once a job of each kind has finished
+JOB_NEXT = {
+    "attendance_csv": ("admin.reports", "Go to Reports"),
+    "attendance_xlsx": ("admin.reports", "Go to Reports"),
+    "calendar_csv": ("admin.calendar_list", "Back to Calendar"),
+    "calendar_ics": ("admin.calendar_list", "Back to Calendar"),
+    "students_csv": ("admin.students", "Back to Students"),
+}
+
+def _job_started(job):
+    """Response for an import route once its job is queued (or finished, if inline)."""
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job_id=job.id, status=job.status,
+                       status_url=url_for("admin.job_status", job_id=job.id)), 202
+    flash(f"Import queued as job #{job.id}", "info")
+    return redirect(url_for("admin.job_detail", job_id=job.id))
+
+@admin_bp.route("/jobs")
+@login_required
+def jobs_list():
+    fail_abandoned_jobs()
+    rows = ImportJob.query.order_by(ImportJob.id.desc()).limit(50).all()
+    return render_template("jobs.html", rows=rows)
+
+@admin_bp.route("/jobs/<int:job_id>")
+@login_required
+def job_detail(job_id):
+    fail_abandoned_jobs()
+    job = ImportJob.query.get_or_404(job_id)
+    rejects = json.loads(job.rejects) if job.rejects else []
+    changes = json.loads(job.preview) if job.preview else []
+    return render_template("job.html", job=job, rejects=rejects, changes=changes,
+                           can_apply=can_apply(job), preview_kept=PREVIEW_KEPT,
+                           next_link=JOB_NEXT.get(job.kind))
+
+@admin_bp.route("/jobs/<int:job_id>/apply", methods=["POST"])
+@login_required
+def job_apply(job_id):
+    job = ImportJob.query.get_or_404(job_id)
+    if not can_apply(job):
+        flash("This preview can no longer be applied; upload the file again.", "warning")
+        return redirect(url_for("admin.job_detail", job_id=job.id))
+    return _job_started(apply_preview(job, user_id=current_user.id))
+
+@admin_bp.route("/jobs/<int:job_id>.json")
+@login_required
+def job_status(job_id):
+    fail_abandoned_jobs()
+    return jsonify(job_to_dict(ImportJob.query.get_or_404(job_id)))
+
+# ---------- Request metrics (METRICS_ENABLED) ----------
+@admin_bp.route("/metrics")
+@login_required
+def metrics_page():
+    store = get_metrics_store()
+    return render_template("metrics.html", enabled=store is not None,
+                           rows=store.summary() if store else [],
+                           budget=current_app.config.get("METRICS_QUERY_BUDGET"))
+
+@admin_bp.route("/metrics.json")
+@login_required
+def metrics_json():
+    store = get_metrics_store()
+    return jsonify(enabled=store is not None,
+                   query_budget=current_app.config.get("METRICS_QUERY_BUDGET"),
+                   endpoints=store.summary() if store else [])
+
 # ---------- Users (admin-managed) ----------
 @admin_bp.route("/users")
 @login_required
 def users_list():
-    rows = User.query.order_by(User.username).all()
-    return render_template("users.html", rows=rows)
+    page = paginate(User.query, (User.username, User.id))
+    return render_template("users.html", rows=page.rows, page=page)
 
 @admin_bp.route("/users/new", methods=["GET", "POST"])
 @login_required
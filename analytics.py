@@ -0,0 +1,250 @@
+# analytics.py
+"""Chronic-absenteeism analytics.
+
+A school year's attendance is loaded with one query into a student x school-day
+matrix of status codes (plus a small roster query for the names). The columns
+are the school days from the calendar (models.iter_school_days). Every measure
+is then a handful of whole-array NumPy passes, so a whole-school, multi-year
+run costs two queries per year and no per-student Python loops.
+
+A day a student has no record for (not enrolled yet, left, not taken) counts as
+neither present nor absent: rates are over the days actually marked. Records on
+days the calendar says were not school days are left out.
+"""
+from dataclasses import dataclass
+from datetime import date
+
+import numpy as np
+from sqlalchemy import String, case, cast, select
+
+import archive
+from models import db, Attendance, Student, iter_school_days
+
+# matrix cell codes
+NO_RECORD, PRESENT, ABSENT, TARDY, OTHER = 0, 1, 2, 3, 4
+_CODES = {"Present": PRESENT, "Absent": ABSENT, "Tardy": TARDY}
+
+WINDOWS = (10, 30)  # rolling windows, in school days
+MIN_MARKED_DAYS = 10  # fewer marked days than this: too early to flag a student
+FETCH_ROWS = 500  # records per fetch; larger chunks get promoted and trigger full GC passes
+
+
+@dataclass
+class YearMatrix:
+    year: object             # SchoolYear
+    days: np.ndarray         # datetime64[D] school days, one per column
+    student_ids: np.ndarray  # one per row, ascending
+    last_names: list
+    first_names: list
+    grades: list             # current grade
+    cells: np.ndarray        # int8 status codes, students x days
+
+
+@dataclass
+class AbsenceReport:
+    year: object
+    school_days: int
+    threshold: float         # chronic when rate >= threshold (a fraction)
+    student_ids: np.ndarray
+    last_names: list
+    first_names: list
+    grades: list
+    marked: np.ndarray       # days with a record
+    absent: np.ndarray
+    tardy: np.ndarray
+    rate: np.ndarray         # absent / marked, NaN when nothing marked
+    latest: dict             # window -> absence rate over the last `window` school days
+    peak: dict               # window -> worst rate over any `window` school days
+    longest_streak: np.ndarray  # most consecutive school days absent
+    chronic: np.ndarray      # bool
+
+    def rows(self, chronic_only: bool = False):
+        """Per-student dicts, chronic first, then by absence rate (highest first)."""
+        rate = np.nan_to_num(self.rate, nan=-1.0)
+        order = np.lexsort((-rate, ~self.chronic))
+        for i in order:
+            if chronic_only and not self.chronic[i]:
+                continue
+            yield {
+                "student_id": int(self.student_ids[i]),
+                "last_name": self.last_names[i],
+                "first_name": self.first_names[i],
+                "grade": self.grades[i] or "",
+                "marked": int(self.marked[i]),
+                "absent": int(self.absent[i]),
+                "tardy": int(self.tardy[i]),
+                "rate": _pct(self.rate[i]),
+                **{f"latest_{w}": _pct(r[i]) for w, r in self.latest.items()},
+                **{f"peak_{w}": _pct(r[i]) for w, r in self.peak.items()},
+                "longest_streak": int(self.longest_streak[i]),
+                "chronic": bool(self.chronic[i]),
+            }
+
+
+def _pct(x):
+    return None if np.isnan(x) else round(float(x) * 100, 1)
+
+
+def load_year_matrix(year, as_of: date | None = None) -> YearMatrix:
+    """Attendance of one school year (up to as_of, default today) as a status matrix."""
+    end = min(year.end_date, as_of or date.today())
+    days = np.array(list(iter_school_days(year.start_date, end, year.id)), dtype="datetime64[D]")
+    live = _live_year_matrix(year, days, end)
+    if year.compacted_at:
+        return _merge_matrices(_archived_year_matrix(year, days), live)
+    return live
+
+
+def _live_year_matrix(year, days, end) -> YearMatrix:
+    """load_year_matrix over the year's Attendance rows."""
+    # three narrow columns per record (status already coded) keep the fetch cheap
+    code = case(*[(Attendance.status == label, c) for label, c in _CODES.items()], else_=OTHER)
+    in_year = (Attendance.school_year_id == year.id,
+               Attendance.date >= year.start_date, Attendance.date <= end)
+    conn = db.session.connection()  # Core rows: no ORM result processing per record
+    # fetched and turned into arrays a small chunk at a time: the row tuples die
+    # young, so the cyclic GC never has to sweep a whole year of them
+    result = conn.execute(
+        select(Attendance.student_id, cast(Attendance.date, String), code).where(*in_year))
+    sid_parts, date_parts, code_parts = [], [], []
+    while part := result.fetchmany(FETCH_ROWS):
+        sids, dates, codes = zip(*part)
+        sid_parts.append(np.array(sids, np.int64))
+        # ISO strings parse straight into datetime64
+        date_parts.append(np.array(dates, dtype="datetime64[D]"))
+        code_parts.append(np.array(codes, np.int8))
+    if not sid_parts or not len(days):
+        return YearMatrix(year, days, np.empty(0, np.int64), [], [], [],
+                          np.zeros((0, len(days)), np.int8))
+    sids, dates, codes = np.concatenate(sid_parts), np.concatenate(date_parts), np.concatenate(code_parts)
+
+    student_ids, row = np.unique(sids, return_inverse=True)
+    # drop records off the school-day columns
+    col = np.minimum(np.searchsorted(days, dates), len(days) - 1)
+    keep = days[col] == dates
+
+    cells = np.zeros((len(student_ids), len(days)), np.int8)
+    cells[row[keep], col[keep]] = codes[keep]
+
+    # names for the matrix rows: one small roster query
+    roster = dict((sid, (last, first, grade)) for sid, last, first, grade in conn.execute(
+        select(Student.id, Student.last_name, Student.first_name, Student.current_grade)
+        .where(Student.id.in_(select(Attendance.student_id).where(*in_year).distinct()))))
+    lasts, firsts, grades = zip(*(roster[int(sid)] for sid in student_ids))
+    return YearMatrix(year, days, student_ids, list(lasts), list(firsts), list(grades), cells)
+
+
+def _archived_year_matrix(year, days) -> YearMatrix:
+    """load_year_matrix for a compacted year: the packed codes already are the
+    matrix (same 1-3 codes); extras holding other statuses become OTHER.
+    """
+    sids, _grades, first, codes = archive.year_codes(year)
+    cols = (days - np.datetime64(first, "D")).astype(int)
+    cells = codes[:, cols].astype(np.int8)
+    for (sid, d), (status, *_rest) in archive.archived_extras(year, year.start_date, year.end_date).items():
+        col = np.searchsorted(days, np.datetime64(d, "D"))
+        if status and col < len(days) and days[col] == np.datetime64(d, "D"):
+            cells[np.searchsorted(sids, sid), col] = OTHER
+    students = archive.archived_students([year.id])
+    roster = [students.get(int(sid)) for sid in sids]
+    return YearMatrix(year, days, sids,
+                      [s.last_name if s else "" for s in roster], [s.first_name if s else "" for s in roster],
+                      [s.current_grade if s else None for s in roster], cells)
+
+
+def _merge_matrices(base: YearMatrix, over: YearMatrix) -> YearMatrix:
+    """base with the marked cells of over (same year and days) laid on top."""
+    if not len(over.student_ids):
+        return base
+    student_ids = np.union1d(base.student_ids, over.student_ids)
+    cells = np.zeros((len(student_ids), len(base.days)), np.int8)
+    cells[np.searchsorted(student_ids, base.student_ids)] = base.cells
+    rows = np.searchsorted(student_ids, over.student_ids)
+    cells[rows] = np.where(over.cells != 0, over.cells, cells[rows])
+    names = {}
+    for m in (base, over):
+        names.update(zip(m.student_ids.tolist(), zip(m.last_names, m.first_names, m.grades)))
+    lasts, firsts, grades = zip(*(names[sid] for sid in student_ids.tolist()))
+    return YearMatrix(base.year, base.days, student_ids, list(lasts), list(firsts), list(grades), cells)
+
+
+def rolling_rates(hits: np.ndarray, marked: np.ndarray, window: int, min_marked: int | None = None):
+    """Rate of hits over every run of `window` consecutive days (columns), per row.
+    A window with fewer than min_marked (default half the window) marked days is NaN.
+    With fewer days than the window, the whole span is one window.
+    """
+    n_days = hits.shape[1]
+    window = max(1, min(window, n_days))
+    min_marked = window // 2 if min_marked is None else min_marked
+    zero = np.zeros((hits.shape[0], 1), np.int32)
+    h = np.concatenate([zero, np.cumsum(hits, axis=1, dtype=np.int32)], axis=1)
+    m = np.concatenate([zero, np.cumsum(marked, axis=1, dtype=np.int32)], axis=1)
+    h = h[:, window:] - h[:, :-window]
+    m = m[:, window:] - m[:, :-window]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where((m > 0) & (m >= min_marked), h / m, np.nan)
+
+
+def longest_runs(mask: np.ndarray) -> np.ndarray:
+    """Longest run of consecutive True values in each row."""
+    if mask.shape[1] == 0:
+        return np.zeros(mask.shape[0], np.int32)
+    count = np.cumsum(mask, axis=1, dtype=np.int32)
+    # count at the last False before each position; run length = count - that
+    reset = np.maximum.accumulate(np.where(mask, 0, count), axis=1)
+    return (count - reset).max(axis=1)
+
+
+def _nanmax(a: np.ndarray) -> np.ndarray:
+    if a.shape[1] == 0:
+        return np.full(a.shape[0], np.nan)
+    best = np.where(np.isnan(a), -1.0, a).max(axis=1)
+    return np.where(best < 0, np.nan, best)
+
+
+def absence_report(year, threshold: float, as_of: date | None = None) -> AbsenceReport:
+    """Chronic-absence measures for one school year; threshold is a fraction (0.10 = 10%)."""
+    mx = load_year_matrix(year, as_of)
+    cells = mx.cells
+    absent_days = cells == ABSENT
+    marked_days = cells != NO_RECORD
+
+    marked = marked_days.sum(axis=1)
+    absent = absent_days.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(marked > 0, absent / marked, np.nan)
+
+    latest, peak = {}, {}
+    for w in WINDOWS:
+        r = rolling_rates(absent_days, marked_days, w)
+        latest[w] = r[:, -1] if r.shape[1] else np.full(len(marked), np.nan)
+        peak[w] = _nanmax(r)
+
+    return AbsenceReport(
+        year=year, school_days=len(mx.days), threshold=threshold,
+        student_ids=mx.student_ids, last_names=mx.last_names, first_names=mx.first_names, grades=mx.grades,
+        marked=marked, absent=absent, tardy=(cells == TARDY).sum(axis=1), rate=rate,
+        latest=latest, peak=peak, longest_streak=longest_runs(absent_days),
+        chronic=(marked >= MIN_MARKED_DAYS) & (np.nan_to_num(rate) >= threshold),
+    )
+
+
+# CSV export columns, in order (see AbsenceReport.rows)
+EXPORT_HEADER = (["year", "student_id", "last_name", "first_name", "grade", "days_marked", "absent",
+                  "tardy", "absence_rate_pct"]
+                 + [f"last_{w}_days_pct" for w in WINDOWS] + [f"worst_{w}_days_pct" for w in WINDOWS]
+                 + ["longest_absence_streak", "chronic"])
+
+
+def export_rows(reports, chronic_only: bool = False):
+    """CSV rows (EXPORT_HEADER order) for a list of AbsenceReports."""
+    for rep in reports:
+        for r in rep.rows(chronic_only):
+            yield ([rep.year.name, r["student_id"], r["last_name"], r["first_name"], r["grade"],
+                    r["marked"], r["absent"], r["tardy"], _blank(r["rate"])]
+                   + [_blank(r[f"latest_{w}"]) for w in WINDOWS] + [_blank(r[f"peak_{w}"]) for w in WINDOWS]
+                   + [r["longest_streak"], "yes" if r["chronic"] else "no"])
+
+
+def _blank(v):
+    return "" if v is None else v
@@ -1,14 +1,46 @@
 import os
-from flask import Flask, render_template, redirect, url_for
+from datetime import date
+import click
+from flask import Flask, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import LoginManager, current_user, login_required
 from werkzeug.security import generate_password_hash
-from models import db, User
+from models import db, User, calendar_changed, sync_cache_versions
 from config import Config
 from auth import auth_bp
 from admin import admin_bp
 from teacher import teacher_bp
-from sqlalchemy import text
+from sqlalchemy import text, inspect, select, update, func, event
+from sqlalchemy.orm import aliased
 from calendar_ui import calendar_ui
+from metrics import init_metrics
+
+def _is_sqlite(app) -> bool:
+    return app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite")
+
+def _apply_db_profile(app):
+    """Engine options (before init_app) for the configured DB_PROFILE."""
+    if app.config.get("DB_PROFILE") == "off" or _is_sqlite(app):
+        return
+    opts = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    opts.setdefault("pool_pre_ping", True)
+    opts.setdefault("pool_size", app.config["DB_POOL_SIZE"])
+    opts.setdefault("max_overflow", app.config["DB_MAX_OVERFLOW"])
+    opts.setdefault("pool_recycle", app.config["DB_POOL_RECYCLE"])
+
+def _install_sqlite_pragmas(app):
+    """Run SQLITE_PRAGMAS on every new SQLite connection."""
+    if app.config.get("DB_PROFILE") == "off" or not _is_sqlite(app):
+        return
+    pragmas = app.config["SQLITE_PRAGMAS"]
+
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+    with app.app_context():
+        event.listen(db.engine, "connect", on_connect)
 
 def create_app():
     app = Flask(__name__, instance_relative_config=True, static_folder="static", template_folder="templates")
@@ -18,7 +50,17 @@ def create_app():
     os.makedirs(app.instance_path, exist_ok=True)
 
     # SQLAlchemy
+    _apply_db_profile(app)
     db.init_app(app)
+    _install_sqlite_pragmas(app)
+    init_metrics(app)
+
+    # calendar/school-year caches: pick up changes made by other processes,
+    # at most every CACHE_SYNC_S (so most feed revalidations don't touch the DB)
+    @app.before_request
+    def _sync_caches():
+        if request.endpoint != "static":
+            sync_cache_versions(app.config["CACHE_SYNC_S"])
 
     # Login
     login_manager = LoginManager()
@@ -35,6 +77,15 @@ def create_app():
     app.register_blueprint(teacher_bp)
     app.register_blueprint(calendar_ui)
 
+    @app.errorhandler(413)
+    def upload_too_large(_e):
+        limit_mb = app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)
+        msg = f"File too large (limit {limit_mb} MB). Split it or raise MAX_UPLOAD_MB."
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(error=msg), 413
+        flash(msg, "danger")
+        return redirect(request.referrer or url_for("dashboard"))
+
     # Simple dashboard
     @app.route("/")
     @login_required
@@ -69,11 +120,12 @@ def create_app():
     @app.cli.command("upgrade-db")
     def upgrade_db():
         """Create new tables + add missing columns (SQLite-safe)."""
+        engine = db.engine  # <- reliable in Flask-SQLAlchemy 3.x
+        had_rollups = inspect(engine).has_table("attendance_rollup")
+
         # Ensure tables exist first
         db.create_all()
 
-        engine = db.engine  # <- reliable in Flask-SQLAlchemy 3.x
-
         def has_col(table: str, col: str) -> bool:
             with engine.connect() as conn:
                 rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
@@ -103,21 +155,212 @@ def create_app():
             if not has_col("attendance", "school_year_id"):
                 conn.exec_driver_sql("ALTER TABLE attendance ADD COLUMN school_year_id INTEGER")
 
+            # student.name_key (normalized name used by the importers), filled below
+            if not has_col("student", "name_key"):
+                conn.exec_driver_sql("ALTER TABLE student ADD COLUMN name_key VARCHAR(210)")
+
+            # school_year.compacted_at (archived years, see archive.py)
+            if not has_col("school_year", "compacted_at"):
+                conn.exec_driver_sql("ALTER TABLE school_year ADD COLUMN compacted_at DATETIME")
+
+            # import_job.preview (calendar import diffs)
+            if not has_col("import_job", "preview"):
+                conn.exec_driver_sql("ALTER TABLE import_job ADD COLUMN preview TEXT")
+
+            # import_job.owner / heartbeat_at (job leases, see jobs.py)
+            if not has_col("import_job", "owner"):
+                conn.exec_driver_sql("ALTER TABLE import_job ADD COLUMN owner VARCHAR(120)")
+            if not has_col("import_job", "heartbeat_at"):
+                conn.exec_driver_sql("ALTER TABLE import_job ADD COLUMN heartbeat_at DATETIME")
+
+        # backfill name_key wherever it's missing or stale
+        from models import Student, student_name_key
+        stale = [{"id": sid, "name_key": student_name_key(fn, ln)}
+                 for sid, fn, ln, key in db.session.query(Student.id, Student.first_name,
+                                                          Student.last_name, Student.name_key)
+                 if key != student_name_key(fn, ln)]
+        if stale:
+            db.session.execute(update(Student), stale)
+            db.session.commit()
+            print(f"upgrade-db: set name_key on {len(stale)} students")
+
+        # SQLite full-text index for student search (see search.py)
+        from search import install_student_search
+        with engine.begin() as conn:
+            if install_student_search(conn):
+                print("upgrade-db: student search index rebuilt")
+
+        # indexes added to existing tables (create_all only covers new tables)
+        with engine.begin() as conn:
+            for name in ("ix_attendance_date_status_year", "ix_attendance_date_student_status",
+                         "ix_attendance_year_date_student_status"):  # superseded by the *_grade ones
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+        if not had_rollups:
+            from rollups import rebuild_rollups
+            print(f"upgrade-db: built {rebuild_rollups()} attendance rollup rows")
+
         print("upgrade-db: schema updated")
 
     @app.cli.command("backfill-years")
-    def backfill_years():
-        """Set attendance.school_year_id based on date + SchoolYear ranges."""
-        from models import Attendance, SchoolYear
-
-        updated = 0
-        for r in Attendance.query.filter(Attendance.school_year_id.is_(None)).all():
-            sy = SchoolYear.query.filter(SchoolYear.start_date <= r.date,
-                                         SchoolYear.end_date >= r.date).first()
-            if sy:
-                r.school_year_id = sy.id
-                updated += 1
-        db.session.commit()
-        print(f"backfill-years: set year for {updated} attendance rows")
+    @click.option("--dry-run", is_flag=True, help="Only count the rows that would be set.")
+    @click.option("--chunk-size", default=5000, show_default=True, help="Rows per UPDATE (by id range).")
+    def backfill_years(dry_run, chunk_size):
+        """Set attendance/calendar school_year_id based on date + SchoolYear ranges."""
+        from models import Attendance, SchoolCalendar, SchoolYear
+
+        def covering_year(model):
+            # same tie-break as models.school_year_id_for_date: latest start wins
+            return (select(SchoolYear.id)
+                    .where(SchoolYear.start_date <= model.date, SchoolYear.end_date >= model.date)
+                    .order_by(SchoolYear.start_date.desc(), SchoolYear.id.desc())
+                    .limit(1)
+                    .correlate(model)
+                    .scalar_subquery())
+
+        def backfill(model, extra=lambda year: ()):
+            label = model.__tablename__
+            year = covering_year(model)
+            where = [model.school_year_id.is_(None), year.is_not(None), *extra(year)]
+            todo = db.session.scalar(select(func.count(model.id)).where(*where))
+            if dry_run or not todo:
+                print(f"backfill-years: {label}: {todo} rows {'would be set' if dry_run else 'set'}")
+                return 0
+
+            lo, hi = db.session.execute(
+                select(func.min(model.id), func.max(model.id)).where(model.school_year_id.is_(None))
+            ).one()
+            done = 0
+            for start in range(lo, hi + 1, chunk_size):
+                res = db.session.execute(
+                    update(model)
+                    .where(model.id >= start, model.id < start + chunk_size, *where)
+                    .values(school_year_id=year)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+                done += res.rowcount
+                print(f"backfill-years: {label}: {done}/{todo}")
+            return done
+
+        # a compacted year is read-only: its attendance lives in the archive, and a
+        # live row filed under it would drop out of its rollups and analytics
+        compacted = lambda year: (select(SchoolYear.id)
+                                  .where(SchoolYear.id == year, SchoolYear.compacted_at.is_not(None))
+                                  .exists())
+        skipped = db.session.scalar(select(func.count(Attendance.id)).where(
+            Attendance.school_year_id.is_(None), compacted(covering_year(Attendance))))
+        if skipped:
+            print(f"backfill-years: attendance: {skipped} rows left unset, their year is compacted "
+                  "(flask expand-year first)")
+        updated = backfill(Attendance, extra=lambda year: (~compacted(year),))
+        # a calendar row can't take a year that already has an entry for that date,
+        # and of several year-less rows on one date only the first (lowest id) is set
+        other = aliased(SchoolCalendar)
+        backfill(SchoolCalendar, extra=lambda year: (
+            ~select(other.id).where(other.date == SchoolCalendar.date, other.school_year_id == year)
+            .correlate(SchoolCalendar).exists(),
+            SchoolCalendar.id == select(func.min(other.id))
+            .where(other.date == SchoolCalendar.date, other.school_year_id.is_(None))
+            .correlate(SchoolCalendar).scalar_subquery(),
+        ))
+        if not dry_run:
+            calendar_changed()  # year-scoped school-day bitmaps in running servers
+            db.session.commit()
+
+        if updated:
+            from rollups import rebuild_rollups
+            rebuild_rollups()
+
+    @app.cli.command("db-pragmas")
+    def db_pragmas():
+        """Show the database settings in effect on a fresh connection."""
+        print(f"db-pragmas: profile={app.config.get('DB_PROFILE')} dialect={db.engine.dialect.name}")
+        if not _is_sqlite(app):
+            for name, value in app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}).items():
+                print(f"  {name} = {value}")
+            return
+        with db.engine.connect() as conn:
+            for name in app.config["SQLITE_PRAGMAS"]:
+                value = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                print(f"  {name} = {value}")
+
+    @app.cli.command("explain-queries")
+    @click.option("--date", "day", default=None, help="Day for the daily queries (default today).")
+    @click.option("--year-id", type=int, default=None, help="Also filter by school year.")
+    def explain_queries(day, year_id):
+        """Print the query plan of each report/export query."""
+        import queries
+
+        d = date.fromisoformat(day) if day else date.today()
+        start, end = d.replace(month=1, day=1), d.replace(month=12, day=31)
+        plans = {
+            "daily breakdown": queries.daily_breakdown(d, year_id),
+            "daily records": queries.daily_records(d, year_id).order_by(*queries.DAILY_RECORD_KEYS),
+            "per-student range stats": queries.student_range_stats(start, end, year_id),
+            "per-student month stats": queries.student_month_stats(start, end, year_id),
+            "attendance export": queries.attendance_export(start, end, year_id),
+        }
+        sqlite = _is_sqlite(app)
+        with db.engine.connect() as conn:
+            for label, q in plans.items():
+                compiled = q.statement.compile(dialect=db.engine.dialect)
+                print(f"== {label}")
+                if sqlite:
+                    params = tuple(compiled.params[k] for k in compiled.positiontup)
+                    params = tuple(v.isoformat() if isinstance(v, date) else v for v in params)
+                    for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params):
+                        print(f"  {row[-1]}")
+                else:
+                    for row in conn.execute(text(f"EXPLAIN {compiled}"), compiled.params):
+                        print(f"  {row[0]}")
+
+    def _cli_year(ref):
+        from models import SchoolYear
+        year = SchoolYear.query.filter_by(name=ref).first()
+        if year is None and ref.isdigit():
+            year = db.session.get(SchoolYear, int(ref))
+        if year is None:
+            raise click.ClickException(f"no school year {ref!r}")
+        return year
+
+    @app.cli.command("compact-year")
+    @click.argument("year")
+    @click.option("--force", is_flag=True, help="Compact even if the year hasn't ended yet.")
+    def compact_year_cmd(year, force):
+        """Pack a closed school year's attendance into per-student vectors (YEAR = name or id)."""
+        from archive import compact_year
+        sy = _cli_year(year)
+        if sy.end_date >= date.today() and not force:
+            raise click.ClickException(f"{sy.name} hasn't ended yet (use --force to compact anyway)")
+        try:
+            stats = compact_year(sy)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        print(f"compact-year: {sy.name}: {stats['records']} attendance rows -> {stats['students']} "
+              f"packed rows ({stats['packed_bytes']} bytes of codes) + {stats['extras']} extras")
+        if _is_sqlite(app):
+            print("compact-year: run VACUUM to return the freed pages to the filesystem")
+
+    @app.cli.command("expand-year")
+    @click.argument("year")
+    def expand_year_cmd(year):
+        """Turn a compacted school year back into editable attendance rows (YEAR = name or id)."""
+        from archive import expand_year
+        sy = _cli_year(year)
+        try:
+            n = expand_year(sy)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        print(f"expand-year: {sy.name}: restored {n} attendance rows")
+
+    @app.cli.command("rebuild-rollups")
+    def rebuild_rollups_cmd():
+        """Recompute the per-student monthly attendance rollups from scratch."""
+        from rollups import rebuild_rollups
+        print(f"rebuild-rollups: {rebuild_rollups()} rollup rows")
 
     return app
@@ -0,0 +1,337 @@
+# archive.py
+"""Compact storage for closed school years.
+
+`flask compact-year` moves a year's Attendance rows into one AttendanceArchive
+row per student: a status code for every calendar day of the year packed 2 bits
+to a day (0 = no record, 1 Present, 2 Absent, 3 Tardy), so a whole year is
+about 92 bytes per student instead of a row per day. Notes, other statuses and
+per-day grade changes go to the sparse AttendanceArchiveExtra table.
+
+A compacted year is read-only: saves and imports into it are refused until
+`flask expand-year` puts the rows back. The readers below expand what a report
+or export asks for on demand; callers merge them with whatever live rows fall
+on the same days (year-less ones, say). The monthly rollups of a compacted year are kept
+as they were, so whole-month reports don't need to expand anything.
+"""
+from collections import Counter, namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import String, cast, delete, insert, select
+
+from models import (db, Attendance, AttendanceArchive, AttendanceArchiveExtra, AttendanceRollup,
+                    SchoolYear, Student)
+
+CODES = {"Present": 1, "Absent": 2, "Tardy": 3}
+STATUS_OF = {v: k for k, v in CODES.items()}
+
+# one expanded day, in the shape of an Attendance row
+ArchivedRecord = namedtuple("ArchivedRecord",
+                            "student_id date status notes grade_at_time school_year_id student")
+
+INSERT_BATCH = 5000
+
+
+# -------- Packing --------
+def pack_codes(codes: np.ndarray) -> np.ndarray:
+    """(students, days) codes 0-3 -> (students, ceil(days / 4)) bytes, day i in bits 2*(i % 4)."""
+    n, days = codes.shape
+    padded = np.zeros((n, -(-days // 4) * 4), np.uint8)
+    padded[:, :days] = codes
+    quads = padded.reshape(n, -1, 4)
+    return quads[:, :, 0] | quads[:, :, 1] << 2 | quads[:, :, 2] << 4 | quads[:, :, 3] << 6
+
+
+def unpack_codes(packed: np.ndarray, days: int) -> np.ndarray:
+    """Inverse of pack_codes: (students, bytes) -> (students, days) codes."""
+    shifts = np.array([0, 2, 4, 6], np.uint8)
+    codes = (packed[:, :, None] >> shifts) & 3
+    return codes.reshape(packed.shape[0], -1)[:, :days]
+
+
+# -------- Which years --------
+def compacted_years(start: date | None = None, end: date | None = None, year_id: int | None = None):
+    """Compacted SchoolYears overlapping [start, end] (and matching year_id, if given)."""
+    q = SchoolYear.query.filter(SchoolYear.compacted_at.isnot(None))
+    if start:
+        q = q.filter(SchoolYear.end_date >= start)
+    if end:
+        q = q.filter(SchoolYear.start_date <= end)
+    if year_id:
+        q = q.filter(SchoolYear.id == year_id)
+    return q.order_by(SchoolYear.start_date).all()
+
+
+def is_compacted(year_id: int | None) -> bool:
+    return bool(year_id) and db.session.query(
+        select(SchoolYear.id).where(SchoolYear.id == year_id, SchoolYear.compacted_at.isnot(None)).exists()
+    ).scalar()
+
+
+# -------- Readers --------
+def year_codes(year):
+    """(student_ids, grades, first day, codes) for a compacted year: codes is a
+    (students, days) uint8 matrix with a column per calendar day from first day.
+    """
+    q = (select(AttendanceArchive.student_id, AttendanceArchive.start_date, AttendanceArchive.days,
+                AttendanceArchive.codes, AttendanceArchive.grade)
+         .where(AttendanceArchive.school_year_id == year.id)
+         .order_by(AttendanceArchive.student_id))
+    rows = db.session.execute(q).all()
+    first = year.start_date
+    days = (year.end_date - first).days + 1
+    codes = np.zeros((len(rows), days), np.uint8)
+    for i, (_sid, start, n, blob, _grade) in enumerate(rows):
+        row = unpack_codes(np.frombuffer(blob, np.uint8)[None, :], n)[0]
+        # rows are written with the year's own range; clip in case the year was edited since
+        lo = (start - first).days
+        a, b = max(lo, 0), min(lo + n, days)
+        if a < b:
+            codes[i, a:b] = row[a - lo:b - lo]
+    return (np.array([r[0] for r in rows], np.int64), [r[4] for r in rows], first, codes)
+
+
+def archived_extras(year, start: date, end: date):
+    """(student_id, date) -> (status, notes, grade_at_time, grade_differs) in [start, end]."""
+    q = (select(AttendanceArchiveExtra.student_id, AttendanceArchiveExtra.date, AttendanceArchiveExtra.status,
+                AttendanceArchiveExtra.notes, AttendanceArchiveExtra.grade_at_time,
+                AttendanceArchiveExtra.grade_differs)
+         .where(AttendanceArchiveExtra.school_year_id == year.id,
+                AttendanceArchiveExtra.date >= start, AttendanceArchiveExtra.date <= end))
+    return {(sid, d): rest for sid, d, *rest in db.session.execute(q)}
+
+
+def archived_students(year_ids):
+    """id -> Student for everyone archived in the given years (one query)."""
+    archived = select(AttendanceArchive.student_id).where(AttendanceArchive.school_year_id.in_(year_ids))
+    return {s.id: s for s in Student.query.filter(Student.id.in_(archived))}
+
+
+def archived_records(start: date, end: date, year_id: int | None = None, with_students: bool = False):
+    """Expanded records of the compacted years in [start, end], in (date, student_id)
+    order. with_students also loads each record's Student (one query).
+    """
+    out = []
+    years = compacted_years(start, end, year_id)
+    for year in years:
+        sids, grades, first, codes = year_codes(year)
+        lo = max((start - first).days, 0)
+        hi = min((end - first).days, codes.shape[1] - 1)
+        if lo > hi:
+            continue
+        extras = archived_extras(year, first + timedelta(days=lo), first + timedelta(days=hi))
+        window = codes[:, lo:hi + 1]
+        # extras may describe a day whose code is 0 (an unpackable status)
+        marked = window != 0
+        for sid, d in extras:
+            j = np.searchsorted(sids, sid)
+            if j < len(sids) and sids[j] == sid:
+                marked[j, (d - first).days - lo] = True
+        day_idx, stu_idx = np.nonzero(marked.T)  # date-major
+        for di, si in zip(day_idx.tolist(), stu_idx.tolist()):
+            sid, d = int(sids[si]), first + timedelta(days=lo + di)
+            status, grade = STATUS_OF.get(int(window[si, di])), grades[si]
+            notes = None
+            extra = extras.get((sid, d))
+            if extra:
+                x_status, notes, x_grade, differs = extra
+                status = x_status or status
+                grade = x_grade if differs else grade
+            out.append(ArchivedRecord(sid, d, status, notes, grade, year.id, None))
+    if with_students and out:
+        students = archived_students([y.id for y in years])
+        out = [r._replace(student=students.get(r.student_id)) for r in out]
+    return out
+
+
+def daily_breakdown_rows(records):
+    """queries.daily_breakdown rows, (grade, status, count), for one day's archived
+    records (loaded with_students, for the current-grade fallback).
+    """
+    counts = Counter((r.grade_at_time or (r.student.current_grade if r.student else None), r.status)
+                     for r in records)
+    return [(g, s, n) for (g, s), n in counts.items()]
+
+
+def archived_range_stats(start: date, end: date, year_id: int | None = None):
+    """queries.student_range_stats rows for the compacted part of [start, end],
+    counted on the packed codes; only extras are looked at one by one.
+    """
+    years = compacted_years(start, end, year_id)
+    if not years:
+        return []
+    students = archived_students([y.id for y in years])
+    stats = {}  # (student_id, grade) -> [present, absent, tardy, total]
+
+    def add(sid, grade, code, n=1):
+        s = students.get(sid)
+        row = stats.setdefault((sid, grade or (s.current_grade if s else None)), [0, 0, 0, 0])
+        if code:
+            row[code - 1] += n
+        row[3] += n
+
+    for year in years:
+        sids, grades, first, codes = year_codes(year)
+        lo = max((start - first).days, 0)
+        hi = min((end - first).days, codes.shape[1] - 1)
+        if lo > hi:
+            continue
+        window = codes[:, lo:hi + 1]
+        for code in (1, 2, 3):
+            for i, n in enumerate((window == code).sum(axis=1).tolist()):
+                if n:
+                    add(int(sids[i]), grades[i], code, n)
+        for (sid, d), (x_status, _notes, x_grade, differs) in archived_extras(
+                year, first + timedelta(days=lo), first + timedelta(days=hi)).items():
+            if not (x_status or differs):
+                continue  # notes only
+            j = int(np.searchsorted(sids, sid))
+            code = int(window[j, (d - first).days - lo])
+            if code:
+                add(sid, grades[j], code, -1)  # take the packed day back out...
+            add(sid, x_grade if differs else grades[j], code)  # ...and count it where it belongs
+    out = []
+    for (sid, grade), counts in stats.items():
+        s = students.get(sid)
+        if counts[3]:
+            out.append((sid, s.last_name if s else "", s.first_name if s else "", grade, *counts))
+    return out
+
+
+def archived_export(start: date, end: date, year_id: int | None = None):
+    """queries.attendance_export rows for the compacted part of [start, end],
+    expanded one year at a time as the export is consumed.
+    """
+    for year in compacted_years(start, end, year_id):
+        records = archived_records(max(start, year.start_date), min(end, year.end_date), year.id,
+                                   with_students=True)
+        for r in records:
+            s = r.student
+            yield (r.date, s.last_name if s else "", s.first_name if s else "", r.grade_at_time,
+                   s.current_grade if s else None, r.status, r.notes, year.name, r.student_id)
+
+
+def archived_rollup_rows(year):
+    """AttendanceRollup rows (dicts) for a compacted year, from its packed codes
+    plus any live rows filed under it.
+    """
+    sids, _grades, first, codes = year_codes(year)
+    rows = {}
+    m = first.replace(day=1)
+    while m <= year.end_date:
+        nxt = date(m.year + (m.month == 12), m.month % 12 + 1, 1)
+        lo, hi = max((m - first).days, 0), min((nxt - first).days, codes.shape[1])
+        block = codes[:, lo:hi]
+        present, absent, tardy = ((block == c).sum(axis=1) for c in (1, 2, 3))
+        total = (block != 0).sum(axis=1)
+        for i in np.nonzero(total)[0].tolist():
+            rows[(int(sids[i]), m)] = {"student_id": int(sids[i]), "school_year_id": year.id, "month": m,
+                                       "present": int(present[i]), "absent": int(absent[i]),
+                                       "tardy": int(tardy[i]), "total": int(total[i])}
+        m = nxt
+    # days kept only as extras (unpackable statuses) still count towards the total
+    for sid, d in db.session.execute(
+            select(AttendanceArchiveExtra.student_id, AttendanceArchiveExtra.date)
+            .where(AttendanceArchiveExtra.school_year_id == year.id,
+                   AttendanceArchiveExtra.status.isnot(None))):
+        m = d.replace(day=1)
+        row = rows.setdefault((sid, m), {"student_id": sid, "school_year_id": year.id, "month": m,
+                                         "present": 0, "absent": 0, "tardy": 0, "total": 0})
+        row["total"] += 1
+    # and so do live rows filed under the year
+    for sid, d, status in db.session.execute(
+            select(Attendance.student_id, Attendance.date, Attendance.status)
+            .where(Attendance.school_year_id == year.id)):
+        m = d.replace(day=1)
+        row = rows.setdefault((sid, m), {"student_id": sid, "school_year_id": year.id, "month": m,
+                                         "present": 0, "absent": 0, "tardy": 0, "total": 0})
+        if status in CODES:
+            row[status.lower()] += 1
+        row["total"] += 1
+    return list(rows.values())
+
+
+# -------- Compact / expand --------
+def compact_year(year) -> dict:
+    """Move a year's Attendance rows into the packed tables, in one transaction.
+    Returns counts for the CLI. Raises ValueError when the year can't be compacted.
+    """
+    if year.compacted_at:
+        raise ValueError(f"{year.name} is already compacted")
+    first = year.start_date
+    days = (year.end_date - first).days + 1
+    rows = db.session.execute(
+        select(Attendance.student_id, cast(Attendance.date, String), Attendance.status,
+               Attendance.notes, Attendance.grade_at_time)
+        .where(Attendance.school_year_id == year.id)
+    ).all()
+    if not rows:
+        raise ValueError(f"{year.name} has no attendance to compact")
+
+    sids = np.unique(np.array([r[0] for r in rows], np.int64))
+    offsets = (np.array([r[1] for r in rows], dtype="datetime64[D]") - np.datetime64(first, "D")).astype(int)
+    if offsets.min() < 0 or offsets.max() >= days:
+        raise ValueError(f"{year.name} has attendance dated outside {first} - {year.end_date}; "
+                         "run `flask backfill-years` or fix the year's dates first")
+    row_of = np.searchsorted(sids, [r[0] for r in rows])
+    codes = np.zeros((len(sids), days), np.uint8)
+    codes[row_of, offsets] = [CODES.get(r[2], 0) for r in rows]
+
+    # each student's usual grade goes on the archive row; the rest are extras
+    grade_counts = {}
+    for sid, _d, _status, _notes, grade in rows:
+        grade_counts.setdefault(sid, Counter())[grade] += 1
+    grade_of = {sid: c.most_common(1)[0][0] for sid, c in grade_counts.items()}
+
+    extras = []
+    for (sid, _d, status, notes, grade), off in zip(rows, offsets.tolist()):
+        packable = status in CODES
+        differs = grade != grade_of[sid]
+        if packable and not notes and not differs:
+            continue
+        extras.append({"student_id": sid, "school_year_id": year.id, "date": first + timedelta(days=off),
+                       "status": None if packable else status, "notes": notes,
+                       "grade_at_time": grade if differs else None, "grade_differs": differs})
+
+    packed = pack_codes(codes)
+    archive_rows = [{"student_id": int(sid), "school_year_id": year.id, "start_date": first, "days": days,
+                     "codes": packed[i].tobytes(), "grade": grade_of[int(sid)]}
+                    for i, sid in enumerate(sids)]
+    for i in range(0, len(archive_rows), INSERT_BATCH):
+        db.session.execute(insert(AttendanceArchive), archive_rows[i:i + INSERT_BATCH])
+    for i in range(0, len(extras), INSERT_BATCH):
+        db.session.execute(insert(AttendanceArchiveExtra), extras[i:i + INSERT_BATCH])
+    db.session.execute(delete(Attendance).where(Attendance.school_year_id == year.id))
+    year.compacted_at = datetime.utcnow().replace(microsecond=0)
+    db.session.commit()
+    return {"records": len(rows), "students": len(sids), "extras": len(extras),
+            "packed_bytes": int(packed.size)}
+
+
+def expand_year(year) -> int:
+    """Put a compacted year back into Attendance rows. Returns the row count."""
+    if not year.compacted_at:
+        raise ValueError(f"{year.name} is not compacted")
+    records = archived_records(year.start_date, year.end_date, year.id)
+    rows = [{"student_id": r.student_id, "date": r.date, "status": r.status,
+             "notes": r.notes, "grade_at_time": r.grade_at_time, "school_year_id": year.id}
+            for r in records]
+    for i in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(insert(Attendance), rows[i:i + INSERT_BATCH])
+    db.session.execute(delete(AttendanceArchiveExtra).where(AttendanceArchiveExtra.school_year_id == year.id))
+    db.session.execute(delete(AttendanceArchive).where(AttendanceArchive.school_year_id == year.id))
+    year.compacted_at = None
+    db.session.commit()
+    return len(rows)
+
+
+def rebuild_archived_rollups() -> int:
+    """Recompute the rollups of every compacted year; the caller commits."""
+    n = 0
+    for year in compacted_years():
+        db.session.execute(delete(AttendanceRollup).where(AttendanceRollup.school_year_id == year.id))
+        rows = archived_rollup_rows(year)
+        for i in range(0, len(rows), INSERT_BATCH):
+            db.session.execute(insert(AttendanceRollup), rows[i:i + INSERT_BATCH])
+        n += len(rows)
+    return n
@@ -0,0 +1,286 @@
+# bench.py
+"""Benchmark the key endpoints against a synthetic school database.
+
+    python bench.py --students 300 --years 3 --out bench.json
+    python bench.py --students 300 --years 3 --compare bench.json
+
+Builds a throwaway SQLite database through the models (students, school
+years, a calendar with breaks and in-service days, and attendance for every
+school day), then times each endpoint through the Flask test client. The
+same --seed always produces the same data, so JSON results from two runs
+can be compared.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+STATUS_WEIGHTS = (("Present", 92), ("Absent", 5), ("Tardy", 3))
+GRADES = ["K", "1", "2", "3", "4", "5", "6", "7", "8"]
+
+
+# ---------- Synthetic data ----------
+def _school_year_bounds(y: int):
+    return date(y, 8, 15), date(y + 1, 6, 10)
+
+def _calendar_for_year(rng, y: int):
+    """(date, type, description) entries for one school year."""
+    start, end = _school_year_bounds(y)
+    rows = [(start, "Regular", "First Day of Instruction")]
+    # Thanksgiving week (Wed-Fri)
+    nov1 = date(y, 11, 1)
+    thanksgiving = nov1 + timedelta(days=(3 - nov1.weekday()) % 7 + 21)
+    for k in (-1, 0, 1):
+        rows.append((thanksgiving + timedelta(days=k), "Holiday", "Thanksgiving Break"))
+    # Winter break: two weeks from Dec 22
+    for k in range(14):
+        rows.append((date(y, 12, 22) + timedelta(days=k), "Closed", "Winter Break"))
+    # Spring break: a week in late March
+    for k in range(7):
+        rows.append((date(y + 1, 3, 23) + timedelta(days=k), "Closed", "Spring Break"))
+    # A handful of in-service days
+    span = (end - start).days
+    for _ in range(6):
+        d = start + timedelta(days=rng.randrange(span))
+        if d.weekday() < 5:
+            rows.append((d, "In-service", "Teacher Workday"))
+    # dedupe by date, first entry wins
+    by_date = {}
+    for d, t, desc in rows:
+        by_date.setdefault(d, (d, t, desc))
+    return sorted(by_date.values())
+
+def build_database(n_students: int, n_years: int, seed: int, first_year: int):
+    from werkzeug.security import generate_password_hash
+    from models import (db, User, Student, SchoolYear, SchoolCalendar, Attendance,
+                        bulk_upsert, iter_school_days, student_name_key)
+    from rollups import rebuild_rollups
+
+    rng = random.Random(seed)
+    db.create_all()
+    db.session.add(User(username="bench", role="admin", password_hash=generate_password_hash("bench")))
+
+    years = []
+    for k in range(n_years):
+        y = first_year + k
+        start, end = _school_year_bounds(y)
+        sy = SchoolYear(name=f"{y}-{(y + 1) % 100:02d}", start_date=start, end_date=end)
+        db.session.add(sy)
+        years.append((y, sy))
+    db.session.flush()
+
+    cal_rows = []
+    for y, sy in years:
+        cal_rows += [{"date": d, "type": t, "description": desc, "school_year_id": sy.id}
+                     for d, t, desc in _calendar_for_year(rng, y)]
+    db.session.execute(SchoolCalendar.__table__.insert(), cal_rows)
+
+    students = [{"first_name": f"First{i:05d}", "last_name": f"Last{rng.randrange(10**6):06d}",
+                 "current_grade": rng.choice(GRADES), "active": True} for i in range(n_students)]
+    for s in students:
+        s["name_key"] = student_name_key(s["first_name"], s["last_name"])
+    db.session.execute(Student.__table__.insert(), students)
+    db.session.commit()
+
+    student_ids = [sid for (sid,) in db.session.query(Student.id).order_by(Student.id)]
+    statuses = [s for s, w in STATUS_WEIGHTS for _ in range(w)]
+    n_att = 0
+    for _y, sy in years:
+        batch = []
+        for d in iter_school_days(sy.start_date, sy.end_date, sy.id):
+            for sid in student_ids:
+                batch.append({"student_id": sid, "date": d, "status": rng.choice(statuses),
+                              "notes": None, "school_year_id": sy.id})
+            if len(batch) >= 20000:
+                bulk_upsert(Attendance, batch, keys=("student_id", "date"), update_cols=("status",))
+                n_att += len(batch)
+                batch = []
+        bulk_upsert(Attendance, batch, keys=("student_id", "date"), update_cols=("status",))
+        n_att += len(batch)
+        db.session.commit()
+    rebuild_rollups()
+
+    return {"students": len(student_ids), "years": len(years), "calendar_rows": len(cal_rows),
+            "attendance_rows": n_att}
+
+
+# ---------- Timing ----------
+def _time(fn, repeat: int, store=None):
+    samples, status, size, queries = [], None, 0, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = fn()
+        body = resp.get_data()  # drain streamed responses inside the timing
+        samples.append((time.perf_counter() - t0) * 1000.0)
+        status, size = resp.status_code, len(body)
+        if store and store.last:
+            queries = store.last["queries"]
+    return {
+        "status": status,
+        "bytes": size,
+        "runs": repeat,
+        "queries": queries,
+        "min_ms": round(min(samples), 2),
+        "median_ms": round(statistics.median(samples), 2),
+        "max_ms": round(max(samples), 2),
+    }
+
+def _csv_bytes(header, rows):
+    import csv
+    sio = io.StringIO()
+    w = csv.writer(sio)
+    w.writerow(header)
+    w.writerows(rows)
+    return sio.getvalue().encode("utf-8")
+
+def _upload(client, url, data: bytes, filename: str, **form):
+    form["file"] = (io.BytesIO(data), filename)
+    return client.post(url, data=form, content_type="multipart/form-data")
+
+def run_benchmarks(app, repeat: int, seed: int):
+    from models import db, Student, SchoolYear, SchoolCalendar, iter_school_days
+    from utils import calendar_rows_to_ics
+
+    rng = random.Random(seed + 1)
+    client = app.test_client()
+    client.post("/login", data={"username": "bench", "password": "bench"})
+
+    with app.app_context():
+        years = SchoolYear.query.order_by(SchoolYear.start_date).all()
+        last = years[-1]
+        students = Student.query.order_by(Student.id).all()
+        day = next(iter_school_days(last.start_date + timedelta(days=30), last.end_date, last.id))
+        month_start = day.replace(day=1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        full_start, full_end = years[0].start_date, last.end_date
+        form = {"date": day.isoformat()}
+        for s in students:
+            form[f"status_{s.id}"] = rng.choice(["Present", "Absent", "Tardy"])
+            form[f"notes_{s.id}"] = ""
+        att_csv = _csv_bytes(
+            ["date", "last_name", "first_name", "grade", "status", "notes", "year"],
+            [[day.isoformat(), s.last_name, s.first_name, s.current_grade, "Present", "", last.name]
+             for s in students],
+        )
+        cal = [(r.date, r.type, r.description or "") for r in
+               SchoolCalendar.query.filter_by(school_year_id=last.id).order_by(SchoolCalendar.date)]
+        cal_csv = _csv_bytes(["date", "type", "description", "year"],
+                             [[d.isoformat(), t, desc, last.name] for d, t, desc in cal])
+        cal_ics = calendar_rows_to_ics(cal)
+        roster_csv = _csv_bytes(["first_name", "last_name", "grade", "active"],
+                                [[s.first_name, s.last_name, s.current_grade, "1"] for s in students])
+
+    cases = {
+        "take_attendance GET": lambda: client.get(f"/attendance/?date={day}"),
+        "take_attendance POST": lambda: client.post("/attendance/", data=form),
+        "reports daily": lambda: client.get(f"/admin/reports?date={day}"),
+        "reports range": lambda: client.get(
+            f"/admin/reports?date={day}&start={day - timedelta(days=40)}&end={day}"),
+        "reports whole months": lambda: client.get(
+            f"/admin/reports?date={day}&start={month_start}&end={month_end}"),
+        "attendance_export full": lambda: client.get(
+            f"/admin/attendance/export?start={full_start}&end={full_end}"),
+        "attendance_export xlsx full": lambda: client.get(
+            f"/admin/attendance/export.xlsx?start={full_start}&end={full_end}"),
+        "absence analytics all years": lambda: client.get("/admin/analytics/absence?year_id=all&chronic_only=0"),
+        "calendar_month": lambda: client.get(f"/calendar/month?year={day.year}&month={day.month}"),
+        "attendance_import_csv": lambda: _upload(client, "/admin/attendance/import_csv", att_csv, "a.csv"),
+        "calendar_import_csv": lambda: _upload(client, "/admin/calendar/import_csv", cal_csv, "c.csv"),
+        "calendar_import ics": lambda: _upload(client, "/admin/calendar/import", cal_ics, "c.ics"),
+        "students_import": lambda: _upload(client, "/admin/students/import", roster_csv, "s.csv"),
+    }
+    store = app.extensions.get("metrics")
+    return {name: _time(fn, repeat, store) for name, fn in cases.items()}
+
+
+# ---------- Reporting ----------
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def print_results(results, previous=None):
+    prev = (previous or {}).get("results", {})
+    width = max(len(k) for k in results)
+    for name, r in results.items():
+        line = (f"{name:<{width}}  {r['median_ms']:>9.2f} ms  "
+                f"(min {r['min_ms']:.2f}, {r['queries']} queries, status {r['status']})")
+        if name in prev and prev[name]["median_ms"]:
+            change = (r["median_ms"] - prev[name]["median_ms"]) * 100.0 / prev[name]["median_ms"]
+            line += f"  {change:+.1f}% vs previous"
+        print(line)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--students", type=int, default=200)
+    ap.add_argument("--years", type=int, default=3)
+    ap.add_argument("--first-year", type=int, default=2021)
+    ap.add_argument("--repeat", type=int, default=5, help="timed runs per endpoint")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--db", help="SQLite file to build (default: a temp file, deleted afterwards); "
+                                 "must not exist yet unless --force")
+    ap.add_argument("--force", action="store_true", help="overwrite an existing --db file")
+    ap.add_argument("--out", help="write results to this JSON file")
+    ap.add_argument("--compare", help="previous results JSON to compare against")
+    args = ap.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="cla-bench-"), "bench.db")
+    if os.path.exists(path):
+        if not args.force:
+            ap.error(f"{path} already exists; pick a new path or pass --force to overwrite it")
+        os.unlink(path)
+    # must be set before config.py is imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(path)}"
+    os.environ["METRICS_ENABLED"] = "1"  # per-request SQL statement counts
+    os.environ["JOBS_INLINE"] = "1"  # time the import work, not just the enqueue
+
+    from app import create_app
+    app = create_app()
+
+    t0 = time.perf_counter()
+    with app.app_context():
+        sizes = build_database(args.students, args.years, args.seed, args.first_year)
+    build_s = round(time.perf_counter() - t0, 2)
+    print(f"built {sizes} in {build_s}s")
+
+    results = run_benchmarks(app, args.repeat, args.seed)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "db", "force")},
+            "data": sizes,
+            "build_s": build_s,
+        },
+        "results": results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+    if not args.db:
+        os.unlink(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,59 +1,200 @@
 # calendar_ui.py
-from flask import Blueprint, render_template, request
-from flask_login import login_required
+import hmac
+import threading
+from collections import OrderedDict
+from flask import Blueprint, render_template, request, current_app, abort, Response, jsonify
+from flask_login import login_required, current_user
 from datetime import date, timedelta
-from calendar import monthrange
-from models import SchoolCalendar, SchoolYear
+from models import SchoolCalendar, calendar_version
+from utils import calendar_rows_to_ics
 
 calendar_ui = Blueprint("calendar_ui", __name__)
 
-@calendar_ui.route("/calendar/month")
-@login_required
-def calendar_month():
-    today = date.today()
-    y = int(request.args.get("year", today.year))
-    m = int(request.args.get("month", today.month))
+class _LRU:
+    """Small thread-safe LRU. Keys start with the calendar version, so a
+    calendar write makes old entries unreachable and they age out.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            val = self._data.get(key)
+            if val is not None:
+                self._data.move_to_end(key)
+            return val
+
+    def put(self, key, val):
+        with self._lock:
+            self._data[key] = val
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+# ---------- ICS feed ----------
+# Built feeds keyed by (calendar version, year_id, start, end)
+_feed_cache = _LRU(32)
+
+def calendar_ics_payload(year_id: int | None = None, start: date | None = None, end: date | None = None) -> bytes:
+    """ICS bytes for the calendar (optionally one year and/or a date range), cached."""
+    version, _changed_at = calendar_version()
+    key = (version, year_id, start, end)
+    payload = _feed_cache.get(key)
+    if payload is not None:
+        return payload
+
+    q = SchoolCalendar.query
+    if year_id:
+        q = q.filter(SchoolCalendar.school_year_id == year_id)
+    if start and end:
+        q = q.filter(SchoolCalendar.date >= start, SchoolCalendar.date <= end)
+    rows = q.order_by(SchoolCalendar.date).with_entities(
+        SchoolCalendar.date, SchoolCalendar.type, SchoolCalendar.description)
+    payload = calendar_rows_to_ics((d, t, desc or "") for d, t, desc in rows)
+
+    _feed_cache.put(key, payload)
+    return payload
+
+def _feed_args():
+    try:
+        year_id = int(request.args["year_id"]) if request.args.get("year_id") else None
+        start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+        end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+    except ValueError:
+        abort(400)
+    if not (start and end) or end < start:
+        start = end = None
+    return year_id, start, end
+
+@calendar_ui.route("/calendar/feed.ics")
+def calendar_feed():
+    """Subscribable ICS feed. Calendar apps pass ?token=CALENDAR_FEED_TOKEN;
+    signed-in users can open it without one. Repeat polls get a 304 from the
+    version counter alone, with no database access.
+    """
+    token = current_app.config.get("CALENDAR_FEED_TOKEN")
+    if not (token and hmac.compare_digest(request.args.get("token", ""), token)):
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+
+    year_id, start, end = _feed_args()
+    version, changed_at = calendar_version()
+    etag = f"cal-{version}-{year_id or ''}-{start or ''}-{end or ''}"
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and since.replace(tzinfo=None) >= changed_at
+
+    resp = Response(status=304) if fresh else Response(
+        calendar_ics_payload(year_id, start, end), mimetype="text/calendar")
+    resp.set_etag(etag)
+    resp.last_modified = changed_at
+    resp.cache_control.private = True
+    resp.cache_control.max_age = current_app.config.get("CALENDAR_FEED_MAX_AGE", 300)
+    return resp
+
 
-    if m < 1:
-        y, m = y - 1, 12
-    if m > 12:
-        y, m = y + 1, 1
+# ---------- Month grid ----------
+# Grids keyed by (calendar version, year, month); each miss also builds the
+# neighbouring months from the same query, since Prev/Next is the usual next click.
+_grid_cache = _LRU(48)
 
+CLASSES = {
+    "Holiday": "bg-danger",
+    "In-service": "bg-warning",
+    "Closed": "bg-secondary",
+    "Regular": "bg-success",
+}
+
+def _norm_month(y: int, m: int):
+    return (y - 1, 12) if m < 1 else (y + 1, 1) if m > 12 else (y, m)
+
+def _grid_start(y: int, m: int) -> date:
     first = date(y, m, 1)
-    last_day = monthrange(y, m)[1]
     # Sunday-start 6-week grid
-    days_back = (first.weekday() + 1) % 7
-    grid_start = first - timedelta(days=days_back)
-    grid_days = [grid_start + timedelta(days=i) for i in range(42)]
-    weeks = [grid_days[i:i+7] for i in range(0, 42, 7)]
+    return first - timedelta(days=(first.weekday() + 1) % 7)
 
-    q_start, q_end = grid_days[0], grid_days[-1]
-    rows = (SchoolCalendar.query
-        .filter(SchoolCalendar.date >= q_start, SchoolCalendar.date <= q_end)
-        .order_by(SchoolCalendar.date)
-        .all())
+def _build_grid(y: int, m: int, by_date: dict) -> dict:
+    start = _grid_start(y, m)
+    days = []
+    for i in range(42):
+        d = start + timedelta(days=i)
+        days.append({"date": d.isoformat(), "day": d.day, "in_month": d.month == m,
+                     "events": by_date.get(d, [])})
+    prev_y, prev_m = _norm_month(y, m - 1)
+    next_y, next_m = _norm_month(y, m + 1)
+    return {
+        "year": y, "month": m,
+        "weeks": [days[i:i + 7] for i in range(0, 42, 7)],
+        "prev": {"year": prev_y, "month": prev_m},
+        "next": {"year": next_y, "month": next_m},
+    }
+
+def month_grid(y: int, m: int) -> dict:
+    """42-day grid for a month with calendar entries per day, cached."""
+    version, _changed_at = calendar_version()
+    grid = _grid_cache.get((version, y, m))
+    if grid is not None:
+        return grid
 
+    months = [_norm_month(y, m - 1), (y, m), _norm_month(y, m + 1)]
+    q_start = _grid_start(*months[0])
+    q_end = _grid_start(*months[-1]) + timedelta(days=41)
     by_date = {}
-    for r in rows:
-        by_date.setdefault(r.date, []).append(r)
-
-    classes = {
-        "Holiday": "bg-danger",
-        "In-service": "bg-warning",
-        "Closed": "bg-secondary",
-        "Regular": "bg-success",
-    }
+    rows = (SchoolCalendar.query
+        .with_entities(SchoolCalendar.date, SchoolCalendar.type, SchoolCalendar.description)
+        .filter(SchoolCalendar.date >= q_start, SchoolCalendar.date <= q_end)
+        .order_by(SchoolCalendar.date, SchoolCalendar.id))
+    for d, t, desc in rows:
+        by_date.setdefault(d, []).append({"type": t, "description": desc or ""})
 
-    prev_y, prev_m = (y - 1, 12) if m == 1 else (y, m - 1)
-    next_y, next_m = (y + 1, 1) if m == 12 else (y, m + 1)
+    for yy, mm in months:
+        built = _build_grid(yy, mm, by_date)
+        _grid_cache.put((version, yy, mm), built)
+        if (yy, mm) == (y, m):
+            grid = built
+    return grid
 
-    years = SchoolYear.query.order_by(SchoolYear.start_date).all()
+def _requested_month():
+    today = date.today()
+    try:
+        y = int(request.args.get("year", today.year))
+        m = int(request.args.get("month", today.month))
+    except ValueError:
+        abort(400)
+    y, m = _norm_month(y, m)
+    # the grid also builds the months either side, which must stay within date()
+    if not 2 <= y <= 9998 or not 1 <= m <= 12:
+        abort(400)
+    return y, m
 
+@calendar_ui.route("/calendar/month")
+@login_required
+def calendar_month():
+    y, m = _requested_month()
+    grid = month_grid(y, m)
     return render_template(
         "calendar_month.html",
-        year=y, month=m, today=today,
-        weeks=weeks, in_month=lambda d: d.month == m,
-        by_date=by_date, classes=classes,
-        prev_y=prev_y, prev_m=prev_m, next_y=next_y, next_m=next_m,
-        years=years
+        grid=grid, year=y, month=m, today=date.today().isoformat(), classes=CLASSES,
     )
+
+@calendar_ui.route("/calendar/month.json")
+@login_required
+def calendar_month_json():
+    """The month grid as JSON for in-page Prev/Next; revalidates with ETag."""
+    y, m = _requested_month()
+    version, changed_at = calendar_version()
+    etag = f"grid-{version}-{y}-{m}"
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(month_grid(y, m))
+    resp.set_etag(etag)
+    resp.last_modified = changed_at
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 60
+    return resp
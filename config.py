@@ -10,3 +10,40 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Performance profile: "fast" applies the settings below, "off" keeps driver defaults
+    DB_PROFILE = os.environ.get("DB_PROFILE", "fast")
+    # SQLite: run on every new connection (WAL lets report reads overlap teacher saves)
+    SQLITE_PRAGMAS = {
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -20000)),  # negative = KiB
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 128 * 1024 * 1024)),
+        "temp_store": os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+    }
+    # Other databases (DATABASE_URL=postgresql://...): connection pool sizing
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))  # seconds
+
+    # Per-request latency / SQL-count instrumentation (see metrics.py), off by default
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+    METRICS_QUERY_BUDGET = int(os.environ.get("METRICS_QUERY_BUDGET", 50))  # warn above this
+    METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", 1000))  # samples kept per endpoint
+
+    # Background imports (see jobs.py)
+    JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", 1))
+    JOBS_INLINE = os.environ.get("JOBS_INLINE", "").lower() in ("1", "true", "yes")  # run in the request
+
+    # Largest accepted request body, i.e. import upload (Flask answers 413 above it)
+    MAX_CONTENT_LENGTH = int(os.environ.get("MAX_UPLOAD_MB", 50)) * 1024 * 1024
+
+    # Subscribable ICS feed (/calendar/feed.ics?token=...); unset = signed-in users only
+    CALENDAR_FEED_TOKEN = os.environ.get("CALENDAR_FEED_TOKEN") or None
+    CALENDAR_FEED_MAX_AGE = int(os.environ.get("CALENDAR_FEED_MAX_AGE", 300))  # seconds
+    # how often a process re-reads the shared calendar/school-year cache versions
+    # (changes made by other workers or CLI commands show up within this)
+    CACHE_SYNC_S = float(os.environ.get("CACHE_SYNC_S", 5))
+
+    # Chronic-absence report (see analytics.py): flag students absent on at least this % of marked days
+    CHRONIC_ABSENCE_PCT = float(os.environ.get("CHRONIC_ABSENCE_PCT", 10))
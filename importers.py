@@ -0,0 +1,346 @@
+# importers.py
+"""Set-based import engines used by the background import jobs.
+
+Rows are consumed from a stream in batches of BATCH_ROWS. Each batch is
+resolved in Python against lookup tables loaded once, written with chunked
+multi-row statements and committed, so memory stays flat however long the
+file is and the SQLite write lock is released between batches. All of the
+writes are upserts, so re-running a file that failed part-way is safe.
+
+Calendar files are at most a few hundred distinct days per year, so their
+rows are collected and diffed against the database in one go instead
+(diff_calendar_rows / apply_calendar_diff), which also allows a preview.
+"""
+from dataclasses import dataclass, field
+
+from sqlalchemy import delete, insert, update
+
+from models import (db, Student, Attendance, SchoolYear, SchoolCalendar, bulk_upsert,
+                    school_year_id_for_date, calendar_changed, student_name_key)
+from rollups import refresh_rollups
+from utils import parse_date_any, batched
+
+
+# rows resolved and written per transaction
+BATCH_ROWS = 2000
+# rejected rows kept for the job status page (all of them are counted)
+REJECTS_KEPT = 200
+# calendar changes listed on a preview (all of them are counted)
+PREVIEW_KEPT = 500
+# ids per DELETE ... WHERE id IN (...)
+_ID_CHUNK = 500
+
+
+class ImportAborted(ValueError):
+    """The file can't be imported. Calendar imports have written nothing; the
+    batched importers keep the batches committed before the bad row."""
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    # (line number in the file, reason, raw row) for the first REJECTS_KEPT skipped rows
+    rejects: list = field(default_factory=list)
+    # calendar imports: (action, date, year, old, new) for the first PREVIEW_KEPT changes
+    changes: list = field(default_factory=list)
+
+    def reject(self, line_no: int, reason: str, row: dict):
+        self.skipped += 1
+        if len(self.rejects) < REJECTS_KEPT:
+            self.rejects.append((line_no, reason, row))
+
+
+def _batches(reader, progress):
+    """Yield lists of (line_no, row), BATCH_ROWS at a time.
+    progress(rows_read) is called when the next batch is requested, i.e. after
+    the caller has committed the previous one, so it never waits on our own
+    write lock.
+    """
+    n = 0
+    # header is line 1
+    for batch in batched(enumerate(reader, start=2), BATCH_ROWS):
+        yield batch
+        n += len(batch)
+        if progress:
+            progress(n)
+
+
+def import_attendance_rows(reader, target_year_id: int | None = None, progress=None) -> ImportResult:
+    """Upsert attendance from dict rows shaped like attendance_template.csv.
+    CSV header: date,last_name,first_name,grade,status,notes,year
+    Later rows win when a (student, date) pair appears more than once.
+    progress(rows_read) is called after each committed batch.
+    """
+    result = ImportResult()
+
+    # name_key -> id, same matching as the roster import (lowest id wins)
+    students = dict(db.session.query(Student.name_key, Student.id).order_by(Student.id.desc()))
+    years_by_name = {sy.name: sy.id for sy in SchoolYear.query.all()}
+    target = db.session.get(SchoolYear, target_year_id) if target_year_id else None
+    # compacted years are read-only (see archive.py)
+    archived = {sy_id for (sy_id,) in db.session.query(SchoolYear.id).filter(SchoolYear.compacted_at.isnot(None))}
+
+    for batch in _batches(reader, progress):
+        pending = {}
+        for line_no, row in batch:
+            try:
+                d = parse_date_any(row.get("date", ""))
+            except Exception:
+                result.reject(line_no, "bad date", row)
+                continue
+
+            sid = students.get(student_name_key(row.get("first_name"), row.get("last_name")))
+            if not sid:
+                result.reject(line_no, "unknown student", row)
+                continue
+
+            year_name = (row.get("year") or "").strip()
+            if year_name:
+                sy_id = years_by_name.get(year_name)
+                if not sy_id:
+                    result.reject(line_no, f"unknown year {year_name!r}", row)
+                    continue
+            elif target_year_id:
+                sy_id = target.id if target else None
+            else:
+                sy_id = school_year_id_for_date(d)
+            if sy_id in archived:
+                result.reject(line_no, "school year is archived", row)
+                continue
+
+            if (sid, d) in pending:
+                result.updated += 1
+            pending[(sid, d)] = {
+                "student_id": sid,
+                "date": d,
+                "status": (row.get("status") or "Present").strip(),
+                "notes": (row.get("notes") or "").strip() or None,
+                "grade_at_time": (row.get("grade") or "").strip() or None,
+                "school_year_id": sy_id,
+            }
+
+        if not pending:
+            continue
+
+        # Which keys already exist, for the created/updated split (keys written by an
+        # earlier batch of this file count as updated): the batch's students, _ID_CHUNK
+        # ids per query, over its date span; uq_attendance_student_date covers it.
+        dates = [d for _sid, d in pending]
+        sids = sorted({sid for sid, _d in pending})
+        existing = set()
+        for i in range(0, len(sids), _ID_CHUNK):
+            existing.update(
+                db.session.query(Attendance.student_id, Attendance.date)
+                .filter(Attendance.student_id.in_(sids[i:i + _ID_CHUNK]),
+                        Attendance.date >= min(dates), Attendance.date <= max(dates)))
+        for key in pending:
+            if key in existing:
+                result.updated += 1
+            else:
+                result.created += 1
+
+        bulk_upsert(
+            Attendance,
+            list(pending.values()),
+            keys=("student_id", "date"),
+            update_cols=("status", "notes", "grade_at_time"),
+            keep_existing=("school_year_id",),
+        )
+        refresh_rollups(pending)
+        db.session.commit()
+    return result
+
+
+def import_student_rows(reader, progress=None) -> ImportResult:
+    """Upsert the roster from dict rows. CSV header: first_name,last_name,grade,active
+    Rows match existing students on student_name_key(), so case and extra
+    spaces don't create duplicates; existing spellings are kept. So is the first
+    spelling of a name repeated within the file: later rows only update it.
+    """
+    result = ImportResult()
+    # name_key -> id; the lowest id wins if older data has near-duplicates
+    known = {}
+    for sid, key in db.session.query(Student.id, Student.name_key).order_by(Student.id.desc()):
+        known[key] = sid
+
+    for batch in _batches(reader, progress):
+        inserts, updates = {}, {}
+        for line_no, row in batch:
+            fn = " ".join((row.get("first_name") or "").split())
+            ln = " ".join((row.get("last_name") or "").split())
+            if not fn or not ln:
+                result.reject(line_no, "missing name", row)
+                continue
+            act = (row.get("active") or "1").strip()
+            gr = (row.get("grade") or "").strip() or None
+            active = act.lower() in ("1", "true", "yes")
+
+            key = student_name_key(fn, ln)
+            sid = known.get(key)
+            if sid:
+                result.updated += 1
+                updates[sid] = {"id": sid, "current_grade": gr, "active": active}
+            elif key in inserts:
+                result.updated += 1
+                inserts[key].update(current_grade=gr, active=active)
+            else:
+                result.created += 1
+                inserts[key] = {"first_name": fn, "last_name": ln, "name_key": key,
+                                "current_grade": gr, "active": active}
+
+        if updates:
+            db.session.execute(update(Student), list(updates.values()))
+        if inserts:
+            new_ids = db.session.execute(
+                insert(Student).returning(Student.id, Student.name_key), list(inserts.values()))
+            known.update((key, sid) for sid, key in new_ids)
+        db.session.commit()
+    return result
+
+
+# calendar import modes, see diff_calendar_rows(); sync is always previewed first
+CALENDAR_MODES = ("merge", "replace", "sync")
+
+
+@dataclass
+class CalendarDiff:
+    """What a calendar import would do, computed by diff_calendar_rows()."""
+    inserts: list = field(default_factory=list)  # dicts for SchoolCalendar insert
+    updates: list = field(default_factory=list)  # {"id", "type", "description"}
+    deletes: list = field(default_factory=list)  # ids
+    unchanged: int = 0
+    # (action, date, school_year_id, (old type, old desc) | None, (new type, new desc) | None)
+    changes: list = field(default_factory=list)
+
+
+def diff_calendar_rows(rows: dict, mode: str = "merge") -> CalendarDiff:
+    """Diff {(date, school_year_id): (type, description)} against the calendar.
+    - merge: insert new days, update changed ones, leave everything else
+    - replace: as merge, and each (date, year) in the file ends up with just
+      the file's entry (duplicate rows for it are deleted); other days are kept
+    - sync: the file becomes the calendar for the school years it touches
+      between its first and last date; entries there it doesn't list are deleted
+    Existing entries in the file's date range are read with one query.
+    """
+    diff = CalendarDiff()
+    if not rows:
+        return diff
+    dates = [d for d, _sy in rows]
+    years = {sy for _d, sy in rows}
+    existing = {}
+    for cid, d, sy_id, t, desc in (db.session.query(SchoolCalendar.id, SchoolCalendar.date,
+                                                    SchoolCalendar.school_year_id, SchoolCalendar.type,
+                                                    SchoolCalendar.description)
+                                   .filter(SchoolCalendar.date >= min(dates), SchoolCalendar.date <= max(dates))
+                                   .order_by(SchoolCalendar.id)):
+        key = (d, sy_id)
+        # duplicate (NULL-year) rows of a day in the file, or days the file doesn't mention
+        if key in existing or key not in rows:
+            if (mode == "sync" and sy_id in years) or (mode == "replace" and key in rows):
+                diff.deletes.append(cid)
+                diff.changes.append(("delete", d, sy_id, (t, desc), None))
+            continue
+        existing[key] = (cid, t, desc)
+
+    for (d, sy_id), (t, desc) in sorted(rows.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+        cur = existing.get((d, sy_id))
+        if cur is None:
+            diff.inserts.append({"date": d, "school_year_id": sy_id, "type": t, "description": desc})
+            diff.changes.append(("insert", d, sy_id, None, (t, desc)))
+        elif (cur[1], cur[2]) == (t, desc):
+            diff.unchanged += 1
+        else:
+            diff.updates.append({"id": cur[0], "type": t, "description": desc})
+            diff.changes.append(("update", d, sy_id, (cur[1], cur[2]), (t, desc)))
+    diff.changes.sort(key=lambda c: (c[1], c[2] or 0))
+    return diff
+
+
+def apply_calendar_diff(diff: CalendarDiff):
+    """Write a CalendarDiff in one transaction with bulk statements."""
+    if diff.deletes:
+        for i in range(0, len(diff.deletes), _ID_CHUNK):
+            db.session.execute(delete(SchoolCalendar)
+                               .where(SchoolCalendar.id.in_(diff.deletes[i:i + _ID_CHUNK])))
+    if diff.updates:
+        db.session.execute(update(SchoolCalendar), diff.updates)
+    if diff.inserts:
+        db.session.execute(SchoolCalendar.__table__.insert(), diff.inserts)
+    calendar_changed()
+    db.session.commit()
+
+
+def _finish_calendar_import(rows: dict, mode: str, preview: bool, result: ImportResult) -> ImportResult:
+    diff = diff_calendar_rows(rows, mode)
+    result.created, result.updated = len(diff.inserts), len(diff.updates)
+    result.deleted, result.unchanged = len(diff.deletes), diff.unchanged
+    years = dict(db.session.query(SchoolYear.id, SchoolYear.name))
+    fmt = lambda v: None if v is None else (v[0] + (f" – {v[1]}" if v[1] else ""))
+    result.changes = [(action, d.isoformat(), years.get(sy_id, ""), fmt(old), fmt(new))
+                      for action, d, sy_id, old, new in diff.changes[:PREVIEW_KEPT]]
+    if not preview:
+        apply_calendar_diff(diff)
+    return result
+
+
+def import_calendar_csv_rows(reader, target_year_id: int | None = None, mode: str = "merge",
+                             progress=None, preview: bool = False) -> ImportResult:
+    """Load calendar days from dict rows. CSV header: date,type,description,year
+    Raises ImportAborted if a row names a school year that doesn't exist.
+    With preview=True the diff is computed and reported but nothing is written.
+    """
+    result = ImportResult()
+    years_by_name = {sy.name: sy.id for sy in SchoolYear.query.all()}
+    target = db.session.get(SchoolYear, target_year_id) if target_year_id else None
+    # compacted years are read-only (see archive.py)
+    archived = {sy_id for (sy_id,) in db.session.query(SchoolYear.id).filter(SchoolYear.compacted_at.isnot(None))}
+
+    rows = {}
+    for batch in _batches(reader, progress):
+        for line_no, row in batch:
+            try:
+                d = parse_date_any(row.get("date", ""))
+            except Exception:
+                result.reject(line_no, "bad date", row)
+                continue
+
+            year_name = (row.get("year") or "").strip()
+            if year_name:
+                sy_id = years_by_name.get(year_name)
+                if not sy_id:
+                    raise ImportAborted(f"Unknown school year in CSV: {year_name} (line {line_no})")
+            elif target_year_id:
+                sy_id = target.id if target else None
+            else:
+                sy_id = school_year_id_for_date(d)
+            if sy_id in archived:
+                result.reject(line_no, "school year is archived", row)
+                continue
+
+            # later rows win for the same (date, year)
+            rows[(d, sy_id)] = ((row.get("type") or "Regular").strip(),
+                                (row.get("description") or "").strip() or None)
+
+    return _finish_calendar_import(rows, mode, preview, result)
+
+
+def import_calendar_ics_rows(events, mode: str = "merge", progress=None, preview: bool = False) -> ImportResult:
+    """Load calendar days from (date, type, description) events, e.g. ics_to_calendar_rows()."""
+    result = ImportResult()
+    archived = {sy_id for (sy_id,) in db.session.query(SchoolYear.id).filter(SchoolYear.compacted_at.isnot(None))}
+    rows = {}
+    for batch in _batches(events, progress):
+        for line_no, (d, t, desc) in batch:
+            sy_id = school_year_id_for_date(d)
+            if sy_id in archived:
+                result.reject(line_no - 1, "school year is archived",  # event number: no header
+                              {"date": d.isoformat(), "type": t, "description": desc or ""})
+                continue
+            rows[(d, sy_id)] = (t, desc or None)
+    if not rows and not result.skipped:
+        raise ImportAborted("No calendar events found in the .ics.")
+    return _finish_calendar_import(rows, mode, preview, result)
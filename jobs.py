@@ -0,0 +1,290 @@
+# jobs.py
+"""Local background runner for file imports.
+
+The import routes save the upload under instance/uploads/, record an
+ImportJob row and hand the job id to an in-process thread pool, so a large
+file doesn't tie up the request. No external broker is needed: job state
+(status, rows read, final counts, rejected rows) lives in the import_job
+table and the status page polls it.
+
+JOBS_WORKERS sets the pool size (1 by default: SQLite has a single writer
+anyway). JOBS_INLINE=1 runs the job inside the request instead, which is
+handy for scripts and benchmarks.
+
+The pool lives in the web process, so a restart or worker recycle drops
+whatever it held. Each job records its owner (host:pid) and the owner renews
+a lease on its queued/running jobs every HEARTBEAT_S seconds. The job pages
+fail jobs whose lease has lapsed (fail_abandoned_jobs), so their status
+pages stop polling; jobs of other live workers are left alone.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, update
+from werkzeug.utils import secure_filename
+
+from importers import (ImportAborted, import_attendance_rows, import_calendar_csv_rows,
+                       import_calendar_ics_rows, import_student_rows)
+from models import db, ImportJob
+from utils import ics_to_calendar_rows, iter_csv_dicts
+from workbooks import iter_xlsx_dicts
+
+# minimum seconds between rows_processed writes while a job runs
+PROGRESS_INTERVAL_S = 1.0
+# uploads kept for a preview that was never applied are removed after this
+STALE_UPLOAD_S = 24 * 3600
+# owners renew their jobs' lease this often; a job not renewed for LEASE_S is abandoned
+HEARTBEAT_S = 30
+LEASE_S = 4 * HEARTBEAT_S
+# kinds that commit once at the end (the rest commit batch by batch)
+SINGLE_COMMIT_KINDS = ("calendar_csv", "calendar_ics")
+
+_executor = None
+_executor_lock = threading.Lock()
+_heartbeat_pid = None  # pid whose heartbeat thread is running (reset by a fork)
+
+
+# ---------- Handlers: (upload path, params, progress) -> ImportResult ----------
+def _attendance_csv(path, params, progress):
+    with open(path, "rb") as f:
+        return import_attendance_rows(iter_csv_dicts(f), params.get("target_year_id"), progress=progress)
+
+def _attendance_xlsx(path, params, progress):
+    return import_attendance_rows(iter_xlsx_dicts(path), params.get("target_year_id"), progress=progress)
+
+def _calendar_csv(path, params, progress):
+    with open(path, "rb") as f:
+        return import_calendar_csv_rows(iter_csv_dicts(f), params.get("target_year_id"),
+                                        params.get("mode", "merge"), progress=progress,
+                                        preview=params.get("preview", False))
+
+def _calendar_ics(path, params, progress):
+    start, end = (date.fromisoformat(params[k]) if params.get(k) else None for k in ("start", "end"))
+    with open(path, "rb") as f:
+        return import_calendar_ics_rows(ics_to_calendar_rows(f, start, end), params.get("mode", "merge"),
+                                        progress=progress, preview=params.get("preview", False))
+
+def _students_csv(path, params, progress):
+    with open(path, "rb") as f:
+        return import_student_rows(iter_csv_dicts(f), progress=progress)
+
+HANDLERS = {
+    "attendance_csv": _attendance_csv,
+    "attendance_xlsx": _attendance_xlsx,
+    "calendar_csv": _calendar_csv,
+    "calendar_ics": _calendar_ics,
+    "students_csv": _students_csv,
+}
+
+
+# ---------- Queue ----------
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get("JOBS_WORKERS", 1),
+                                           thread_name_prefix="import-job")
+    return _executor
+
+def _upload_folder(app):
+    folder = os.path.join(app.instance_path, "uploads")
+    os.makedirs(folder, exist_ok=True)
+    # previews keep their upload for the Apply step; clear out abandoned ones
+    cutoff = time.time() - STALE_UPLOAD_S
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+    return folder
+
+def _start(app, job: ImportJob) -> ImportJob:
+    job.owner = _owner()
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    if app.config.get("JOBS_INLINE"):
+        run_job(app, job.id)
+        db.session.refresh(job)
+    else:
+        _ensure_heartbeat(app)
+        _get_executor(app).submit(run_job, app, job.id)
+    return job
+
+def _owner() -> str:
+    # per call, not at import: workers forked from a preloading master differ
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _heartbeat(app, owner: str):
+    while True:
+        time.sleep(HEARTBEAT_S)
+        try:
+            with app.app_context(), db.engine.begin() as conn:
+                conn.execute(update(ImportJob)
+                             .where(ImportJob.owner == owner, ImportJob.status.in_(("queued", "running")))
+                             .values(heartbeat_at=datetime.utcnow()))
+        except Exception:
+            app.logger.exception("import job heartbeat failed")
+
+def _ensure_heartbeat(app):
+    global _heartbeat_pid
+    with _executor_lock:
+        if _heartbeat_pid != os.getpid():
+            _heartbeat_pid = os.getpid()
+            threading.Thread(target=_heartbeat, args=(app, _owner()), daemon=True,
+                             name="import-job-heartbeat").start()
+
+def _abandoned_message(job: ImportJob) -> str:
+    if job.status == "queued" or job.kind in SINGLE_COMMIT_KINDS or json.loads(job.params or "{}").get("preview"):
+        saved = "nothing was saved"
+    else:
+        saved = "rows saved before that are kept"
+    return (f"Interrupted (server restarted or worker stopped) after {job.rows_processed or 0} rows; "
+            f"{saved}. Upload the file again to finish.")
+
+def fail_abandoned_jobs() -> int:
+    """Mark queued/running jobs whose owner stopped renewing their lease as
+    failed and remove their uploads. Returns how many.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=LEASE_S)
+    jobs = ImportJob.query.filter(
+        ImportJob.status.in_(("queued", "running")),
+        func.coalesce(ImportJob.heartbeat_at, ImportJob.created_at) < cutoff,
+    ).all()
+    for job in jobs:
+        job.message = _abandoned_message(job)
+        job.status = "failed"
+        job.finished_at = datetime.utcnow()
+        if job.upload_path and os.path.exists(job.upload_path):
+            os.unlink(job.upload_path)
+        job.upload_path = None
+    if jobs:
+        db.session.commit()
+    return len(jobs)
+
+def enqueue_import(kind: str, file, params: dict | None = None, user_id: int | None = None) -> ImportJob:
+    """Save the uploaded FileStorage and start (or queue) an import job for it.
+    The upload is copied to disk in chunks; MAX_CONTENT_LENGTH caps its size.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    app = current_app._get_current_object()
+    folder = _upload_folder(app)
+
+    job = ImportJob(kind=kind, filename=file.filename, params=json.dumps(params or {}),
+                    created_by_id=user_id)
+    db.session.add(job)
+    db.session.flush()
+    job.upload_path = os.path.join(folder, f"job{job.id}-{secure_filename(file.filename) or 'upload'}")
+    file.save(job.upload_path)
+    db.session.commit()
+    return _start(app, job)
+
+def can_apply(job: ImportJob) -> bool:
+    """A finished preview whose upload is still on disk."""
+    return (job.status == "done" and json.loads(job.params or "{}").get("preview", False)
+            and bool(job.upload_path) and os.path.exists(job.upload_path))
+
+def apply_preview(job: ImportJob, user_id: int | None = None) -> ImportJob:
+    """Start the real import for a previewed file, reusing its upload."""
+    params = json.loads(job.params or "{}")
+    params["preview"] = False
+    new = ImportJob(kind=job.kind, filename=job.filename, params=json.dumps(params),
+                    upload_path=job.upload_path, created_by_id=user_id)
+    job.upload_path = None  # the new job owns (and removes) the file now
+    db.session.add(new)
+    db.session.commit()
+    return _start(current_app._get_current_object(), new)
+
+
+# ---------- Worker ----------
+def _progress_writer(job_id: int, state: dict):
+    """Callback for the importers; throttled writes on their own connection."""
+    last = [0.0]
+
+    def progress(n: int):
+        state["rows"] = n
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL_S:
+            return
+        last[0] = now
+        with db.engine.begin() as conn:
+            conn.execute(update(ImportJob).where(ImportJob.id == job_id)
+                         .values(rows_processed=n, heartbeat_at=datetime.utcnow()))
+
+    return progress
+
+def run_job(app, job_id: int):
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status != "queued":
+            return
+        job.status = "running"
+        job.started_at = job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+        state = {"rows": 0}
+        status, message, result = "failed", None, None
+        try:
+            result = HANDLERS[job.kind](job.upload_path, json.loads(job.params or "{}"),
+                                        _progress_writer(job_id, state))
+            status = "done"
+        except ImportAborted as e:
+            db.session.rollback()
+            message = str(e)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("import job %s failed", job_id)
+            # earlier batches are committed; say how far it got
+            message = f"Import failed after {state['rows']} rows: {e}"
+
+        job = db.session.get(ImportJob, job_id)
+        job.status = status
+        job.finished_at = datetime.utcnow()
+        job.rows_processed = state["rows"]
+        preview = status == "done" and json.loads(job.params or "{}").get("preview", False)
+        if result is not None:
+            job.created, job.updated, job.skipped = result.created, result.updated, result.skipped
+            job.message = f"{result.created} new, {result.updated} updated"
+            if job.kind.startswith("calendar"):
+                job.message += f", {result.deleted} deleted, {result.unchanged} unchanged"
+            job.message += f", {result.skipped} skipped"
+            if preview:
+                job.message = "Preview (nothing saved yet): " + job.message
+            job.rejects = json.dumps(result.rejects)
+            job.preview = json.dumps(result.changes) if result.changes else None
+        else:
+            job.message = message
+        # a preview keeps its upload for apply_preview()
+        path = None
+        if not preview:
+            path, job.upload_path = job.upload_path, None
+        db.session.commit()
+
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+
+def job_to_dict(job: ImportJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "filename": job.filename,
+        "rows_processed": job.rows_processed,
+        "created": job.created,
+        "updated": job.updated,
+        "skipped": job.skipped,
+        "message": job.message,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "finished": job.status in ("done", "failed"),
+    }
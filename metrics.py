@@ -0,0 +1,117 @@
+# metrics.py
+"""Opt-in per-request latency and SQL instrumentation.
+
+Enable with METRICS_ENABLED=1. Each request records wall time, the number of
+SQL statements it ran and the time spent in them (via SQLAlchemy cursor
+events). Requests over METRICS_QUERY_BUDGET statements are logged as likely
+N+1s. The last METRICS_WINDOW samples per endpoint are kept in memory and
+summarised as percentiles on /admin/metrics.
+"""
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+
+def _percentile(sorted_vals, pct: float):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(pct / 100.0 * len(sorted_vals)) - 1))
+    return sorted_vals[k]
+
+
+class MetricsStore:
+    """Bounded per-endpoint samples of (wall_ms, queries, sql_ms)."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._requests = defaultdict(int)
+        self._over_budget = defaultdict(int)
+        self.last = None  # most recent sample, handy for scripts like bench.py
+
+    def record(self, endpoint: str, wall_ms: float, queries: int, sql_ms: float, over_budget: bool):
+        sample = (wall_ms, queries, sql_ms)
+        with self._lock:
+            self._samples[endpoint].append(sample)
+            self._requests[endpoint] += 1
+            if over_budget:
+                self._over_budget[endpoint] += 1
+            self.last = {"endpoint": endpoint, "wall_ms": round(wall_ms, 2),
+                         "queries": queries, "sql_ms": round(sql_ms, 2)}
+
+    def summary(self):
+        """One dict per endpoint, slowest p95 first."""
+        with self._lock:
+            snap = {ep: list(s) for ep, s in self._samples.items()}
+            requests = dict(self._requests)
+            over = dict(self._over_budget)
+
+        out = []
+        for ep, samples in snap.items():
+            wall = sorted(s[0] for s in samples)
+            queries = sorted(s[1] for s in samples)
+            sql = sorted(s[2] for s in samples)
+            out.append({
+                "endpoint": ep,
+                "requests": requests[ep],
+                "window": len(samples),
+                "wall_ms": {p: round(_percentile(wall, p), 2) for p in (50, 95, 99)},
+                "queries": {"p50": _percentile(queries, 50), "p95": _percentile(queries, 95),
+                            "max": queries[-1]},
+                "sql_ms": {p: round(_percentile(sql, p), 2) for p in (50, 95, 99)},
+                "over_budget": over.get(ep, 0),
+            })
+        out.sort(key=lambda r: r["wall_ms"][95], reverse=True)
+        return out
+
+
+def get_store():
+    return current_app.extensions.get("metrics")
+
+
+def init_metrics(app):
+    """Wire the request hooks and cursor events when METRICS_ENABLED is set."""
+    if not app.config.get("METRICS_ENABLED"):
+        return
+    store = MetricsStore(app.config.get("METRICS_WINDOW", 1000))
+    app.extensions["metrics"] = store
+    budget = app.config.get("METRICS_QUERY_BUDGET", 50)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_t0", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        t0 = conn.info["metrics_t0"].pop()
+        if has_request_context() and "metrics_t0" in g:
+            g.metrics_queries += 1
+            g.metrics_sql_ms += (time.perf_counter() - t0) * 1000.0
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_t0 = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_ms = 0.0
+
+    # teardown runs after a streamed body has been sent, so exports are timed in full
+    @app.teardown_request
+    def _metrics_finish(_exc):
+        if "metrics_t0" not in g or request.endpoint == "static":
+            return
+        wall_ms = (time.perf_counter() - g.metrics_t0) * 1000.0
+        endpoint = request.endpoint or "<unmatched>"
+        over = g.metrics_queries > budget
+        if over:
+            app.logger.warning("%s %s ran %d SQL statements (budget %d) - likely N+1",
+                               request.method, endpoint, g.metrics_queries, budget)
+        store.record(endpoint, wall_ms, g.metrics_queries, g.metrics_sql_ms, over)
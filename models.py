@@ -1,6 +1,11 @@
 # models.py
-from datetime import date
+import logging
+import time
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
 from flask_login import UserMixin
 
 db = SQLAlchemy()
@@ -21,6 +26,8 @@ class SchoolYear(db.Model):
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
     active = db.Column(db.Boolean, nullable=False, default=True)
+    # set by `flask compact-year`: attendance lives in AttendanceArchive, read-only
+    compacted_at = db.Column(db.DateTime)
 
     def includes(self, d: date) -> bool:
         return self.start_date <= d <= self.end_date
@@ -34,12 +41,27 @@ class Student(db.Model):
     current_grade = db.Column(db.String(10), nullable=True, index=True)
     # roster status
     active = db.Column(db.Boolean, nullable=False, default=True)
+    # student_name_key(first, last); what importers match on. Kept in sync by
+    # the ORM events below; Core inserts must set it themselves.
+    name_key = db.Column(db.String(210), index=True)
 
     # Identity = name (you can add an external_id later if needed)
     __table_args__ = (
         db.UniqueConstraint('first_name','last_name', name='uq_student_identity'),
+        # roster order / keyset pages (pagination.py)
+        db.Index("ix_student_last_first_id", "last_name", "first_name", "id"),
     )
 
+def student_name_key(first_name: str | None, last_name: str | None) -> str:
+    """Case-folded, whitespace-collapsed "last|first", so "smith " matches "Smith"."""
+    norm = lambda s: " ".join((s or "").split()).casefold()
+    return f"{norm(last_name)}|{norm(first_name)}"
+
+@event.listens_for(Student, "before_insert")
+@event.listens_for(Student, "before_update")
+def _set_student_name_key(_mapper, _conn, target):
+    target.name_key = student_name_key(target.first_name, target.last_name)
+
 
 # --- Attendance ---
 class Attendance(db.Model):
@@ -59,6 +81,11 @@ class Attendance(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("student_id", "date", name="uq_attendance_student_date"),
+        # reports/exports (see queries.py); status and grade last so the GROUP BYs
+        # only visit the index and the student rows they join
+        db.Index("ix_attendance_date_student_status_grade", "date", "student_id", "status", "grade_at_time"),
+        db.Index("ix_attendance_year_date_student_status_grade",
+                 "school_year_id", "date", "student_id", "status", "grade_at_time"),
     )
 
 # --- School Calendar ---
@@ -70,27 +97,324 @@ class SchoolCalendar(db.Model):
     description = db.Column(db.String(255))
 
     school_year = db.relationship("SchoolYear", lazy=True)
-    __table_args__ = (db.UniqueConstraint("date", "school_year_id", name="uq_cal_date_year"),)
+    __table_args__ = (
+        db.UniqueConstraint("date", "school_year_id", name="uq_cal_date_year"),
+        # calendar list filtered by year, paged by (date, id)
+        db.Index("ix_cal_year_date_id", "school_year_id", "date", "id"),
+    )
+
+# --- Attendance rollups ---
+class AttendanceRollup(db.Model):
+    """Per-student, per-year, per-month status counts derived from Attendance.
+    Maintained by rollups.refresh_rollups(); rebuild with `flask rebuild-rollups`.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey("student.id"), nullable=False)
+    school_year_id = db.Column(db.Integer, db.ForeignKey("school_year.id"))
+    month = db.Column(db.Date, nullable=False, index=True)  # first day of the month
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    tardy = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)  # includes any other status
+
+    __table_args__ = (
+        db.UniqueConstraint("student_id", "school_year_id", "month", name="uq_rollup_student_year_month"),
+    )
+
+# --- Archived (compacted) attendance ---
+class AttendanceArchive(db.Model):
+    """One student's attendance for a compacted school year, 2 bits per calendar
+    day from start_date (see archive.py). Replaces that year's Attendance rows.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey("student.id"), nullable=False)
+    school_year_id = db.Column(db.Integer, db.ForeignKey("school_year.id"), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)  # day 0 of codes
+    days = db.Column(db.Integer, nullable=False)
+    codes = db.Column(db.LargeBinary, nullable=False)
+    grade = db.Column(db.String(10))  # grade_at_time of the year's records (exceptions are extras)
+
+    __table_args__ = (
+        db.UniqueConstraint("school_year_id", "student_id", name="uq_archive_year_student"),
+    )
+
+class AttendanceArchiveExtra(db.Model):
+    """What a packed day can't hold: notes, a status other than Present/Absent/Tardy
+    (its code is then 0) or a grade_at_time different from the archive row's.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey("student.id"), nullable=False)
+    school_year_id = db.Column(db.Integer, db.ForeignKey("school_year.id"), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20))  # only when not packable
+    notes = db.Column(db.Text)
+    grade_at_time = db.Column(db.String(10))
+    grade_differs = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("student_id", "date", name="uq_archive_extra_student_date"),
+        db.Index("ix_archive_extra_year_date", "school_year_id", "date"),
+    )
+
+# --- Shared cache versions ---
+class CacheVersion(db.Model):
+    """Change counter per family of process-level caches ("calendar", "school_year").
+    Bumped in the writing transaction; every process compares it on each request
+    (sync_cache_versions), so caches and ETags agree across workers and CLI runs.
+    """
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# --- Background import jobs ---
+class ImportJob(db.Model):
+    """One uploaded file processed by jobs.py outside the request."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # attendance_csv/calendar_csv/calendar_ics/students_csv
+    status = db.Column(db.String(20), nullable=False, default="queued")  # queued/running/done/failed
+    filename = db.Column(db.String(255))
+    upload_path = db.Column(db.String(500))  # removed once the job finishes
+    params = db.Column(db.Text)  # JSON: target_year_id, mode, ...
+    created_by_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    owner = db.Column(db.String(120))  # host:pid of the process whose pool holds the job
+    heartbeat_at = db.Column(db.DateTime)  # renewed by the owner; a lapsed lease means it's gone
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.Integer)
+    updated = db.Column(db.Integer)
+    skipped = db.Column(db.Integer)
+    message = db.Column(db.Text)
+    rejects = db.Column(db.Text)  # JSON list of [line_no, reason, row]
+    preview = db.Column(db.Text)  # calendar imports: JSON list of [action, date, year, old, new]
+
+    created_by = db.relationship("User", lazy=True)
 
 # -------- Helpers --------
 NON_SCHOOL_TYPES = {"Holiday", "In-service", "Closed"}
 
+# Process-level interval index over SchoolYear ranges, sorted by start date.
+# (starts, ends, ids, max_end_so_far) or None when it needs reloading.
+# Anything that writes SchoolYear must call invalidate_school_year_index()
+# before committing.
+_year_index = None
+
+def _load_school_year_index():
+    rows = (db.session.query(SchoolYear.start_date, SchoolYear.end_date, SchoolYear.id)
+            .order_by(SchoolYear.start_date, SchoolYear.id).all())
+    starts = [r[0] for r in rows]
+    ends = [r[1] for r in rows]
+    ids = [r[2] for r in rows]
+    # running max of end dates lets a lookup stop early when ranges overlap
+    max_end, running = [], None
+    for e in ends:
+        running = e if running is None or e > running else running
+        max_end.append(running)
+    return starts, ends, ids, max_end
+
+def invalidate_school_year_index():
+    """Drop this process's year index and, with the caller's commit, everyone else's."""
+    global _year_index
+    _year_index = None
+    _bump_cache_version("school_year")
+
+def school_year_id_for_date(d: date) -> int | None:
+    """Id of the SchoolYear whose range covers d (latest start wins on overlap)."""
+    global _year_index
+    idx = _year_index
+    if idx is None:
+        idx = _year_index = _load_school_year_index()
+    starts, ends, ids, max_end = idx
+    i = bisect_right(starts, d) - 1
+    while i >= 0 and max_end[i] >= d:
+        if ends[i] >= d:
+            return ids[i]
+        i -= 1
+    return None
+
 def get_school_year_for_date(d: date):
-    return SchoolYear.query.filter(SchoolYear.start_date <= d, SchoolYear.end_date >= d).first()
+    sy_id = school_year_id_for_date(d)
+    return db.session.get(SchoolYear, sy_id) if sy_id else None
 
-def is_school_day(d: date, school_year_id: int | None = None) -> bool:
-    # weekends off unless explicitly marked Regular in calendar
-    if d.weekday() >= 5:
-        q = SchoolCalendar.query.filter_by(date=d)
-        if school_year_id:
-            q = q.filter_by(school_year_id=school_year_id)
-        cal = q.first()
-        return bool(cal and cal.type == "Regular")
-
-    q = SchoolCalendar.query.filter_by(date=d)
+# Per-school-year school-day bitmap, keyed by school_year_id (None = the whole
+# calendar). Each entry is (first, bits, prefix): bits[i] is 1 when
+# first + i days is a school day, prefix[i] counts school days before it.
+# Days outside [first, first + len(bits)) have no calendar override, so the
+# plain weekday rule applies. Anything that writes SchoolCalendar must call
+# calendar_changed() before committing.
+_school_days = {}
+
+# Last CacheVersion rows seen by this process: name -> (version, changed_at).
+# Caches built from SchoolCalendar (the ICS feed, month grids) put the calendar
+# version in their keys; the feed uses it for its ETag/Last-Modified too.
+# A change made here is entered at once as "<version>-<n>" (never equal to a
+# stored version), so the next sync always adopts the stored one.
+_CACHE_NEVER = datetime(2000, 1, 1)  # changed_at before any recorded change
+_cache_versions = {}
+_cache_synced_at = float("-inf")  # time.monotonic() of the last sync
+_cache_table = None  # cache_version exists (checked again while it doesn't)
+_local_bumps = 0
+
+def _weekdays_between(start: date, end: date) -> int:
+    """Mon-Fri days in [start, end]."""
+    if end < start:
+        return 0
+    full, rem = divmod((end - start).days + 1, 7)
+    wd = start.weekday()
+    return full * 5 + sum(1 for k in range(rem) if (wd + k) % 7 < 5)
+
+def _build_school_days(school_year_id):
+    q = db.session.query(SchoolCalendar.date, SchoolCalendar.type)
     if school_year_id:
-        q = q.filter_by(school_year_id=school_year_id)
-    cal = q.first()
-    if cal and cal.type in NON_SCHOOL_TYPES:
-        return False
-    return True
+        q = q.filter(SchoolCalendar.school_year_id == school_year_id)
+    overrides = {}
+    for d, t in q.order_by(SchoolCalendar.date, SchoolCalendar.id):
+        overrides.setdefault(d, t)  # first entry per date wins
+    if not overrides:
+        return None
+
+    first = min(overrides)
+    n = (max(overrides) - first).days + 1
+    bits = bytearray(n)
+    prefix = array("l", bytes(array("l").itemsize * (n + 1)))
+    for i in range(n):
+        d = first + timedelta(days=i)
+        t = overrides.get(d)
+        if d.weekday() >= 5:
+            # weekends off unless explicitly marked Regular in calendar
+            bits[i] = t == "Regular"
+        else:
+            bits[i] = t not in NON_SCHOOL_TYPES
+        prefix[i + 1] = prefix[i] + bits[i]
+    return first, bits, prefix
+
+def _school_days_for(school_year_id):
+    key = school_year_id or None
+    if key not in _school_days:
+        _school_days[key] = _build_school_days(key)
+    return _school_days[key]
+
+def _has_cache_table() -> bool:
+    global _cache_table
+    if not _cache_table:
+        found = inspect(db.engine).has_table(CacheVersion.__tablename__)
+        if not found and _cache_table is None:
+            logging.getLogger(__name__).warning(
+                "cache_version table missing (run flask upgrade-db); calendar caches are per process")
+        _cache_table = found
+    return _cache_table
+
+def _bump_cache_version(name: str):
+    """Count a change in the current session transaction; the caller commits."""
+    global _cache_versions, _cache_synced_at, _local_bumps
+    now = datetime.utcnow().replace(microsecond=0)
+    _local_bumps += 1
+    base = str(_cache_versions.get(name, (0, None))[0]).split("-")[0]
+    _cache_versions = {**_cache_versions, name: (f"{base}-{_local_bumps}", now)}
+    _cache_synced_at = float("-inf")  # next request reads the stored version
+    if not _has_cache_table():
+        return
+    stmt = _insert_for(CacheVersion.__table__).values(name=name, version=1, changed_at=now)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["name"], set_={"version": CacheVersion.version + 1, "changed_at": now}))
+
+def sync_cache_versions(max_age: float = 0.0):
+    """Compare the shared versions with the ones this process last saw (one small
+    read) and drop whatever changed elsewhere. Called at the start of requests;
+    skipped when the last check is under max_age seconds old, so changes made
+    by other processes show up here within max_age.
+    """
+    global _year_index, _cache_versions, _cache_synced_at
+    now = time.monotonic()
+    if now - _cache_synced_at < max_age:
+        return
+    _cache_synced_at = now
+    if not _has_cache_table():
+        return
+    seen = {name: (v, at) for name, v, at in
+            db.session.query(CacheVersion.name, CacheVersion.version, CacheVersion.changed_at)}
+    if seen.get("calendar") != _cache_versions.get("calendar"):
+        _school_days.clear()
+    if seen.get("school_year") != _cache_versions.get("school_year"):
+        _year_index = None
+    _cache_versions = seen  # swapped whole: import threads read it too
+
+def calendar_changed():
+    """Drop everything derived from SchoolCalendar, here and (with the caller's
+    commit) in other processes; rebuilt lazily on next use.
+    """
+    _school_days.clear()
+    _bump_cache_version("calendar")
+
+def calendar_version():
+    """(version tag, last change time in UTC) for cache keys and HTTP validators,
+    as of the last sync_cache_versions() or change made here.
+    """
+    version, changed_at = _cache_versions.get("calendar", (0, _CACHE_NEVER))
+    return str(version), changed_at
+
+def is_school_day(d: date, school_year_id: int | None = None) -> bool:
+    entry = _school_days_for(school_year_id)
+    if entry:
+        first, bits, _prefix = entry
+        i = (d - first).days
+        if 0 <= i < len(bits):
+            return bool(bits[i])
+    return d.weekday() < 5
+
+def count_school_days(start: date, end: date, school_year_id: int | None = None) -> int:
+    """Number of school days in [start, end], without walking the range."""
+    if end < start:
+        return 0
+    total = _weekdays_between(start, end)
+    entry = _school_days_for(school_year_id)
+    if entry:
+        first, bits, prefix = entry
+        lo = max((start - first).days, 0)
+        hi = min((end - first).days, len(bits) - 1)
+        if lo <= hi:
+            # swap the weekday estimate for the bitmap count where they overlap
+            total -= _weekdays_between(first + timedelta(days=lo), first + timedelta(days=hi))
+            total += prefix[hi + 1] - prefix[lo]
+    return total
+
+def iter_school_days(start: date, end: date, school_year_id: int | None = None):
+    """Yield each school day in [start, end] in order."""
+    entry = _school_days_for(school_year_id)
+    first, bits = (entry[0], entry[1]) if entry else (start, b"")
+    d = start
+    while d <= end:
+        i = (d - first).days
+        if (bits[i] if 0 <= i < len(bits) else d.weekday() < 5):
+            yield d
+        d += timedelta(days=1)
+
+# -------- Bulk writes --------
+# Keep each multi-row statement under SQLite's default bound-parameter limit.
+UPSERT_PARAM_LIMIT = 900
+
+def _insert_for(table):
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def bulk_upsert(model, rows, keys, update_cols, keep_existing=()):
+    """INSERT ... ON CONFLICT(keys) DO UPDATE for a list of dicts, in chunks.
+    - update_cols: columns overwritten from the incoming row on conflict
+    - keep_existing: columns only overwritten when the incoming value is not NULL
+    Runs inside the current session transaction; the caller commits.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    per_stmt = max(1, UPSERT_PARAM_LIMIT // len(rows[0]))
+    for i in range(0, len(rows), per_stmt):
+        stmt = _insert_for(table).values(rows[i:i + per_stmt])
+        set_ = {c: stmt.excluded[c] for c in update_cols}
+        for c in keep_existing:
+            set_[c] = db.func.coalesce(stmt.excluded[c], table.c[c])
+        stmt = stmt.on_conflict_do_update(index_elements=list(keys), set_=set_)
+        db.session.execute(stmt)
@@ -0,0 +1,121 @@
+# pagination.py
+"""Keyset (seek) pagination for the admin lists.
+
+A page is fetched with WHERE (k1, k2, ...) > (cursor values) ORDER BY k1, k2, ...
+LIMIT size + 1, so page 50 costs the same index range scan as page 1. The last
+key must be unique (an id) and all keys NOT NULL. Cursors are opaque, URL-safe
+tokens carrying the key values of the first/last row shown.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date
+
+from flask import request, url_for
+from sqlalchemy import Date, tuple_
+
+PAGE_SIZES = (25, 50, 100, 200)
+DEFAULT_PAGE_SIZE = 50
+
+
+@dataclass
+class Page:
+    rows: list
+    size: int
+    next_url: str | None = None
+    prev_url: str | None = None
+    size_urls: dict | None = None  # page size -> url (back to the first page)
+
+
+def _encode(values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode(token: str, keys):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    out = []
+    for key, v in zip(keys, values):
+        if isinstance(key.type, Date):
+            try:
+                v = date.fromisoformat(v)
+            except (TypeError, ValueError):
+                return None
+        out.append(v)
+    return out
+
+
+def paginate(query, keys, prefix: str = "", key_of=None) -> Page:
+    """One keyset page of query ordered by keys (ascending), driven by the
+    request args {prefix}cursor, {prefix}dir (next/prev) and {prefix}size.
+    key_of(row) returns a row's key values (default: the attributes named
+    like the key columns). Links keep every other request arg, so filters
+    survive paging.
+    """
+    def fetch(cursor, backwards, limit):
+        q = query
+        if cursor is not None:
+            seek = tuple_(*keys)
+            q = q.filter(seek < tuple_(*cursor) if backwards else seek > tuple_(*cursor))
+        q = q.order_by(*[k.desc() for k in keys] if backwards else keys)
+        return q.limit(limit).all()
+
+    key_of = key_of or (lambda row: [getattr(row, k.key) for k in keys])
+    return _page(fetch, keys, prefix, key_of)
+
+
+def paginate_list(rows, keys, key_of, prefix: str = "") -> Page:
+    """paginate() over rows already in memory, sorted by key_of. keys only
+    types the cursor values, so links and cursors work the same as for a query.
+    """
+    def fetch(cursor, backwards, limit):
+        if cursor is None:
+            return rows[:limit]
+        cursor = tuple(cursor)
+        if backwards:
+            return [r for r in reversed(rows) if tuple(key_of(r)) < cursor][:limit]
+        return [r for r in rows if tuple(key_of(r)) > cursor][:limit]
+
+    return _page(fetch, keys, prefix, key_of)
+
+
+def _page(fetch, keys, prefix, key_of) -> Page:
+    args = request.args
+    names = {f"{prefix}cursor", f"{prefix}dir", f"{prefix}size"}
+    size = args.get(f"{prefix}size", DEFAULT_PAGE_SIZE, type=int)
+    size = size if size in PAGE_SIZES else DEFAULT_PAGE_SIZE
+    cursor = _decode(args[f"{prefix}cursor"], keys) if args.get(f"{prefix}cursor") else None
+    backwards = cursor is not None and args.get(f"{prefix}dir") == "prev"
+
+    rows = fetch(cursor, backwards, size + 1)
+    more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    base = {k: v for k, v in args.items() if k not in names}
+
+    def link(n=size, **extra):
+        params = dict(base)
+        if n != DEFAULT_PAGE_SIZE:
+            params[f"{prefix}size"] = n
+        params.update(extra)
+        return url_for(request.endpoint, **(request.view_args or {}), **params)
+
+    page = Page(rows=rows, size=size, size_urls={n: link(n) for n in PAGE_SIZES})
+    if rows:
+        # going forward there's a previous page iff we came from a cursor; going back, the reverse
+        if (more if not backwards else True):
+            page.next_url = link(**{f"{prefix}cursor": _encode(key_of(rows[-1]))})
+        if (more if backwards else cursor is not None):
+            page.prev_url = link(**{f"{prefix}cursor": _encode(key_of(rows[0])), f"{prefix}dir": "prev"})
+    elif cursor is not None:
+        # stepped past the end (rows deleted meanwhile): offer the way back
+        page.prev_url = link(**{f"{prefix}cursor": _encode(cursor), f"{prefix}dir": "prev"})
+    return page
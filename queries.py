@@ -0,0 +1,160 @@
+# queries.py
+"""Query builders for the report and export views.
+
+Kept in one place so the views and `flask explain-queries` run exactly the
+same SQL, and the composite indexes on Attendance can be checked against it.
+"""
+from datetime import date
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import contains_eager
+
+from models import db, Attendance, AttendanceRollup, Student, SchoolYear
+
+
+# grade a record counts under: the snapshot taken with it, else the student's current grade
+RECORD_GRADE = func.coalesce(Attendance.grade_at_time, Student.current_grade)
+
+
+def daily_breakdown(d: date, year_id: int | None = None):
+    """(grade, status, count) for one day; the status totals and the by-grade
+    table are both summed from these rows. Covered by ix_attendance_date_student_status_grade.
+    """
+    q = (db.session.query(RECORD_GRADE.label("grade"), Attendance.status, func.count(Attendance.id))
+         .join(Student, Student.id == Attendance.student_id)
+         .filter(Attendance.date == d))
+    if year_id:
+        q = q.filter(Attendance.school_year_id == year_id)
+    return q.group_by(RECORD_GRADE, Attendance.status)
+
+
+# sort/seek key for daily_records pages (see pagination.py)
+DAILY_RECORD_KEYS = (Student.last_name, Student.first_name, Attendance.id)
+
+
+def daily_records(d: date, year_id: int | None = None):
+    """Attendance rows for one day with their Student loaded by the same join.
+    Unordered; the caller pages it by DAILY_RECORD_KEYS.
+    """
+    q = (db.session.query(Attendance)
+         .join(Student, Student.id == Attendance.student_id)
+         .options(contains_eager(Attendance.student))
+         .filter(Attendance.date == d))
+    if year_id:
+        q = q.filter(Attendance.school_year_id == year_id)
+    return q
+
+
+def _status_sum(status):
+    return func.sum(case((Attendance.status == status, 1), else_=0))
+
+
+def student_range_stats(start: date, end: date, year_id: int | None = None):
+    """(student_id, last_name, first_name, grade, present, absent, tardy, total)
+    over [start, end] from raw attendance, in name order. One row per student
+    and grade, so a student whose grade changed within the range has two.
+    Covered by ix_attendance_date_student_status_grade / ix_attendance_year_date_student_status_grade.
+    """
+    q = (db.session.query(
+            Attendance.student_id,
+            Student.last_name,
+            Student.first_name,
+            RECORD_GRADE.label("grade"),
+            _status_sum("Present").label("present"),
+            _status_sum("Absent").label("absent"),
+            _status_sum("Tardy").label("tardy"),
+            func.count(Attendance.id).label("total"),
+         )
+         .join(Student, Student.id == Attendance.student_id)
+         .filter(Attendance.date >= start, Attendance.date <= end))
+    if year_id:
+        q = q.filter(Attendance.school_year_id == year_id)
+    return (q.group_by(Attendance.student_id, RECORD_GRADE)
+            .order_by(Student.last_name, Student.first_name, Attendance.student_id))
+
+
+def student_month_stats(start: date, end: date, year_id: int | None = None):
+    """Same shape as student_range_stats, read from the monthly rollups.
+    Only valid when [start, end] covers whole months. Rollups keep no
+    grade_at_time, so rows are graded by the student's current grade.
+    """
+    q = (db.session.query(
+            AttendanceRollup.student_id,
+            Student.last_name,
+            Student.first_name,
+            Student.current_grade.label("grade"),
+            func.sum(AttendanceRollup.present).label("present"),
+            func.sum(AttendanceRollup.absent).label("absent"),
+            func.sum(AttendanceRollup.tardy).label("tardy"),
+            func.sum(AttendanceRollup.total).label("total"),
+         )
+         .join(Student, Student.id == AttendanceRollup.student_id)
+         .filter(AttendanceRollup.month >= start, AttendanceRollup.month <= end))
+    if year_id:
+        q = q.filter(AttendanceRollup.school_year_id == year_id)
+    return (q.group_by(AttendanceRollup.student_id)
+            .order_by(Student.last_name, Student.first_name, AttendanceRollup.student_id))
+
+
+def grade_order(grade):
+    """Sort key for grade labels: K, then numeric grades, then the rest, blanks last."""
+    g = (grade or "").strip()
+    if not g:
+        return (3, 0, "")
+    if g.upper() in ("K", "KG"):
+        return (0, 0, g)
+    return (1, int(g), g) if g.isascii() and g.isdigit() else (2, 0, g)
+
+
+def fold_stats(rows):
+    """Fold student_range_stats/student_month_stats rows into per-student
+    totals (name order kept) and per-grade totals. Returns (students, grades):
+    students is a list of dicts; grades maps grade -> dict of the counts.
+    """
+    students, grades = {}, {}
+    for sid, last, first, grade, *counts in rows:
+        s = students.setdefault(sid, {"id": sid, "name": f"{last}, {first}", "grades": [],
+                                      "present": 0, "absent": 0, "tardy": 0, "total": 0})
+        s["grades"].append(grade)
+        g = grades.setdefault(grade, {"present": 0, "absent": 0, "tardy": 0, "total": 0})
+        for key, n in zip(("present", "absent", "tardy", "total"), counts):
+            s[key] += n or 0
+            g[key] += n or 0
+    for s in students.values():
+        s["grade"] = " / ".join(g or "-" for g in sorted(s.pop("grades"), key=grade_order))
+        s["pct"] = round(s["present"] * 100.0 / s["total"], 1) if s["total"] else None
+    return list(students.values()), dict(sorted(grades.items(), key=lambda kv: grade_order(kv[0])))
+
+
+def fold_daily(rows):
+    """Fold daily_breakdown rows into (status -> count, grade -> {status: count, "total": n})."""
+    counts, grades = {}, {}
+    for grade, status, n in rows:
+        counts[status] = counts.get(status, 0) + n
+        g = grades.setdefault(grade, {"total": 0})
+        g[status] = g.get(status, 0) + n
+        g["total"] += n
+    return counts, dict(sorted(grades.items(), key=lambda kv: grade_order(kv[0])))
+
+
+def attendance_export(start: date, end: date, year_id: int | None = None):
+    """Export rows in (date, student_id) order, names and year joined in."""
+    q = (
+        db.session.query(
+            Attendance.date,
+            Student.last_name,
+            Student.first_name,
+            Attendance.grade_at_time,
+            Student.current_grade,
+            Attendance.status,
+            Attendance.notes,
+            SchoolYear.name,
+            Attendance.student_id,
+        )
+        .join(Student, Student.id == Attendance.student_id)
+        .outerjoin(SchoolYear, SchoolYear.id == Attendance.school_year_id)
+        .filter(Attendance.date >= start, Attendance.date <= end)
+    )
+    if year_id:
+        q = q.filter(Attendance.school_year_id == year_id)
+    return q.order_by(Attendance.date, Attendance.student_id)
@@ -0,0 +1,91 @@
+# rollups.py
+"""Maintenance of the AttendanceRollup table.
+
+Writers pass the (student_id, date) cells they touched to refresh_rollups(),
+which recomputes just those student-months from Attendance inside the
+caller's transaction. Rollups of compacted years (see archive.py) come from
+the archive and are left alone, except by rebuild_rollups().
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import case, func, literal, select
+
+from archive import rebuild_archived_rollups
+from models import db, Attendance, AttendanceRollup, SchoolYear
+
+# keep IN (...) lists under SQLite's bound-parameter limit
+_ID_CHUNK = 500
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def next_month(m: date) -> date:
+    return date(m.year + 1, 1, 1) if m.month == 12 else date(m.year, m.month + 1, 1)
+
+
+def is_whole_months(start: date, end: date) -> bool:
+    """True when [start, end] starts on a 1st and ends on a month's last day."""
+    return start.day == 1 and (end + timedelta(days=1)).day == 1
+
+
+def _refresh_month(m: date, student_ids=None):
+    """Recompute rollup rows for month m (optionally only some students)."""
+    compacted = select(SchoolYear.id).where(SchoolYear.compacted_at.isnot(None))
+    delete_q = AttendanceRollup.query.filter(
+        AttendanceRollup.month == m,
+        AttendanceRollup.school_year_id.is_(None) | AttendanceRollup.school_year_id.notin_(compacted),
+    )
+    agg = (
+        select(
+            Attendance.student_id,
+            Attendance.school_year_id,
+            literal(m, db.Date),
+            func.sum(case((Attendance.status == "Present", 1), else_=0)),
+            func.sum(case((Attendance.status == "Absent", 1), else_=0)),
+            func.sum(case((Attendance.status == "Tardy", 1), else_=0)),
+            func.count(Attendance.id),
+        )
+        .where(Attendance.date >= m, Attendance.date < next_month(m),
+               Attendance.school_year_id.is_(None) | Attendance.school_year_id.notin_(compacted))
+        .group_by(Attendance.student_id, Attendance.school_year_id)
+    )
+    cols = ["student_id", "school_year_id", "month", "present", "absent", "tardy", "total"]
+
+    if student_ids is None:
+        delete_q.delete(synchronize_session=False)
+        db.session.execute(AttendanceRollup.__table__.insert().from_select(cols, agg))
+        return
+
+    ids = sorted(student_ids)
+    for i in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[i:i + _ID_CHUNK]
+        delete_q.filter(AttendanceRollup.student_id.in_(chunk)).delete(synchronize_session=False)
+        db.session.execute(AttendanceRollup.__table__.insert().from_select(
+            cols, agg.where(Attendance.student_id.in_(chunk))))
+
+
+def refresh_rollups(cells):
+    """Recompute the rollups covering the given (student_id, date) pairs.
+    Runs in the current session transaction; the caller commits.
+    """
+    by_month = {}
+    for sid, d in cells:
+        by_month.setdefault(month_start(d), set()).add(sid)
+    for m, sids in sorted(by_month.items()):
+        _refresh_month(m, sids)
+
+
+def rebuild_rollups() -> int:
+    """Recompute the whole table month by month. Returns the row count."""
+    AttendanceRollup.query.delete(synchronize_session=False)
+    lo, hi = db.session.query(func.min(Attendance.date), func.max(Attendance.date)).one()
+    if lo:
+        m = month_start(lo)
+        while m <= hi:
+            _refresh_month(m)
+            m = next_month(m)
+    rebuild_archived_rollups()
+    db.session.commit()
+    return AttendanceRollup.query.count()
@@ -0,0 +1,102 @@
+# search.py
+"""Student name search.
+
+On SQLite the roster is indexed in an FTS5 table (student_fts) that reads its
+text from the student table and is kept in sync by triggers, so Core bulk
+inserts are covered as well as ORM writes. Every search term is matched as a
+prefix: "jo sm" finds "Smith, John". Other databases, or an SQLite build
+without FTS5, fall back to LIKE prefix matching on the name columns.
+
+The table is created with the student table (init-db) and by upgrade-db for
+existing databases.
+"""
+import re
+
+from sqlalchemy import column, event, inspect, or_, table, text
+
+from models import db, Student
+
+FTS_TABLE = "student_fts"
+_fts = table(FTS_TABLE, column("rowid"), column("rank"), column(FTS_TABLE))
+
+_COLS = "first_name, last_name, current_grade"
+_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({_COLS}, content='student', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON student BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLS}) VALUES (new.id, new.first_name, new.last_name, new.current_grade); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON student BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLS}) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.current_grade); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {_COLS} ON student BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLS}) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.current_grade); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_COLS}) VALUES (new.id, new.first_name, new.last_name, new.current_grade); END",
+]
+
+# engine url -> bool, so the table check runs once per process
+_available = {}
+
+
+def install_student_search(conn) -> bool:
+    """Create the FTS table and triggers if missing and (re)build the index.
+    Returns False when the database can't host it (not SQLite, or no FTS5).
+    """
+    if conn.dialect.name != "sqlite":
+        return False
+    try:
+        for stmt in _DDL:
+            conn.exec_driver_sql(stmt)
+    except Exception:
+        return False
+    conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _available.clear()
+    return True
+
+
+@event.listens_for(Student.__table__, "after_create")
+def _student_table_created(_target, conn, **_kw):
+    install_student_search(conn)
+
+
+def _has_fts() -> bool:
+    key = str(db.engine.url)
+    if key not in _available:
+        _available[key] = db.engine.dialect.name == "sqlite" and inspect(db.engine).has_table(FTS_TABLE)
+    return _available[key]
+
+
+def _terms(q: str):
+    return re.findall(r"\w+", q or "")
+
+
+def student_match(q: str):
+    """Filter for Student rows matching every term of q as a prefix."""
+    terms = _terms(q)
+    if not terms:
+        return text("1 = 1")
+    if _has_fts():
+        match = " ".join(f'"{t}"*' for t in terms)
+        return Student.id.in_(db.select(_fts.c.rowid).where(_fts.c[FTS_TABLE].op("MATCH")(match)))
+    return db.and_(*[or_(Student.first_name.ilike(f"{t}%"), Student.last_name.ilike(f"{t}%"),
+                         Student.current_grade.ilike(f"{t}%")) for t in terms])
+
+
+def search_students(q: str, limit: int = 10, offset: int = 0, active_only: bool = False):
+    """Best matches first (bm25 on SQLite), then by name. Returns (students, has_more)."""
+    terms = _terms(q)
+    if not terms:
+        return [], False
+    query = db.session.query(Student)
+    if _has_fts():
+        match = " ".join(f'"{t}"*' for t in terms)
+        query = (query.join(_fts, _fts.c.rowid == Student.id)
+                 .filter(_fts.c[FTS_TABLE].op("MATCH")(match))
+                 .order_by(_fts.c.rank))
+    else:
+        query = query.filter(student_match(q))
+    if active_only:
+        query = query.filter(Student.active.is_(True))
+    rows = (query.order_by(Student.last_name, Student.first_name, Student.id)
+            .offset(offset).limit(limit + 1).all())
+    return rows[:limit], len(rows) > limit
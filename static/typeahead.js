@@ -0,0 +1,66 @@
+// typeahead.js - student search dropdown backed by admin.student_search.
+// attachTypeahead(input, url, onPick): shows matches under the input as you
+// type; "More..." loads the next page. onPick receives {id, name, grade, active}.
+function attachTypeahead(input, url, onPick) {
+  const menu = document.createElement("div");
+  menu.className = "list-group position-absolute shadow-sm";
+  menu.style.zIndex = 1000;
+  menu.style.minWidth = input.offsetWidth + "px";
+  menu.hidden = true;
+  input.parentNode.style.position = "relative";
+  input.parentNode.appendChild(menu);
+  input.setAttribute("autocomplete", "off");
+
+  let timer = null;
+  let seq = 0;
+
+  function item(label, cls, handler) {
+    const a = document.createElement("button");
+    a.type = "button";
+    a.className = "list-group-item list-group-item-action " + (cls || "");
+    a.textContent = label;
+    a.addEventListener("mousedown", e => { e.preventDefault(); handler(); });
+    return a;
+  }
+
+  function fetchPage(q, offset, append) {
+    const mine = ++seq;
+    const sep = url.includes("?") ? "&" : "?";
+    fetch(url + sep + "q=" + encodeURIComponent(q) + "&offset=" + offset)
+      .then(r => r.json())
+      .then(data => {
+        if (mine !== seq) return;  // a newer keystroke won
+        if (!append) menu.replaceChildren();
+        const more = menu.querySelector(".typeahead-more");
+        if (more) more.remove();
+        data.results.forEach(s => {
+          const label = s.name + (s.grade ? " (" + s.grade + ")" : "") + (s.active ? "" : " - inactive");
+          menu.appendChild(item(label, "", () => { menu.hidden = true; onPick(s); }));
+        });
+        if (data.next_offset !== null) {
+          menu.appendChild(item("More...", "typeahead-more text-muted small",
+                                () => fetchPage(q, data.next_offset, true)));
+        }
+        if (!menu.children.length) {
+          menu.appendChild(item("No matches", "disabled text-muted small", () => {}));
+        }
+        menu.hidden = false;
+      })
+      .catch(() => {});
+  }
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    const q = input.value.trim();
+    if (!q) { menu.hidden = true; return; }
+    timer = setTimeout(() => fetchPage(q, 0, false), 150);
+  });
+  input.addEventListener("blur", () => { menu.hidden = true; });
+  input.addEventListener("keydown", e => {
+    if (e.key === "Escape") menu.hidden = true;
+    if (e.key === "Enter" && !menu.hidden) {
+      const first = menu.querySelector(".list-group-item:not(.disabled):not(.typeahead-more)");
+      if (first) { e.preventDefault(); first.dispatchEvent(new MouseEvent("mousedown")); }
+    }
+  });
+}
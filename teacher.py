@@ -1,7 +1,9 @@
 from datetime import date
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required
-from models import db, Student, Attendance, get_school_year_for_date, is_school_day
+from models import db, Student, Attendance, get_school_year_for_date, is_school_day, bulk_upsert
+from rollups import refresh_rollups
+from archive import archived_records
 
 teacher_bp = Blueprint("teacher", __name__, url_prefix="/attendance")
 
@@ -20,23 +22,46 @@ def take_attendance():
 
     students = Student.query.filter_by(active=True).order_by(Student.last_name, Student.first_name).all()
 
+    compacted = bool(sy and sy.compacted_at)
+    existing = {r.student_id: r for r in Attendance.query.filter_by(date=selected).all()}
+    if compacted:
+        # closed year: show what was recorded, from the archive (over any live rows)
+        existing.update((r.student_id, r) for r in archived_records(selected, selected, sy_id))
+
+    if request.method == "POST" and compacted:
+        flash(f"{sy.name} is archived and read-only (flask expand-year to edit it)", "danger")
+        return redirect(url_for("teacher.take_attendance", date=selected.isoformat()))
+
     if request.method == "POST" and not non_school:
+        # diff the form against the day's records; write only what changed
+        changed = []
         for s in students:
             status = request.form.get(f"status_{s.id}", "Present")
             notes = request.form.get(f"notes_{s.id}", "").strip() or None
-            rec = Attendance.query.filter_by(student_id=s.id, date=selected).first()
-            if not rec:
-                rec = Attendance(student_id=s.id, date=selected, school_year_id=sy_id)
-                db.session.add(rec)
-            rec.status = status
-            rec.notes = notes
-            if sy_id and rec.school_year_id != sy_id:
-                rec.school_year_id = sy_id
-        db.session.commit()
-        flash(f"Attendance saved for {selected.isoformat()}", "success")
+            rec = existing.get(s.id)
+            if (rec and rec.status == status and rec.notes == notes
+                    and not (sy_id and rec.school_year_id != sy_id)):
+                continue
+            changed.append({
+                "student_id": s.id,
+                "date": selected,
+                "status": status,
+                "notes": notes,
+                "school_year_id": sy_id,
+            })
+        if changed:
+            bulk_upsert(
+                Attendance,
+                changed,
+                keys=("student_id", "date"),
+                update_cols=("status", "notes"),
+                keep_existing=("school_year_id",),
+            )
+            refresh_rollups((r["student_id"], selected) for r in changed)
+            db.session.commit()
+        flash(f"Attendance saved for {selected.isoformat()} ({len(changed)} changed)", "success")
         return redirect(url_for("teacher.take_attendance", date=selected.isoformat()))
 
-    existing = {r.student_id: r for r in Attendance.query.filter_by(date=selected).all()}
     return render_template("attendance.html",
                            students=students, selected=selected, existing=existing,
-                           non_school=non_school, school_year=sy)
+                           non_school=non_school, school_year=sy, compacted=compacted)
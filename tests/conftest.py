@@ -0,0 +1,47 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The app on a fresh SQLite database in tmp_path, tables created."""
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.db'}")
+    import models
+    from app import create_app
+    from models import db
+
+    # process-level caches belong to the previous test's database
+    models._school_days.clear()
+    monkeypatch.setattr(models, "_year_index", None)
+    monkeypatch.setattr(models, "_cache_versions", {})
+    monkeypatch.setattr(models, "_cache_synced_at", float("-inf"))
+    monkeypatch.setattr(models, "_cache_table", None)
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as an admin."""
+    from werkzeug.security import generate_password_hash
+    from models import db, User
+
+    with app.app_context():
+        db.session.add(User(username="admin", role="admin", password_hash=generate_password_hash("x")))
+        db.session.commit()
+    client = app.test_client()
+    client.post("/login", data={"username": "admin", "password": "x"})
+    return client
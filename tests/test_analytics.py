@@ -0,0 +1,57 @@
+# tests/test_analytics.py
+from datetime import date
+
+import numpy as np
+import pytest
+
+import analytics
+from analytics import ABSENT, NO_RECORD as N, PRESENT as P, TARDY as T, YearMatrix
+
+A = ABSENT
+
+
+def test_longest_runs():
+    mask = np.array([[1, 1, 0, 1, 1, 1, 0, 0, 1],
+                     [0, 0, 0, 0, 0, 0, 0, 0, 0],
+                     [1, 1, 1, 1, 1, 1, 1, 1, 1]], bool)
+    assert analytics.longest_runs(mask).tolist() == [3, 0, 9]
+    assert analytics.longest_runs(np.zeros((2, 0), bool)).tolist() == [0, 0]
+
+
+def test_rolling_rates():
+    hits = np.array([[1, 1, 0, 1, 0, 0]], bool)
+    marked = np.array([[1, 1, 1, 1, 0, 1]], bool)
+    # windows of 3: hits 2,2,1,1 over marked 3,3,2,2
+    rates = analytics.rolling_rates(hits, marked, 3, min_marked=2)
+    assert rates.tolist() == [[2 / 3, 2 / 3, 0.5, 0.5]]
+    # too few marked days in a window: NaN
+    assert np.isnan(analytics.rolling_rates(hits, marked, 3, min_marked=3)[0, 2:]).all()
+    # fewer days than the window: one window over everything
+    assert analytics.rolling_rates(hits, marked, 30).tolist() == [[3 / 5]]
+
+
+def test_absence_report_measures_and_chronic_flag(monkeypatch):
+    cells = np.array([
+        [P] * 10 + [A] * 2,          # 2/12 = 16.7%: chronic
+        [P] * 11 + [A],              # 1/12 = 8.3%: not chronic
+        [A, A, A] + [N] * 9,         # 100% but only 3 marked days: too early to flag
+        [T, A, A, A, P] + [P] * 7,   # 25%, streak of 3
+    ], np.int8)
+    days = np.arange("2021-09-01", "2021-09-13", dtype="datetime64[D]")
+    mx = YearMatrix(year=None, days=days, student_ids=np.array([1, 2, 3, 4]),
+                    last_names=list("ABCD"), first_names=list("abcd"), grades=["3"] * 4, cells=cells)
+    monkeypatch.setattr(analytics, "load_year_matrix", lambda year, as_of=None: mx)
+    monkeypatch.setattr(analytics, "WINDOWS", (4,))
+
+    rep = analytics.absence_report(None, 0.10, as_of=date(2021, 9, 12))
+    assert rep.marked.tolist() == [12, 12, 3, 12]
+    assert rep.absent.tolist() == [2, 1, 3, 3]
+    assert rep.tardy.tolist() == [0, 0, 0, 1]
+    assert rep.longest_streak.tolist() == [2, 1, 3, 3]
+    assert rep.chronic.tolist() == [True, False, False, True]
+    assert rep.rate[0] == pytest.approx(2 / 12)
+    # last 4 school days; worst 4-day stretch
+    assert rep.latest[4].tolist()[:2] == [0.5, 0.25]
+    assert rep.peak[4][3] == pytest.approx(0.75)
+    assert np.isnan(rep.latest[4][2])  # nothing marked lately
+    assert [r["student_id"] for r in rep.rows(chronic_only=True)] == [4, 1]
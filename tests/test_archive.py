@@ -0,0 +1,149 @@
+# tests/test_archive.py
+import re
+from datetime import date, timedelta
+
+import analytics
+from models import db, Attendance, AttendanceRollup, SchoolYear, Student
+
+DAY = date(2021, 10, 4)
+
+
+def _seed_compacted(app):
+    """2021-22 with Ada's record on DAY, compacted; returns (year id, Ada's id, Alan's id)."""
+    with app.app_context():
+        y = SchoolYear(name="2021-22", start_date=date(2021, 9, 1), end_date=date(2022, 6, 14))
+        ada = Student(first_name="Ada", last_name="Lovelace", current_grade="3")
+        alan = Student(first_name="Alan", last_name="Turing", current_grade="4")
+        db.session.add_all([y, ada, alan])
+        db.session.flush()
+        db.session.add(Attendance(student_id=ada.id, date=DAY, status="Present", grade_at_time="3",
+                                  school_year_id=y.id))
+        db.session.commit()
+        ids = y.id, ada.id, alan.id
+    result = app.test_cli_runner().invoke(args=["compact-year", "2021-22"])
+    assert result.exception is None, result.output
+    return ids
+
+
+def _daily_counts(html):
+    return {s: int(n) for s, n in re.findall(r"<span>(Present|Absent|Tardy)</span><span>(\d+)</span>", html)}
+
+
+def test_backfill_leaves_compacted_years_alone(app, client):
+    _yid, _ada, alan = _seed_compacted(app)
+    with app.app_context():
+        db.session.add(Attendance(student_id=alan, date=DAY, status="Absent"))
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["backfill-years"])
+    assert result.exception is None, result.output
+    assert "1 rows left unset" in result.output
+    with app.app_context():
+        assert Attendance.query.filter_by(student_id=alan).one().school_year_id is None
+
+    # the day's report shows the archived record and the live one
+    html = client.get(f"/admin/reports?date={DAY}").get_data(as_text=True)
+    assert _daily_counts(html) == {"Present": 1, "Absent": 1, "Tardy": 0}
+    assert "Lovelace" in html and "Turing" in html
+
+
+def test_live_rows_filed_under_a_compacted_year_are_merged(app, client):
+    yid, ada, alan = _seed_compacted(app)
+    with app.app_context():
+        # as an older backfill-years would have left it
+        db.session.add(Attendance(student_id=alan, date=DAY, status="Tardy", school_year_id=yid))
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-rollups"])
+    assert result.exception is None, result.output
+
+    with app.app_context():
+        rollups = {r.student_id: (r.present, r.tardy, r.total)
+                   for r in AttendanceRollup.query.filter_by(school_year_id=yid)}
+        assert rollups == {ada: (1, 0, 1), alan: (0, 1, 1)}
+
+        mx = analytics.load_year_matrix(db.session.get(SchoolYear, yid), as_of=date(2021, 10, 8))
+        col = int((mx.days == mx.days.dtype.type(DAY)).argmax())
+        assert dict(zip(mx.student_ids.tolist(), mx.cells[:, col].tolist())) == {
+            ada: analytics.PRESENT, alan: analytics.TARDY}
+
+    html = client.get(f"/admin/reports?date={DAY}&year_id={yid}").get_data(as_text=True)
+    assert _daily_counts(html) == {"Present": 1, "Absent": 0, "Tardy": 1}
+
+
+STATUSES = ("Present", "Present", "Absent", "Tardy", "Present", "Excused", "Present")
+
+
+def _seed_year(app):
+    """Two months of a year for three students, with an unpackable status, notes,
+    records without a grade and a grade change; returns the year id.
+    """
+    with app.app_context():
+        y = SchoolYear(name="2021-22", start_date=date(2021, 9, 1), end_date=date(2022, 6, 14))
+        students = [Student(first_name=f, last_name=l, current_grade=g)
+                    for f, l, g in (("Ada", "Lovelace", "3"), ("Alan", "Turing", "4"), ("Grace", "Hopper", "5"))]
+        db.session.add(y)
+        db.session.add_all(students)
+        db.session.flush()
+        d, i = date(2021, 9, 1), 0
+        while d <= date(2021, 10, 29):
+            if d.weekday() < 5:
+                for k, s in enumerate(students):
+                    i += 1
+                    grade = s.current_grade
+                    if s.last_name == "Hopper" and d.month == 9:
+                        grade = "4"  # moved up a grade in October
+                    elif s.last_name == "Turing" and i % 5 == 0:
+                        grade = None
+                    db.session.add(Attendance(
+                        student_id=s.id, date=d, status=STATUSES[(i + k) % len(STATUSES)],
+                        notes=f"note {i}" if i % 4 == 0 else None, grade_at_time=grade, school_year_id=y.id))
+            d += timedelta(days=1)
+        db.session.commit()
+        return y.id
+
+
+def _attendance(app):
+    with app.app_context():
+        return sorted((a.student_id, a.date, a.status, a.notes, a.grade_at_time, a.school_year_id)
+                      for a in Attendance.query)
+
+
+def _snapshot(client, yid):
+    urls = [f"/admin/reports?date={d}&rec_size=100" for d in ("2021-09-03", "2021-09-08", "2021-10-13")]
+    urls += [
+        "/admin/reports?date=2021-09-01&start=2021-09-06&end=2021-10-20",
+        "/admin/reports?date=2021-09-01&start=2021-09-01&end=2021-10-31",
+        f"/admin/reports?date=2021-09-01&year_id={yid}&start=2021-09-06&end=2021-10-20",
+        "/admin/attendance/export?start=2021-08-01&end=2021-12-31",
+        f"/admin/analytics/absence.csv?year_id={yid}&chronic_only=0",
+    ]
+    out = {}
+    for url in urls:
+        resp = client.get(url)
+        assert resp.status_code == 200, url
+        # the pager's cursors key live rows by id, archived ones by student id
+        out[url] = re.sub(r'<nav class="d-flex align-items-center gap-2 my-2 small">.*?</nav>', "",
+                          resp.get_data(as_text=True), flags=re.S)
+    return out
+
+
+def test_compact_and_expand_round_trip(app, client):
+    yid = _seed_year(app)
+    rows = _attendance(app)
+    assert {r[2] for r in rows} == {"Present", "Absent", "Tardy", "Excused"}
+    before = _snapshot(client, yid)
+    export = before["/admin/attendance/export?start=2021-08-01&end=2021-12-31"]
+    assert "Excused" in export and "note 4" in export
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["compact-year", "2021-22"])
+    assert result.exception is None, result.output
+    assert _attendance(app) == []
+    assert " 0 extras" not in result.output
+    after = _snapshot(client, yid)
+    for url in before:
+        assert after[url] == before[url], url
+
+    result = runner.invoke(args=["expand-year", "2021-22"])
+    assert result.exception is None, result.output
+    assert _attendance(app) == rows
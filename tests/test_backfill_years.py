@@ -0,0 +1,39 @@
+# tests/test_backfill_years.py
+from datetime import date
+
+from models import db, SchoolYear, SchoolCalendar
+
+
+def _calendar(app):
+    with app.app_context():
+        return sorted((c.date, c.description, c.school_year_id) for c in SchoolCalendar.query)
+
+
+def test_backfill_years_calendar_duplicates(app):
+    with app.app_context():
+        y = SchoolYear(name="2021-22", start_date=date(2021, 9, 1), end_date=date(2022, 6, 14))
+        db.session.add(y)
+        db.session.flush()
+        db.session.add_all([
+            # two year-less rows on one date: only the first gets the year
+            SchoolCalendar(date=date(2021, 10, 1), type="holiday", description="a"),
+            SchoolCalendar(date=date(2021, 10, 1), type="holiday", description="b"),
+            # the covering year already has an entry for this date: left alone
+            SchoolCalendar(date=date(2021, 10, 4), type="holiday", description="has", school_year_id=y.id),
+            SchoolCalendar(date=date(2021, 10, 4), type="holiday", description="null"),
+            SchoolCalendar(date=date(2021, 10, 5), type="holiday", description="plain"),
+        ])
+        db.session.commit()
+        yid = y.id
+
+    for chunk in ("5000", "1"):
+        result = app.test_cli_runner().invoke(args=["backfill-years", "--chunk-size", chunk])
+        assert result.exception is None, result.output
+
+    assert _calendar(app) == [
+        (date(2021, 10, 1), "a", yid),
+        (date(2021, 10, 1), "b", None),
+        (date(2021, 10, 4), "has", yid),
+        (date(2021, 10, 4), "null", None),
+        (date(2021, 10, 5), "plain", yid),
+    ]
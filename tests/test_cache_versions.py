@@ -0,0 +1,104 @@
+# tests/test_cache_versions.py
+from datetime import date, datetime
+
+from sqlalchemy import event, text
+
+import models
+from models import db, SchoolYear, is_school_day, school_year_id_for_date
+
+FEED = "/calendar/feed.ics?token=t"
+
+
+def _other_process(app, *statements):
+    """Write as another worker/CLI would: its own connection, bump included."""
+    with app.app_context(), db.engine.begin() as conn:
+        for sql, params in statements:
+            conn.execute(text(sql), params)
+
+
+def _bump(name):
+    return ("INSERT INTO cache_version (name, version, changed_at) VALUES (:n, 1, :at) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1, changed_at = :at",
+            {"n": name, "at": datetime(2030, 1, 1)})
+
+
+def test_caches_follow_writes_from_other_processes(app):
+    app.config["CALENDAR_FEED_TOKEN"] = "t"
+    app.config["CACHE_SYNC_S"] = 0
+    with app.app_context():
+        db.session.add(SchoolYear(name="2021-22", start_date=date(2021, 9, 1), end_date=date(2022, 6, 14)))
+        db.session.commit()
+    client = app.test_client()
+
+    def in_request(fn):
+        with app.test_request_context():
+            app.preprocess_request()
+            return fn()
+
+    first = client.get(FEED)
+    assert client.get(FEED).headers["ETag"] == first.headers["ETag"]
+    assert in_request(lambda: is_school_day(date(2021, 10, 6)))
+    assert in_request(lambda: school_year_id_for_date(date(2022, 9, 1))) is None
+
+    _other_process(
+        app,
+        ("INSERT INTO school_calendar (date, type, description) VALUES ('2021-10-06', 'Holiday', 'Snow day')", {}),
+        _bump("calendar"),
+        ("INSERT INTO school_year (name, start_date, end_date, active) "
+         "VALUES ('2022-23', '2022-08-15', '2023-06-14', 1)", {}),
+        _bump("school_year"),
+    )
+
+    assert not in_request(lambda: is_school_day(date(2021, 10, 6)))
+    assert in_request(lambda: school_year_id_for_date(date(2022, 9, 1))) is not None
+    second = client.get(FEED)
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert b"Snow day" in second.data
+    # the tag comes from the database, so every worker sends the same one
+    assert client.get(FEED, headers={"If-None-Match": second.headers["ETag"]}).status_code == 304
+
+
+def _count_queries(app, fn):
+    n = [0]
+
+    def count(*_args):
+        n[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        fn()
+    finally:
+        with app.app_context():
+            event.remove(db.engine, "before_cursor_execute", count)
+    return n[0]
+
+
+def test_feed_revalidation_within_sync_interval_skips_the_database(app):
+    app.config["CALENDAR_FEED_TOKEN"] = "t"
+    app.config["CACHE_SYNC_S"] = 60
+    client = app.test_client()
+    etag = client.get(FEED).headers["ETag"]
+
+    def revalidate():
+        assert client.get(FEED, headers={"If-None-Match": etag}).status_code == 304
+
+    assert _count_queries(app, revalidate) == 0
+
+
+def test_missing_cache_version_table_falls_back_to_this_process(app, client, monkeypatch):
+    app.config["CALENDAR_FEED_TOKEN"] = "t"
+    app.config["CACHE_SYNC_S"] = 0
+    with app.app_context():
+        db.session.execute(text("DROP TABLE cache_version"))
+        db.session.commit()
+    monkeypatch.setattr(models, "_cache_table", None)  # as a process started before upgrade-db
+    first = client.get(FEED)
+    assert first.status_code == 200
+
+    resp = client.post("/admin/calendar/new", data={"date": "2021-10-06", "type": "Holiday",
+                                                   "description": "Snow day"})
+    assert resp.status_code == 302
+    second = client.get(FEED)
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert b"Snow day" in second.data
@@ -0,0 +1,59 @@
+# tests/test_calendar_import.py
+import io
+import json
+from datetime import date
+
+import pytest
+
+from importers import apply_calendar_diff, diff_calendar_rows
+from models import db, ImportJob, SchoolCalendar
+
+HOLIDAYS = {(date(2021, 11, 25), None): ("Holiday", "Thanksgiving"),
+            (date(2022, 1, 17), None): ("Holiday", "MLK Day")}
+
+
+def _seed(app):
+    with app.app_context():
+        db.session.add_all([
+            SchoolCalendar(date=date(2021, 11, 25), type="Closed", description="Thanksgiving"),
+            SchoolCalendar(date=date(2021, 11, 25), type="Closed", description="duplicate"),
+            SchoolCalendar(date=date(2021, 12, 23), type="Holiday", description="Winter break"),
+            SchoolCalendar(date=date(2022, 1, 3), type="In-service", description="PD day"),
+        ])
+        db.session.commit()
+
+
+def _calendar(app):
+    with app.app_context():
+        return sorted((c.date.isoformat(), c.type, c.description) for c in SchoolCalendar.query)
+
+
+@pytest.mark.parametrize("mode, expected", [
+    ("merge", [("2021-11-25", "Closed", "duplicate"), ("2021-11-25", "Holiday", "Thanksgiving"),
+               ("2021-12-23", "Holiday", "Winter break"), ("2022-01-03", "In-service", "PD day"),
+               ("2022-01-17", "Holiday", "MLK Day")]),
+    # the file's days only: the duplicate goes, the school's own days stay
+    ("replace", [("2021-11-25", "Holiday", "Thanksgiving"), ("2021-12-23", "Holiday", "Winter break"),
+                 ("2022-01-03", "In-service", "PD day"), ("2022-01-17", "Holiday", "MLK Day")]),
+    ("sync", [("2021-11-25", "Holiday", "Thanksgiving"), ("2022-01-17", "Holiday", "MLK Day")]),
+])
+def test_calendar_import_modes(app, mode, expected):
+    _seed(app)
+    with app.app_context():
+        apply_calendar_diff(diff_calendar_rows(HOLIDAYS, mode))
+    assert _calendar(app) == expected
+
+
+def test_sync_import_is_previewed_first(app, client):
+    app.config["JOBS_INLINE"] = True
+    _seed(app)
+    before = _calendar(app)
+    data = b"date,type,description,year\n2021-11-25,Holiday,Thanksgiving,\n2022-01-17,Holiday,MLK Day,\n"
+    client.post("/admin/calendar/import_csv", data={"file": (io.BytesIO(data), "c.csv"), "mode": "sync"},
+                content_type="multipart/form-data")
+    with app.app_context():
+        job = ImportJob.query.one()
+        assert job.status == "done" and job.message.startswith("Preview")
+        deleted = [c[1] for c in json.loads(job.preview) if c[0] == "delete"]
+        assert deleted == ["2021-11-25", "2021-12-23", "2022-01-03"]
+    assert _calendar(app) == before
@@ -0,0 +1,11 @@
+# tests/test_calendar_ui.py
+import pytest
+
+
+@pytest.mark.parametrize("year, month, status", [
+    (1, 1, 400), (1, 12, 400), (2, 1, 200), (9998, 12, 200), (9999, 1, 400), (2021, 13, 200),
+])
+def test_month_grid_year_bounds(client, year, month, status):
+    # month 13 rolls over into the next year
+    for url in ("/calendar/month", "/calendar/month.json"):
+        assert client.get(f"{url}?year={year}&month={month}").status_code == status
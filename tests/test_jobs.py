@@ -0,0 +1,39 @@
+# tests/test_jobs.py
+from datetime import datetime, timedelta
+
+import jobs
+from models import db, ImportJob
+
+
+def test_only_jobs_with_a_lapsed_lease_are_failed(app, client, tmp_path):
+    upload = tmp_path / "job1-a.csv"
+    upload.write_text("date\n")
+    now = datetime.utcnow()
+    lapsed = now - timedelta(seconds=jobs.LEASE_S + 5)
+    with app.app_context():
+        db.session.add_all([
+            ImportJob(kind="attendance_csv", status="running", owner="gone:1", heartbeat_at=lapsed,
+                      created_at=lapsed, upload_path=str(upload), rows_processed=1000),
+            ImportJob(kind="calendar_csv", status="running", owner="gone:1", heartbeat_at=lapsed,
+                      created_at=lapsed, rows_processed=50),
+            # another live worker's jobs, however old
+            ImportJob(kind="attendance_csv", status="queued", owner="other:2", heartbeat_at=now,
+                      created_at=now - timedelta(hours=1)),
+            ImportJob(kind="attendance_csv", status="running", owner="other:2", heartbeat_at=now,
+                      created_at=now - timedelta(hours=1)),
+            # from before leases: no heartbeat, only its age to go on
+            ImportJob(kind="students_csv", status="queued", created_at=lapsed),
+            ImportJob(kind="attendance_csv", status="done", created_at=lapsed),
+        ])
+        db.session.commit()
+
+    assert client.get("/admin/jobs").status_code == 200
+
+    with app.app_context():
+        rows = ImportJob.query.order_by(ImportJob.id).all()
+        assert [j.status for j in rows] == ["failed", "failed", "queued", "running", "failed", "done"]
+        assert "after 1000 rows; rows saved before that are kept" in rows[0].message
+        assert "after 50 rows; nothing was saved" in rows[1].message
+        assert "nothing was saved" in rows[4].message
+        assert rows[0].upload_path is None
+    assert not upload.exists()
@@ -0,0 +1,12 @@
+# tests/test_metrics.py
+from metrics import _percentile
+
+
+def test_percentile_nearest_rank():
+    assert _percentile([], 50) is None
+    assert _percentile([1, 2, 3, 4], 50) == 2
+    assert _percentile([1, 2, 3, 4], 75) == 3
+    assert _percentile([1, 2, 3, 4], 100) == 4
+    assert _percentile([1, 2, 3, 4], 0) == 1
+    assert _percentile(list(range(1, 101)), 95) == 95
+    assert _percentile([7], 99) == 7
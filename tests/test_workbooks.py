@@ -0,0 +1,83 @@
+# tests/test_workbooks.py
+import io
+import json
+from datetime import date
+
+from openpyxl import Workbook, load_workbook
+
+from models import db, Attendance, ImportJob, SchoolYear, Student
+from workbooks import _sheet_title
+
+
+def _import(client, data: bytes):
+    client.post("/admin/attendance/import_csv", data={"file": (io.BytesIO(data), "a.xlsx")},
+                content_type="multipart/form-data")
+    return ImportJob.query.order_by(ImportJob.id.desc()).first()
+
+
+def test_xlsx_export_reimports_without_rejects(app, client):
+    app.config["JOBS_INLINE"] = True
+    with app.app_context():
+        y = SchoolYear(name="2021-22", start_date=date(2021, 9, 1), end_date=date(2022, 6, 14))
+        students = [Student(first_name="Jane", last_name="Doe", current_grade="3"),
+                    Student(first_name="Meili", last_name="Johnson", current_grade="K"),
+                    Student(first_name="Sam", last_name="Lee")]
+        db.session.add_all([y, *students])
+        db.session.flush()
+        for day in (6, 7, 8):
+            for s, status in zip(students, ("Present", "Absent", "Tardy")):
+                db.session.add(Attendance(student_id=s.id, date=date(2021, 10, day), status=status,
+                                          school_year_id=y.id, notes="late bus" if status == "Tardy" else None))
+        db.session.commit()
+
+    resp = client.get("/admin/attendance/export.xlsx?start=2021-09-01&end=2022-06-14")
+    assert resp.status_code == 200
+    assert load_workbook(io.BytesIO(resp.data), read_only=True).sheetnames == [
+        "Summary", "Grade K", "Grade 3", "No grade"]
+
+    with app.app_context():
+        before = sorted((a.student_id, a.date, a.status, a.notes) for a in Attendance.query)
+        job = _import(client, resp.data)
+        assert job.status == "done", job.message
+        assert (job.created, job.updated, job.skipped) == (0, 9, 0)
+        assert json.loads(job.rejects) == []
+        assert sorted((a.student_id, a.date, a.status, a.notes) for a in Attendance.query) == before
+
+
+def test_xlsx_import_without_record_sheet_fails_cleanly(app, client):
+    app.config["JOBS_INLINE"] = True
+    wb = Workbook()
+    wb.active.append(["Courageous Learners Academy Attendance"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    with app.app_context():
+        job = _import(client, buf.getvalue())
+        assert job.status == "failed"
+        assert "No sheet has the columns date, last_name, first_name" in job.message
+
+
+def test_xlsx_export_sheet_titles_are_valid_and_distinct(app, client):
+    with app.app_context():
+        for n, grade in enumerate(("K/1", "K\\1", "K:1", "3")):
+            s = Student(first_name=f"S{n}", last_name="Doe", current_grade=grade)
+            db.session.add(s)
+            db.session.flush()
+            db.session.add(Attendance(student_id=s.id, date=date(2021, 10, 6), status="Present"))
+        db.session.commit()
+
+    resp = client.get("/admin/attendance/export.xlsx?start=2021-09-01&end=2022-06-14")
+    assert resp.status_code == 200
+    wb = load_workbook(io.BytesIO(resp.data), read_only=True)
+    assert sorted(wb.sheetnames) == ["Grade 3", "Grade K-1", "Grade K-1 (2)", "Grade K-1 (3)", "Summary"]
+    # each grade keeps its own sheet
+    grades = sorted(row[3] for name in wb.sheetnames[1:]
+                    for row in wb[name].iter_rows(min_row=2, values_only=True))
+    assert grades == ["3", "K/1", "K:1", "K\\1"]
+
+
+def test_sheet_title_truncates_before_deduping():
+    taken = {"summary"}
+    long = "Grade " + "x" * 40
+    assert _sheet_title(long, taken) == long[:31]
+    assert _sheet_title(long, taken) == long[:27] + " (2)"
+    assert _sheet_title("SUMMARY", taken) == "SUMMARY (2)"
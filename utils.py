@@ -1,7 +1,8 @@
 # utils.py
 from datetime import datetime, date, timedelta
-from flask import Response
+from flask import Response, stream_with_context
 import csv as _csv
+import heapq
 import io as _io
 
 # ---------- CSV helper ----------
@@ -25,6 +26,57 @@ def csv_response(rows, filename, header, title: str | None = None):
     return Response(data, mimetype="text/csv",
                     headers={"Content-Disposition": f"attachment; filename={filename}"})
 
+def csv_stream_response(rows, filename, header, title: str | None = None, flush_every: int = 500):
+    """Like csv_response, but sends the CSV as it is produced.
+    rows is consumed lazily (e.g. a yield_per query), so memory stays flat and
+    the first bytes go out before the last row is read. The generator keeps the
+    request/app context alive, so rows may come from the DB session.
+    """
+    def generate():
+        sio = _io.StringIO()
+        w = _csv.writer(sio)
+        if title:
+            w.writerow([title])
+            w.writerow([])
+        w.writerow(header)
+        n = 0
+        for r in rows:
+            w.writerow(list(r))
+            n += 1
+            if n % flush_every == 0:
+                yield sio.getvalue()
+                sio.seek(0)
+                sio.truncate()
+        yield sio.getvalue()
+        sio.close()
+
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+# ---------- Streaming CSV input ----------
+def iter_csv_dicts(stream, encoding: str = "utf-8-sig"):
+    """csv.DictReader rows from a binary stream (an upload or a file opened "rb").
+    Bytes are decoded incrementally as the reader asks for lines, so only the
+    current buffer is held in memory; "utf-8-sig" drops a leading BOM.
+    The stream is left open for the caller to close.
+    """
+    text = _io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        yield from _csv.DictReader(text)
+    finally:
+        text.detach()
+
+def batched(rows, size: int):
+    """Yield lists of up to size items from any iterable."""
+    batch = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 # ---------- Date parsing (flexible) ----------
 _DATE_FORMATS = [
     "%Y-%m-%d",  # 2024-08-15
@@ -102,63 +154,228 @@ def calendar_rows_to_ics(rows):
     text = "\r\n".join(lines) + "\r\n"
     return text.encode("utf-8")
 
-def ics_to_calendar_rows(ics_bytes: bytes):
-    """Parse a simple ICS (all-day events). Yield (date, type, description).
-    Recognizes DTSTART, SUMMARY, CATEGORIES. SUMMARY like "Type – Desc" is split.
-    """
-    text = ics_bytes.decode("utf-8", errors="ignore")
-    # Unfold folded lines (RFC 5545)
-    unfolded = []
-    for line in text.splitlines():
-        if (line.startswith(" ") or line.startswith("\t")) and unfolded:
-            unfolded[-1] += line.lstrip()
+# Calendar day types, for mapping CATEGORIES like "Holidays" or "CLOSED"
+CALENDAR_TYPES = ("Regular", "Holiday", "In-service", "Closed")
+# Stop expanding an open-ended RRULE (no COUNT/UNTIL) after this many dates
+# when no window end is given
+ICS_MAX_OCCURRENCES = 1000
+
+_ICS_WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+
+def _ics_lines(source):
+    """Unfolded content lines from ICS bytes or a binary file, one at a time."""
+    if isinstance(source, (bytes, bytearray)):
+        source = _io.BytesIO(source)
+    held = None
+    for raw in source:
+        line = raw.decode("utf-8", errors="ignore").rstrip("\r\n")
+        if line[:1] in (" ", "\t") and held is not None:
+            held += line[1:]  # continuation: drop the single folding whitespace
+            continue
+        if held is not None:
+            yield held
+        held = line
+    if held is not None:
+        yield held
+
+def _ics_date(value: str):
+    """DATE or DATE-TIME value -> date (time part ignored)."""
+    v = value.strip()
+    try:
+        return date(int(v[:4]), int(v[4:6]), int(v[6:8]))
+    except Exception:
+        return None
+
+def _ics_text(value: str) -> str:
+    return (value.replace("\\n", " ").replace("\\N", " ").replace("\\,", ",")
+            .replace("\\;", ";").replace("\\\\", "\\").strip())
+
+def _calendar_type(value: str) -> str:
+    v = value.strip()
+    for t in CALENDAR_TYPES:
+        if v.lower() in (t.lower(), t.lower() + "s"):
+            return t
+    return v
+
+def _month_days(y: int, m: int) -> int:
+    return ((date(y + m // 12, m % 12 + 1, 1)) - date(y, m, 1)).days
+
+def _nth_weekdays(first: date, last: date, byday):
+    """Dates in [first, last] matching BYDAY entries like (None, 0) or (-1, 0)."""
+    out = set()
+    for n, wd in byday:
+        d = first + timedelta(days=(wd - first.weekday()) % 7)
+        hits = []
+        while d <= last:
+            hits.append(d)
+            d += timedelta(days=7)
+        if n is None:
+            out.update(hits)
+        elif -len(hits) <= n - (n > 0) < len(hits):
+            out.add(hits[n - 1 if n > 0 else n])
+    return out
+
+def _rrule_period(freq, y, m, d0, rule):
+    """Candidate dates for one FREQ period, unsorted. d0 is the period's anchor day."""
+    bymonth, bymonthday, byday = rule["BYMONTH"], rule["BYMONTHDAY"], rule["BYDAY"]
+    if freq == "DAILY":
+        out = {d0}
+    elif freq == "WEEKLY":
+        monday = d0 - timedelta(days=d0.weekday())
+        days = [wd for _n, wd in byday] if byday else [rule["dtstart"].weekday()]
+        out = {monday + timedelta(days=wd) for wd in days}
+    else:
+        months = [m] if freq == "MONTHLY" else (bymonth or [rule["dtstart"].month])
+        if freq == "YEARLY" and byday and not bymonth and not bymonthday:
+            # ordinals like 20MO count within the year
+            return _nth_weekdays(date(y, 1, 1), date(y, 12, 31), byday)
+        out = set()
+        for mm in months:
+            n_days = _month_days(y, mm)
+            if bymonthday:
+                days = [md if md > 0 else n_days + md + 1 for md in bymonthday]
+                out.update(date(y, mm, md) for md in days if 1 <= md <= n_days)
+            elif byday:
+                out.update(_nth_weekdays(date(y, mm, 1), date(y, mm, n_days), byday))
+            elif rule["dtstart"].day <= n_days:
+                out.add(date(y, mm, rule["dtstart"].day))
+    if bymonth:
+        out = {d for d in out if d.month in bymonth}
+    if bymonthday and freq in ("DAILY", "WEEKLY"):
+        out = {d for d in out if d.day in bymonthday
+               or d.day - _month_days(d.year, d.month) - 1 in bymonthday}
+    if byday and (freq == "DAILY" or bymonthday):
+        wds = {wd for _n, wd in byday}
+        out = {d for d in out if d.weekday() in wds}
+    return out
+
+def _parse_rrule(value: str, dtstart: date):
+    parts = dict(p.split("=", 1) for p in value.upper().split(";") if "=" in p)
+    byday = []
+    for tok in filter(None, parts.get("BYDAY", "").split(",")):
+        wd = _ICS_WEEKDAYS.get(tok[-2:])
+        if wd is not None:
+            byday.append((int(tok[:-2]) if tok[:-2] not in ("", "+", "-") else None, wd))
+    ints = lambda key: [int(x) for x in parts.get(key, "").split(",") if x.strip().lstrip("+-").isdigit()]
+    return {
+        "FREQ": parts.get("FREQ"),
+        "INTERVAL": max(1, int(parts.get("INTERVAL", 1) or 1)),
+        "COUNT": int(parts["COUNT"]) if parts.get("COUNT", "").isdigit() else None,
+        "UNTIL": _ics_date(parts["UNTIL"]) if "UNTIL" in parts else None,
+        "BYMONTH": ints("BYMONTH"),
+        "BYMONTHDAY": ints("BYMONTHDAY"),
+        "BYDAY": byday,
+        "dtstart": dtstart,
+    }
+
+def _rrule_dates(dtstart: date, rule: dict):
+    """Yield an RRULE's dates in order, lazily, DTSTART first (it counts toward COUNT)."""
+    freq, interval = rule["FREQ"], rule["INTERVAL"]
+    if freq not in ("DAILY", "WEEKLY", "MONTHLY", "YEARLY"):
+        yield dtstart
+        return
+    count, until = rule["COUNT"], rule["UNTIL"]
+    emitted, empty_run, k = 0, 0, 0
+    if not until or dtstart <= until:
+        yield dtstart
+        emitted = 1
+    while (count is None or emitted < count) and empty_run < 1000:
+        if freq == "DAILY":
+            y, m, d0 = None, None, dtstart + timedelta(days=k * interval)
+        elif freq == "WEEKLY":
+            y, m, d0 = None, None, dtstart + timedelta(weeks=k * interval)
+        elif freq == "MONTHLY":
+            mi = dtstart.month - 1 + k * interval
+            y, m = dtstart.year + mi // 12, mi % 12 + 1
+            d0 = date(y, m, 1)
         else:
-            unfolded.append(line)
-
-    cur_date = None
-    cur_type = None
-    cur_desc = ""
-    in_event = False
-
-    for line in unfolded:
-        ls = line.strip()
-        if ls == "BEGIN:VEVENT":
-            cur_date, cur_type, cur_desc = None, None, ""
-            in_event = True
+            y, m = dtstart.year + k * interval, 1
+            d0 = date(y, 1, 1)
+        if y is not None and y > 9998:
+            return
+        k += 1
+        hits = sorted(d for d in _rrule_period(freq, y, m, d0, rule) if d > dtstart)
+        empty_run = 0 if hits else empty_run + 1
+        for d in hits:
+            if until and d > until:
+                return
+            yield d
+            emitted += 1
+            if count is not None and emitted >= count:
+                return
+
+def _event_dates(ev, start, end):
+    """Dates of one VEVENT inside the window, RRULE/RDATE minus EXDATE, in order."""
+    dtstart = ev["dtstart"]
+    if ev["rrule"]:
+        rule = _parse_rrule(ev["rrule"], dtstart)
+        dates = _rrule_dates(dtstart, rule)
+        cap = ICS_MAX_OCCURRENCES if end is None and not (rule["COUNT"] or rule["UNTIL"]) else None
+    else:
+        dates, cap = iter((dtstart,)), None
+    if ev["rdates"]:
+        dates = heapq.merge(dates, sorted(ev["rdates"]))
+    prev, n = None, 0
+    for d in dates:
+        if cap is not None and n >= cap:
+            return
+        n += 1
+        if end and d > end:
+            return
+        if d == prev or d in ev["exdates"] or (start and d < start):
             continue
-        if ls == "END:VEVENT":
-            if cur_date and cur_type:
-                yield (cur_date, cur_type, cur_desc or "")
-            in_event = False
+        prev = d
+        yield d
+
+def _event_type_desc(category, summary):
+    """(type, description) from CATEGORIES and a SUMMARY like "Type – Desc"."""
+    t = _calendar_type(category) if category else None
+    if " – " in summary:
+        maybe_t, desc = summary.split(" – ", 1)
+        return t or _calendar_type(maybe_t), desc.strip()
+    if not t:
+        return summary, ""
+    return t, "" if summary == t else summary
+
+def ics_to_calendar_rows(source, start: date | None = None, end: date | None = None):
+    """Parse all-day events from ICS bytes or a binary file. Yield (date, type, description).
+    Lines are read and unfolded one at a time, and recurring events
+    (RRULE/RDATE/EXDATE) are expanded lazily, so large feeds stream through.
+    Only dates in [start, end] are yielded when a window is given.
+    Type comes from CATEGORIES (mapped onto CALENDAR_TYPES where it matches);
+    SUMMARY like "Type – Desc" is split.
+    """
+    ev = None
+    for line in _ics_lines(source):
+        if line == "BEGIN:VEVENT":
+            ev = {"dtstart": None, "category": None, "summary": "", "rrule": None,
+                  "rdates": [], "exdates": set()}
             continue
-        if not in_event:
+        if ev is None:
             continue
-
-        if ls.startswith("DTSTART"):  # DTSTART;VALUE=DATE:YYYYMMDD or DTSTART:YYYYMMDD
-            parts = ls.split(":", 1)
-            if len(parts) == 2:
-                ymd = parts[1]
-                try:
-                    y, m, d = int(ymd[:4]), int(ymd[4:6]), int(ymd[6:8])
-                    cur_date = date(y, m, d)
-                except Exception:
-                    cur_date = None
+        if line == "END:VEVENT":
+            t, desc = _event_type_desc(ev["category"], ev["summary"])
+            if ev["dtstart"] and t:
+                for d in _event_dates(ev, start, end):
+                    yield (d, t, desc)
+            ev = None
             continue
 
-        if ls.startswith("CATEGORIES:"):
-            cur_type = ls.split(":", 1)[1].strip()
+        head, sep, value = line.partition(":")
+        if not sep:
             continue
-
-        if ls.startswith("SUMMARY:"):
-            val = ls.split(":", 1)[1].strip()
-            if " – " in val:
-                maybe_t, maybe_desc = val.split(" – ", 1)
-                if not cur_type:
-                    cur_type = maybe_t.strip()
-                cur_desc = maybe_desc.strip()
+        name = head.split(";", 1)[0].upper()
+        if name == "DTSTART":
+            ev["dtstart"] = _ics_date(value)
+        elif name == "RRULE":
+            ev["rrule"] = value
+        elif name in ("RDATE", "EXDATE"):
+            dates = [d for d in map(_ics_date, value.split(",")) if d]
+            if name == "RDATE":
+                ev["rdates"].extend(dates)
             else:
-                if not cur_type:
-                    cur_type = val
-                else:
-                    cur_desc = val
-            continue
+                ev["exdates"].update(dates)
+        elif name == "CATEGORIES":
+            ev["category"] = _ics_text(value.split(",")[0])
+        elif name == "SUMMARY":
+            ev["summary"] = _ics_text(value)
@@ -0,0 +1,166 @@
+# workbooks.py
+"""Excel (XLSX) attendance export and import.
+
+The export builds the workbook with openpyxl's write-only mode: every sheet
+streams its rows to a temporary file as they are appended, and the workbook
+itself is written to a temporary file, so memory stays flat however many
+years and students go in. Only the per-student totals for the summary sheet
+are kept, one entry per student.
+
+The import reads, in read-only mode and row by row, every sheet whose first
+row holds the record columns (so the grade sheets of an export, not its
+Summary), and hands dict rows shaped like attendance_template.csv to the same
+importer as the CSV.
+"""
+import re
+import tempfile
+from datetime import date, datetime
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from importers import ImportAborted
+from queries import grade_order
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+NO_GRADE = "No grade"
+RECORD_HEADER = ["date", "last_name", "first_name", "grade", "status", "notes", "year"]
+_BOLD = Font(bold=True)
+# characters Excel won't have in a sheet title (which is also capped at 31)
+_TITLE_BAD = re.compile(r"[\[\]:*?/\\]")
+_TITLE_MAX = 31
+
+
+def _header(ws, values):
+    cells = []
+    for v in values:
+        c = WriteOnlyCell(ws, v)
+        c.font = _BOLD
+        cells.append(c)
+    ws.append(cells)
+
+
+def _sheet_title(label: str, taken: set) -> str:
+    """A valid sheet title for label that isn't in taken (lowercased titles, as
+    Excel compares them); the title is added to taken.
+    """
+    base = _TITLE_BAD.sub("-", label)[:_TITLE_MAX]
+    title, n = base, 1
+    while title.lower() in taken:
+        n += 1
+        suffix = f" ({n})"
+        title = base[:_TITLE_MAX - len(suffix)] + suffix
+    taken.add(title.lower())
+    return title
+
+
+def _pct(present, total):
+    return round(present * 100.0 / total, 1) if total else None
+
+
+def attendance_workbook(rows, title: str):
+    """Write an attendance workbook and return it as an open temporary file.
+    rows: queries.attendance_export-shaped tuples
+        (date, last, first, grade_at_time, current_grade, status, notes, year_name, student_id)
+    in date order. Each record goes on its grade's sheet; a Summary sheet in
+    front holds per-grade and per-student totals.
+    """
+    wb = Workbook(write_only=True)
+    summary = wb.create_sheet("Summary")
+    sheets = {}  # grade label -> worksheet
+    titles = {"summary"}
+    students = {}  # student_id -> [last, first, grades, present, absent, tardy, total]
+    by_grade = {}  # grade -> [student ids, present, absent, tardy, total]
+    first_day = last_day = None
+
+    for d, last, first, gat, cur, status, notes, year_name, sid in rows:
+        grade = gat or cur or ""
+        label = f"Grade {grade}" if grade else NO_GRADE
+        ws = sheets.get(label)
+        if ws is None:
+            ws = sheets[label] = wb.create_sheet(_sheet_title(label, titles))
+            ws.freeze_panes = "A2"
+            _header(ws, RECORD_HEADER)
+        ws.append([d, last, first, grade, status, notes or "", year_name or ""])
+
+        s = students.get(sid)
+        if s is None:
+            s = students[sid] = [last, first, set(), 0, 0, 0, 0]
+        s[2].add(grade)
+        g = by_grade.get(grade)
+        if g is None:
+            g = by_grade[grade] = [set(), 0, 0, 0, 0]
+        g[0].add(sid)
+        for counts, at in ((s, 3), (g, 1)):
+            counts[at] += status == "Present"
+            counts[at + 1] += status == "Absent"
+            counts[at + 2] += status == "Tardy"
+            counts[at + 3] += 1
+        first_day = first_day or d
+        last_day = d
+
+    # grade sheets in grade order, after the summary
+    labels = sorted(sheets, key=lambda lb: grade_order(None if lb == NO_GRADE else lb[6:]))
+    for i, label in enumerate(labels, start=1):
+        current = [ws.title for ws in wb.worksheets].index(sheets[label].title)
+        if current != i:
+            wb.move_sheet(sheets[label].title, i - current)
+
+    heading = WriteOnlyCell(summary, title)
+    heading.font = _BOLD
+    summary.append([heading])
+    summary.append([f"{first_day} to {last_day}" if first_day else "No attendance in range"])
+    summary.append([])
+    _header(summary, ["Grade", "Students", "Present", "Absent", "Tardy", "Total", "%"])
+    for grade in sorted(by_grade, key=grade_order):
+        sids, p, a, t, total = by_grade[grade]
+        summary.append([grade or NO_GRADE, len(sids), p, a, t, total, _pct(p, total)])
+    summary.append([])
+    _header(summary, ["Last name", "First name", "Grade", "Present", "Absent", "Tardy", "Total", "%"])
+    for last, first, grades, p, a, t, total in sorted(students.values(), key=lambda s: (s[0], s[1])):
+        summary.append([last, first, " / ".join(g or "-" for g in sorted(grades, key=grade_order)),
+                        p, a, t, total, _pct(p, total)])
+
+    out = tempfile.TemporaryFile()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
+def _cell_text(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, datetime):
+        return v.date().isoformat()
+    if isinstance(v, date):
+        return v.isoformat()
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))  # grades typed as numbers come back as 3.0
+    return str(v).strip()
+
+
+def iter_xlsx_dicts(path, required=("date", "last_name", "first_name")):
+    """Dict rows (all values as text) from each sheet of an .xlsx file whose
+    first row has the required columns, keyed by that row; other sheets and
+    blank rows are skipped. Each row also gets "sheet" (its sheet's title), so
+    rejects can be found. Read in read-only mode: no sheet is loaded whole.
+    Raises ImportAborted when no sheet has the columns.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        found = False
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = [_cell_text(v).lower() for v in next(rows, ())]
+            if not set(required) <= set(header):
+                continue
+            found = True
+            for values in rows:
+                texts = [_cell_text(v) for v in values]
+                if any(texts):
+                    yield {**dict(zip(header, texts)), "sheet": ws.title}
+        if not found:
+            raise ImportAborted(f"No sheet has the columns {', '.join(required)} in its first row.")
+    finally:
+        wb.close()